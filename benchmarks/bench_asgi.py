@@ -0,0 +1,184 @@
+"""
+Benchmark del modo ASGI del dashboard (dashboard/servidor_asgi.py).
+
+Levanta PostgrestFalso y sirve el dashboard con uvicorn en dos modos:
+
+    wsgi   toda la app Flask detrás del puente WSGI (DASHBOARD_HILOS_WSGI
+           hilos): Flask no sirve /api/eventos, las pestañas sondean
+    asgi   servidor_asgi.app: /api/eventos y /api/resumen en el loop
+
+En cada modo abre --pestanas streams SSE que quedan abiertos, lanza
+--peticiones sondeos a /api/resumen (--concurrencia a la vez) y una página
+HTML, y mide cuánto tarda un evento publicado en llegar a todas las
+pestañas.
+
+Uso:
+    python benchmarks/bench_asgi.py --pestanas 200 --peticiones 1000 --concurrencia 200
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "dashboard")]
+
+import httpx
+
+from falsos import PostgrestFalso, BotApiFalso
+from bench_updates import percentil
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def servir(app_asgi) -> str:
+    import uvicorn
+
+    puerto = puerto_libre()
+    servidor = uvicorn.Server(uvicorn.Config(
+        app_asgi, host="127.0.0.1", port=puerto, log_level="error", limit_concurrency=10000,
+    ))
+    threading.Thread(target=servidor.run, daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{puerto}"
+
+
+async def pestana(http: httpx.AsyncClient, url: str, abiertas: list, recibidos: dict, listo: asyncio.Event):
+    try:
+        async with http.stream("GET", f"{url}/api/eventos", timeout=None) as r:
+            if r.status_code != 200:
+                return
+            abiertas.append(1)
+            async for linea in r.aiter_lines():
+                if linea.startswith("event: cotizacion"):
+                    recibidos["n"] += 1
+                    if recibidos["n"] >= recibidos["esperados"]:
+                        listo.set()
+    except (httpx.HTTPError, asyncio.CancelledError):
+        pass
+
+
+async def medir(url: str, args, bus) -> dict:
+    limites = httpx.Limits(max_connections=args.pestanas + args.concurrencia + 10)
+    async with httpx.AsyncClient(limits=limites, timeout=args.timeout) as http:
+        abiertas, listo = [], asyncio.Event()
+        recibidos = {"n": 0, "esperados": args.pestanas}
+        tareas = [
+            asyncio.create_task(pestana(http, url, abiertas, recibidos, listo))
+            for _ in range(args.pestanas)
+        ]
+        limite = time.monotonic() + args.timeout
+        while (len(abiertas) < args.pestanas and time.monotonic() < limite
+               and not all(t.done() for t in tareas)):
+            await asyncio.sleep(0.05)
+
+        semaforo = asyncio.Semaphore(args.concurrencia)
+        ms, errores = [], 0
+
+        async def sondeo():
+            nonlocal errores
+            async with semaforo:
+                inicio = time.perf_counter()
+                try:
+                    r = await http.get(f"{url}/api/resumen")
+                    r.raise_for_status()
+                    ms.append((time.perf_counter() - inicio) * 1000)
+                except httpx.HTTPError:
+                    errores += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(sondeo() for _ in range(args.peticiones)))
+        segundos = time.perf_counter() - inicio
+
+        try:
+            t = time.perf_counter()
+            pagina = (await http.get(f"{url}/historial")).status_code
+            pagina_ms = (time.perf_counter() - t) * 1000
+        except httpx.HTTPError:
+            pagina, pagina_ms = "timeout", None
+
+        evento_ms = None
+        if abiertas:
+            recibidos["esperados"] = len(abiertas)
+            t = time.perf_counter()
+            bus.publicar_cotizacion({"id": 1, "estado": "Cotizado"})
+            try:
+                await asyncio.wait_for(listo.wait(), timeout=args.timeout)
+                evento_ms = (time.perf_counter() - t) * 1000
+            except asyncio.TimeoutError:
+                pass
+
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    return {
+        "pestanas": len(abiertas), "ok": len(ms), "errores": errores,
+        "por_seg": len(ms) / segundos, "p50": percentil(ms, 50), "p95": percentil(ms, 95),
+        "pagina": pagina, "pagina_ms": pagina_ms,
+        "evento_ms": evento_ms, "recibidos": recibidos["n"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pestanas", type=int, default=100, help="streams SSE abiertos")
+    parser.add_argument("--peticiones", type=int, default=500)
+    parser.add_argument("--concurrencia", type=int, default=100)
+    parser.add_argument("--latencia-db", type=float, default=20, help="ms por petición")
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    db = PostgrestFalso(args.latencia_db)
+    tg = BotApiFalso(5)
+    os.environ.update({
+        "SUPABASE_URL": db.url,
+        "SUPABASE_KEY": "falsa.falsa.falsa",
+        "TELEGRAM_API_URL": tg.url,
+        "BOT_TOKEN": "123:falso",
+        "EVENTOS_LATIDO_SEG": "1",
+    })
+    os.chdir(tempfile.mkdtemp(prefix="bench_asgi_"))
+    with db.lock:
+        for i in range(300):
+            db.insertar("cotizaciones", {
+                "user_id": str(1000 + i), "username": f"u{i % 30}", "estado": "Cotizado",
+                "monto": 100.0, "fecha": "2030-01-01", "pedido_completo": "bench",
+            })
+
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    import servidor_asgi
+
+    modos = {
+        "wsgi": Starlette(
+            routes=[Mount("/", servidor_asgi.puente_wsgi)], lifespan=servidor_asgi.ciclo_de_vida
+        ),
+        "asgi": servidor_asgi.app,
+    }
+    print(f"{args.pestanas} pestañas SSE, {args.peticiones} sondeos ({args.concurrencia} a la vez), "
+          f"db {args.latencia_db} ms, {servidor_asgi.DASHBOARD_HILOS_WSGI} hilos WSGI\n")
+    print(f"{'modo':<6} {'sse':>5} {'ok':>6} {'err':>5} {'por_seg':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'página':>12} {'evento ms':>10}")
+    for modo, app_asgi in modos.items():
+        url = servir(app_asgi)
+        r = asyncio.run(medir(url, args, servidor_asgi.dashboard.bus_eventos))
+        pagina = f"{r['pagina']}" + (f" {r['pagina_ms']:.0f}ms" if r["pagina_ms"] else "")
+        evento = (f"{r['evento_ms']:.1f}" if r["evento_ms"]
+                  else f"{r['recibidos']}/{r['pestanas']}" if r["pestanas"] else "-")
+        print(f"{modo:<6} {r['pestanas']:>5} {r['ok']:>6} {r['errores']:>5} {r['por_seg']:>8.1f} "
+              f"{r['p50']:>8.1f} {r['p95']:>8.1f} {pagina:>12} {evento:>10}")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
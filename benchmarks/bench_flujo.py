@@ -0,0 +1,285 @@
+"""
+Benchmark de punta a punta sin red.
+
+Levanta PostgrestFalso y BotApiFalso (benchmarks/falsos.py), apunta a ellos
+el bot, el dashboard y el cron reales (SUPABASE_URL / TELEGRAM_API_URL) y
+recorre el flujo completo por usuario con la concurrencia indicada:
+
+    cotizacion  usuario: menú, datos del vuelo y foto         (bot)
+    cotizar     admin: /accion/cotizar                        (dashboard)
+    pago        usuario: menú, ID y comprobante               (bot)
+    confirmar   admin: botón "Confirmar Pago" en Telegram     (bot)
+    qr          admin: /accion/enviar_qr con 2 imágenes       (dashboard)
+    entrega_qr  hasta que la cola entrega los 3 pasos del QR  (cola_envios)
+
+Con --cron, al final siembra vuelos cotizados para mañana y corre una vez
+cron_recordatorios.correr(). Reporta por paso: completados, errores,
+throughput y latencias p50/p95/p99; más las peticiones y 429 de los falsos.
+
+Uso:
+    python benchmarks/bench_flujo.py --flujos 100 --concurrencia 20 \\
+        --latencia-db 15 --latencia-tg 60 --prob-429 0.02 --cron 200
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "dashboard")]
+
+from falsos import PostgrestFalso, BotApiFalso
+from bench_updates import percentil
+
+PASOS = ["cotizacion", "cotizar", "pago", "confirmar", "qr", "entrega_qr"]
+
+
+class Medidor:
+    def __init__(self):
+        self.ms = {p: [] for p in PASOS}
+        self.errores = {p: 0 for p in PASOS}
+        self.inicio = time.perf_counter()
+
+    def registrar(self, paso: str, inicio: float, ok: bool):
+        if ok:
+            self.ms[paso].append((time.perf_counter() - inicio) * 1000)
+        else:
+            self.errores[paso] += 1
+
+    def reporte(self, segundos: float):
+        print(f"\n{'paso':<12} {'ok':>5} {'err':>4} {'por_seg':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for p in PASOS:
+            v = self.ms[p]
+            print(
+                f"{p:<12} {len(v):>5} {self.errores[p]:>4} {len(v) / segundos:>8.1f} "
+                f"{percentil(v, 50):>9.1f} {percentil(v, 95):>9.1f} {percentil(v, 99):>9.1f}"
+            )
+
+
+class Simulador:
+    """Conduce al bot con Updates sintéticos y al dashboard con su test client"""
+
+    def __init__(self, bot_mod, dashboard_mod, medidor: Medidor, db: PostgrestFalso):
+        self.bot_mod = bot_mod
+        self.dash = dashboard_mod
+        self.medidor = medidor
+        self.db = db
+        self.app = None
+        self._ids = itertools.count(1)
+        self._fallidos = set()
+
+    async def iniciar(self):
+        self.app = self.bot_mod.construir_app()
+
+        async def al_error(update, context):
+            if update is not None:
+                self._fallidos.add(update.update_id)
+            logging.getLogger("bench").debug("Error en handler: %s", context.error)
+
+        self.app.add_error_handler(al_error)
+        await self.app.initialize()
+        if self.app.post_init:
+            await self.app.post_init(self.app)
+        await self.app.start()
+
+    async def cerrar(self):
+        await self.app.stop()
+        await self.app.shutdown()
+        if self.app.post_shutdown:
+            await self.app.post_shutdown(self.app)
+
+    # --- bot ---
+
+    def _usuario(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": "U", "username": f"u{uid}"}
+
+    async def _procesar(self, datos: dict) -> bool:
+        from telegram import Update
+
+        update = Update.de_json(datos, self.app.bot)
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        return update.update_id not in self._fallidos
+
+    async def mensaje(self, uid: int, texto: str = None, foto: bool = False) -> bool:
+        n = next(self._ids)
+        msg = {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._usuario(uid),
+        }
+        if foto:
+            msg["photo"] = [{"file_id": f"ref-{n}", "file_unique_id": f"r{n}", "width": 800, "height": 800}]
+        else:
+            msg["text"] = texto
+        return await self._procesar({"update_id": n, "message": msg})
+
+    async def boton_admin(self, data: str) -> bool:
+        n = next(self._ids)
+        admin = self.bot_mod.ADMIN_CHAT_ID
+        return await self._procesar({
+            "update_id": n,
+            "callback_query": {
+                "id": str(n),
+                "from": {"id": admin, "is_bot": False, "first_name": "Admin"},
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": n,
+                    "date": int(time.time()),
+                    "chat": {"id": admin, "type": "private"},
+                    "caption": "💰 COMPROBANTE DE PAGO RECIBIDO",
+                },
+            },
+        })
+
+    # --- dashboard ---
+
+    def _post(self, ruta: str, datos: dict) -> bool:
+        with self.dash.app.test_client() as c:
+            r = c.post(ruta, data=datos, content_type="multipart/form-data")
+            with c.session_transaction() as sesion:
+                avisos = sesion.get("_flashes", [])
+        return r.status_code == 302 and all(cat == "success" for cat, _ in avisos)
+
+    async def dashboard(self, ruta: str, datos: dict) -> bool:
+        return await asyncio.to_thread(self._post, ruta, datos)
+
+    async def entregado(self, v_id, timeout: float = 120) -> bool:
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            pasos = await asyncio.to_thread(self.dash.cola_envios.pasos, v_id)
+            if pasos and all(p["estado"] in ("enviado", "fallido", "cancelado") for p in pasos):
+                return all(p["estado"] == "enviado" for p in pasos)
+            await asyncio.sleep(0.05)
+        return False
+
+    # --- flujo ---
+
+    def _vuelo_de(self, uid: int):
+        with self.db.lock:
+            ids = [f["id"] for f in self.db.tabla("cotizaciones") if f.get("user_id") == str(uid)]
+        return ids[-1] if ids else None
+
+    async def flujo(self, uid: int):
+        m = self.medidor
+
+        t = time.perf_counter()
+        ok = await self.mensaje(uid, "📝 Datos de vuelo")
+        ok = await self.mensaje(uid, "CDMX a Cancún el 25-12-2026") and ok
+        ok = await self.mensaje(uid, foto=True) and ok
+        v_id = self._vuelo_de(uid)
+        m.registrar("cotizacion", t, ok and v_id is not None)
+        if v_id is None:
+            return
+
+        t = time.perf_counter()
+        ok = await self.dashboard("/accion/cotizar", {"id": v_id, "monto_total": "1000", "porcentaje": "15"})
+        m.registrar("cotizar", t, ok)
+
+        t = time.perf_counter()
+        ok = await self.mensaje(uid, "📸 Enviar Pago")
+        ok = await self.mensaje(uid, str(v_id)) and ok
+        ok = await self.mensaje(uid, foto=True) and ok
+        m.registrar("pago", t, ok)
+
+        t = time.perf_counter()
+        ok = await self.boton_admin(f"conf_pago_{v_id}")
+        m.registrar("confirmar", t, ok)
+
+        t = time.perf_counter()
+        ok = await self.dashboard("/accion/enviar_qr", {
+            "id": v_id,
+            "fotos": [(io.BytesIO(b"QR-%d-%d" % (v_id, i) * 2000), f"qr{i}.png") for i in range(2)],
+        })
+        m.registrar("qr", t, ok)
+        if ok:
+            m.registrar("entrega_qr", t, await self.entregado(v_id))
+
+
+async def correr_cron(cron_mod, db: PostgrestFalso, n: int):
+    manana = (datetime.utcnow().date() + timedelta(days=1)).isoformat()
+    with db.lock:
+        for i in range(n):
+            db.insertar("cotizaciones", {
+                "user_id": str(900000 + i), "username": f"c{i}", "estado": "Cotizado",
+                "monto": 150.0, "fecha": manana, "pedido_completo": "bench",
+            })
+    inicio = time.perf_counter()
+    resumen = await cron_mod.correr()
+    print(f"\ncron: {n} vuelos en {time.perf_counter() - inicio:.2f}s → {resumen}")
+
+
+async def principal(args):
+    db = PostgrestFalso(args.latencia_db)
+    tg = BotApiFalso(args.latencia_tg, args.prob_429, args.retry_after)
+    os.environ.update({
+        "SUPABASE_URL": db.url,
+        "SUPABASE_KEY": "falsa.falsa.falsa",
+        "TELEGRAM_API_URL": tg.url,
+        "BOT_TOKEN": "123:falso",
+    })
+    # estados.db, envios.db, recordatorios.db... quedan en un directorio temporal
+    os.chdir(tempfile.mkdtemp(prefix="bench_flujo_"))
+    logging.basicConfig(level=logging.WARNING)
+
+    import bot
+    import app_dashboard
+    logging.getLogger().setLevel(logging.WARNING)
+    for ruidoso in ("httpx", "telegram", "bot", "cola_envios"):
+        logging.getLogger(ruidoso).setLevel(logging.CRITICAL)
+
+    medidor = Medidor()
+    sim = Simulador(bot, app_dashboard, medidor, db)
+    await sim.iniciar()
+
+    semaforo = asyncio.Semaphore(args.concurrencia)
+
+    async def con_turno(uid):
+        async with semaforo:
+            await sim.flujo(uid)
+
+    inicio = time.perf_counter()
+    try:
+        await asyncio.gather(*(con_turno(100000 + i) for i in range(args.flujos)))
+    finally:
+        segundos = time.perf_counter() - inicio
+        await sim.cerrar()
+
+    print(f"{args.flujos} flujos, concurrencia {args.concurrencia}, "
+          f"db {args.latencia_db} ms, tg {args.latencia_tg} ms, 429 {args.prob_429:.0%}: "
+          f"{segundos:.2f}s, {args.flujos / segundos:.1f} flujos/s")
+    medidor.reporte(segundos)
+
+    if args.cron:
+        import cron_recordatorios
+        await correr_cron(cron_recordatorios, db, args.cron)
+
+    print("\nPostgREST falso:", json.dumps(db.stats, sort_keys=True))
+    print("Bot API falsa:", json.dumps(tg.stats, sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flujos", type=int, default=50)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--latencia-db", type=float, default=10, help="ms por petición")
+    parser.add_argument("--latencia-tg", type=float, default=50, help="ms por petición")
+    parser.add_argument("--prob-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--cron", type=int, default=0, help="vuelos para una corrida del cron")
+    args = parser.parse_args()
+    asyncio.run(principal(args))
+    # Los hilos del dashboard (cola, sondeo) son daemon
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
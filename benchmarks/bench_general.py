@@ -0,0 +1,246 @@
+"""
+Benchmark de la página General (/) y del costo de sus triggers.
+
+Compara el cálculo anterior (bajar las columnas username y monto y
+agregarlas en Python) con la lectura de resumen_general(), que lee los
+agregados mantenidos por trigger (sql/resumen_general.sql), a medida que
+cotizaciones crece. Dos backends:
+
+    falso     PostgrestFalso (benchmarks/falsos.py) por HTTP con el cliente
+              supabase real: incluye serializar y transferir las filas. El
+              falso mantiene los agregados en cada escritura como el trigger.
+    postgres  --dsn de un Postgres real (psycopg). Carga en un esquema
+              propio sql/cambios_cotizaciones.sql y sql/resumen_general.sql
+              y, además de las lecturas, mide inserts y updates de a una
+              fila con los triggers desactivados y activados.
+
+Con --dsn usar una base desechable: el esquema bench_general se borra y se
+vuelve a crear.
+
+Uso:
+    python benchmarks/bench_general.py --tamanos 1000,10000,100000
+    python benchmarks/bench_general.py --dsn postgresql://postgres@localhost/bench \\
+        --tamanos 1000,100000,1000000 --escrituras 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from falsos import PostgrestFalso
+from bench_updates import percentil
+
+ESTADOS = [
+    "Pendiente",
+    "Cotizado",
+    "Esperando confirmación de pago",
+    "Pago Confirmado",
+    "QR Enviados",
+]
+CONFIRMADOS = ["Pago Confirmado", "QR Enviados"]
+SCRIPTS_SQL = ["cambios_cotizaciones.sql", "resumen_general.sql"]
+
+
+def usuarios_para(n: int) -> int:
+    return max(10, n // 20)
+
+
+def medir(fn, repeticiones: int):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = fn()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tiempos), resultado
+
+
+def imprimir_lecturas(n: int, ms_antes: float, ms_ahora: float):
+    print(f"{n:>10} {ms_antes:>10.2f} {ms_ahora:>10.3f} {ms_antes / ms_ahora:>7.0f}x", end="")
+
+
+# ============================================================================
+# POSTGREST FALSO
+# ============================================================================
+
+def correr_falso(tamanos: list, repeticiones: int):
+    from supabase import create_client
+
+    db = PostgrestFalso(0)
+    supabase = create_client(db.url, "falsa.falsa.falsa")
+    rnd = random.Random(1)
+
+    # Las mismas consultas que hacía general() antes de resumen_general()
+    def antes():
+        usuarios = supabase.table("cotizaciones").select("username").execute().data
+        montos = (
+            supabase.table("cotizaciones").select("monto").in_("estado", CONFIRMADOS).execute().data
+        )
+        return (
+            len({r["username"] for r in usuarios if r.get("username")}),
+            round(sum(float(r["monto"]) for r in montos if r["monto"]), 2),
+        )
+
+    def ahora():
+        r = supabase.rpc("resumen_general", {}).execute().data
+        return r["usuarios_unicos"], round(float(r["total_recaudado"]), 2)
+
+    print(f"{'filas':>10} {'antes ms':>10} {'ahora ms':>10} {'mejora':>8}")
+    actual = 0
+    for n in tamanos:
+        with db.lock:
+            for _ in range(actual, n):
+                db.insertar("cotizaciones", {
+                    "username": f"user{rnd.randrange(usuarios_para(n))}",
+                    "estado": rnd.choice(ESTADOS),
+                    "monto": round(rnd.uniform(50, 900), 2),
+                })
+        actual = n
+        ms_antes, r_antes = medir(antes, repeticiones)
+        ms_ahora, r_ahora = medir(ahora, repeticiones)
+        assert r_antes == r_ahora, (r_antes, r_ahora)
+        imprimir_lecturas(n, ms_antes, ms_ahora)
+        print()
+    db.cerrar()
+
+
+# ============================================================================
+# POSTGRES REAL
+# ============================================================================
+
+ESQUEMA_PG = """
+drop schema if exists bench_general cascade;
+create schema bench_general;
+set search_path = bench_general;
+create table cotizaciones (
+    id         bigserial primary key,
+    user_id    text,
+    username   text,
+    estado     text,
+    monto      numeric,
+    fecha      date,
+    created_at timestamptz not null default now()
+);
+"""
+
+POBLAR_PG = """
+insert into cotizaciones (username, estado, monto, fecha)
+select 'user' || floor(random() * %(usuarios)s)::int,
+       (%(estados)s::text[])[1 + floor(random() * 5)::int],
+       round((50 + random() * 850)::numeric, 2),
+       current_date + floor(random() * 60)::int
+from generate_series(1, %(filas)s)
+"""
+
+
+def correr_postgres(dsn: str, tamanos: list, repeticiones: int, escrituras: int):
+    try:
+        import psycopg
+    except ImportError:
+        sys.exit("--dsn necesita psycopg: pip install 'psycopg[binary]'")
+
+    con = psycopg.connect(dsn, autocommit=True)
+    con.execute(ESQUEMA_PG)
+    scripts = [open(os.path.join(RAIZ, "sql", s), encoding="utf-8").read() for s in SCRIPTS_SQL]
+    for script in scripts:
+        con.execute(script)
+    rnd = random.Random(1)
+
+    def triggers(activos: bool):
+        con.execute(f"alter table cotizaciones {'enable' if activos else 'disable'} trigger user")
+
+    def antes():
+        # PostgREST arma el JSON en la BD (json_agg) y el cliente lo decodifica
+        usuarios = con.execute(
+            "select coalesce(json_agg(t), '[]') from (select username from cotizaciones) t"
+        ).fetchone()[0]
+        montos = con.execute(
+            "select coalesce(json_agg(t), '[]') from"
+            " (select monto from cotizaciones where estado = any(%s)) t",
+            (CONFIRMADOS,),
+        ).fetchone()[0]
+        return (
+            len({r["username"] for r in usuarios if r.get("username")}),
+            round(sum(float(r["monto"]) for r in montos if r["monto"]), 2),
+        )
+
+    def ahora():
+        r = con.execute("select resumen_general()").fetchone()[0]
+        return r["usuarios_unicos"], round(float(r["total_recaudado"]), 2)
+
+    def escribir(n: int) -> dict:
+        """µs p50 por insert y por update de estado, de a una fila por transacción"""
+        tiempos = {"insert": [], "update": []}
+        for _ in range(escrituras):
+            inicio = time.perf_counter()
+            con.execute(
+                "insert into cotizaciones (username, estado, monto) values (%s, %s, %s)",
+                (f"user{rnd.randrange(usuarios_para(n))}", rnd.choice(ESTADOS), 100),
+            )
+            tiempos["insert"].append((time.perf_counter() - inicio) * 1e6)
+            inicio = time.perf_counter()
+            con.execute(
+                "update cotizaciones set estado = %s where id = %s",
+                (rnd.choice(ESTADOS), rnd.randint(1, n)),
+            )
+            tiempos["update"].append((time.perf_counter() - inicio) * 1e6)
+        return {k: percentil(v, 50) for k, v in tiempos.items()}
+
+    print(f"{'filas':>10} {'antes ms':>10} {'ahora ms':>10} {'mejora':>8}"
+          f" {'insert µs':>20} {'update µs':>20}")
+    print(f"{'':>41}" + f" {'sin':>7} {'con':>5} {'extra':>5}" * 2)
+    actual = 0
+    for n in tamanos:
+        # Carga masiva sin triggers y agregados recalculados con la carga
+        # inicial del script, como al instalarlo sobre una tabla existente
+        triggers(False)
+        con.execute(POBLAR_PG, {
+            "usuarios": usuarios_para(n), "estados": ESTADOS, "filas": max(0, n - actual),
+        })
+        triggers(True)
+        con.execute(scripts[-1])
+        con.execute("analyze cotizaciones")
+        actual = n
+
+        ms_antes, r_antes = medir(antes, repeticiones)
+        ms_ahora, r_ahora = medir(ahora, repeticiones)
+        assert r_antes == r_ahora, (r_antes, r_ahora)
+
+        triggers(False)
+        sin_trg = escribir(n)
+        triggers(True)
+        con_trg = escribir(n)
+        # Las escrituras sin triggers dejaron los agregados desfasados
+        con.execute(scripts[-1])
+        actual += 2 * escrituras
+
+        imprimir_lecturas(n, ms_antes, ms_ahora)
+        for op in ("insert", "update"):
+            extra = (con_trg[op] / sin_trg[op] - 1) * 100
+            print(f" {sin_trg[op]:>7.0f} {con_trg[op]:>5.0f} {extra:>+4.0f}%", end="")
+        print()
+
+    con.execute("drop schema bench_general cascade")
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tamanos", default="1000,10000,100000")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--dsn", help="Postgres real; sin esto se usa PostgrestFalso")
+    parser.add_argument("--escrituras", type=int, default=1000,
+                        help="inserts y updates por tamaño y modo (solo con --dsn)")
+    args = parser.parse_args()
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+
+    if args.dsn:
+        correr_postgres(args.dsn, tamanos, args.repeticiones, args.escrituras)
+    else:
+        correr_falso(tamanos, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark de consultas en paralelo dentro de una petición del dashboard.
+
+Levanta PostgrestFalso (benchmarks/falsos.py) con latencia por petición y
+mide las rutas que lanzan varias consultas independientes, primero en
+serie (pool_io = None, como DASHBOARD_HILOS_IO=0) y luego con el pool:
+
+    general        resumen_general() + urgentes del día
+    usuario        resumen_usuarios + página de vuelos
+    resumen        /api/resumen con delta: cambios + borrados + resumen
+    enviar_qr      búsqueda del vuelo + copia de 3 fotos a disco
+
+Con --clientes > 1 varias peticiones llegan a la vez y compiten por el
+mismo pool (acotado por DASHBOARD_HILOS_IO).
+
+Uso:
+    python benchmarks/bench_paralelo.py --peticiones 50 --latencia-db 30 --clientes 4
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "dashboard")]
+
+from falsos import PostgrestFalso, BotApiFalso
+from bench_updates import percentil
+
+FOTO = b"\x89PNG" + os.urandom(256 * 1024)
+
+
+def rutas(v_id: int) -> dict:
+    """nombre -> (método, ruta, datos)"""
+    return {
+        "general": ("GET", "/", None),
+        "usuario": ("GET", "/historial-usuario/ana", None),
+        "resumen": ("GET", "/api/resumen?desde=2000-01-01T00:00:00", None),
+        "enviar_qr": ("POST", "/accion/enviar_qr", lambda: {
+            "id": v_id,
+            "fotos": [(io.BytesIO(FOTO), f"qr{i}.png") for i in range(3)],
+        }),
+    }
+
+
+def peticiones_db(db: PostgrestFalso) -> int:
+    return sum(s.get("peticiones", 0) for s in db.stats.values())
+
+
+def medir(app, metodo: str, ruta: str, datos, n: int, clientes: int) -> list:
+    def una(_):
+        with app.test_client() as c:
+            inicio = time.perf_counter()
+            if metodo == "GET":
+                r = c.get(ruta)
+            else:
+                r = c.post(ruta, data=datos(), content_type="multipart/form-data")
+            ms = (time.perf_counter() - inicio) * 1000
+        assert r.status_code in (200, 302), (ruta, r.status_code)
+        return ms
+
+    with ThreadPoolExecutor(clientes) as pool:
+        return list(pool.map(una, range(n)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peticiones", type=int, default=40)
+    parser.add_argument("--latencia-db", type=float, default=30, help="ms por petición")
+    parser.add_argument("--clientes", type=int, default=1, help="peticiones simultáneas")
+    args = parser.parse_args()
+
+    db = PostgrestFalso(args.latencia_db)
+    tg = BotApiFalso(5)
+    os.environ.update({
+        "SUPABASE_URL": db.url,
+        "SUPABASE_KEY": "falsa.falsa.falsa",
+        "TELEGRAM_API_URL": tg.url,
+        "BOT_TOKEN": "123:falso",
+    })
+    os.chdir(tempfile.mkdtemp(prefix="bench_paralelo_"))
+
+    hoy = date.today()
+    with db.lock:
+        for i in range(200):
+            db.insertar("cotizaciones", {
+                "user_id": str(1000 + i % 20), "username": "ana" if i % 4 == 0 else f"u{i % 20}",
+                "estado": ["Cotizado", "Esperando confirmación de pago", "Pago Confirmado"][i % 3],
+                "monto": 100.0 + i, "fecha": str(hoy + timedelta(days=i % 3)),
+                "pedido_completo": "bench",
+            })
+        v_id = db.tabla("cotizaciones")[0]["id"]
+
+    import app_dashboard
+
+    pool = app_dashboard.pool_io
+    print(f"latencia db {args.latencia_db} ms, {args.peticiones} peticiones, "
+          f"{args.clientes} cliente(s), pool de {app_dashboard.DASHBOARD_HILOS_IO} hilos\n")
+    print(f"{'ruta':<10} {'modo':<9} {'p50 ms':>8} {'p95 ms':>8} {'consultas':>10}")
+    for nombre, (metodo, ruta, datos) in rutas(v_id).items():
+        p50 = {}
+        for modo, pool_modo in (("serie", None), ("paralelo", pool)):
+            app_dashboard.pool_io = pool_modo
+            medir(app_dashboard.app, metodo, ruta, datos, 3, 1)  # calentar conexiones
+            antes = peticiones_db(db)
+            ms = medir(app_dashboard.app, metodo, ruta, datos, args.peticiones, args.clientes)
+            consultas = (peticiones_db(db) - antes) / args.peticiones
+            p50[modo] = percentil(ms, 50)
+            print(f"{nombre:<10} {modo:<9} {p50[modo]:>8.1f} {percentil(ms, 95):>8.1f} {consultas:>10.1f}")
+        print(f"{'':<10} {'mejora':<9} {p50['serie'] / p50['paralelo']:>7.2f}x\n")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark de procesamiento de updates.
+
+Reproduce updates sintéticos de varios usuarios contra el procesador
+secuencial por defecto y contra ProcesadorPorUsuario, simulando la latencia
+de Supabase/Telegram en cada handler. Reporta updates/s y latencias p50/p99,
+y verifica que el orden por usuario se respete.
+
+Uso:
+    python benchmarks/bench_updates.py --usuarios 200 --updates 2000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update, Message, Chat, User
+from telegram.ext import SimpleUpdateProcessor
+
+from procesador_updates import ProcesadorPorUsuario
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    idx = min(len(orden) - 1, int(round(p / 100 * (len(orden) - 1))))
+    return orden[idx]
+
+
+def crear_updates(n_usuarios, n_updates, semilla=1):
+    rnd = random.Random(semilla)
+    ahora = datetime.now()
+    updates = []
+    for i in range(n_updates):
+        uid = 1000 + rnd.randrange(n_usuarios)
+        user = User(id=uid, first_name="bench", is_bot=False)
+        msg = Message(
+            message_id=i,
+            date=ahora,
+            chat=Chat(id=uid, type="private"),
+            from_user=user,
+            text=f"msg {i}",
+        )
+        updates.append(Update(update_id=i, message=msg))
+    return updates
+
+
+async def correr(procesador, updates, latencia_ms, jitter_ms):
+    rnd = random.Random(2)
+    vistos = {}
+    fuera_de_orden = 0
+    latencias = []
+
+    async def handler(update, encolado):
+        nonlocal fuera_de_orden
+        uid = update.effective_user.id
+        if update.update_id < vistos.get(uid, -1):
+            fuera_de_orden += 1
+        vistos[uid] = update.update_id
+        await asyncio.sleep((latencia_ms + rnd.uniform(0, jitter_ms)) / 1000)
+        latencias.append((time.perf_counter() - encolado) * 1000)
+
+    inicio = time.perf_counter()
+    async with procesador:
+        tareas = [
+            asyncio.create_task(
+                procesador.process_update(u, handler(u, time.perf_counter()))
+            )
+            for u in updates
+        ]
+        await asyncio.gather(*tareas)
+    total = time.perf_counter() - inicio
+
+    return {
+        "updates_s": len(updates) / total,
+        "p50_ms": percentil(latencias, 50),
+        "p99_ms": percentil(latencias, 99),
+        "fuera_de_orden": fuera_de_orden,
+        "total_s": total,
+    }
+
+
+def imprimir(nombre, r):
+    print(
+        f"{nombre:<24} {r['updates_s']:>10.1f} upd/s   "
+        f"p50 {r['p50_ms']:>9.1f} ms   p99 {r['p99_ms']:>9.1f} ms   "
+        f"fuera de orden: {r['fuera_de_orden']}   ({r['total_s']:.2f}s)"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--usuarios", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--latencia-ms", type=float, default=40)
+    parser.add_argument("--jitter-ms", type=float, default=40)
+    parser.add_argument("--sin-secuencial", action="store_true",
+                        help="omite la corrida secuencial (lenta con muchos updates)")
+    args = parser.parse_args()
+
+    updates = crear_updates(args.usuarios, args.updates)
+    print(
+        f"{args.updates} updates, {args.usuarios} usuarios, "
+        f"latencia simulada {args.latencia_ms}+{args.jitter_ms} ms\n"
+    )
+
+    if not args.sin_secuencial:
+        r = await correr(SimpleUpdateProcessor(1), updates, args.latencia_ms, args.jitter_ms)
+        imprimir("secuencial", r)
+
+    r = await correr(
+        ProcesadorPorUsuario(args.concurrencia), updates, args.latencia_ms, args.jitter_ms
+    )
+    imprimir(f"por usuario (x{args.concurrencia})", r)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
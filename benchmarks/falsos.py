@@ -0,0 +1,535 @@
+"""
+Servicios falsos para correr bot, dashboard y cron sin red.
+
+- PostgrestFalso: subconjunto de PostgREST en memoria (/rest/v1/<tabla> y
+  /rest/v1/rpc/<funcion>) con los filtros, orden, límites, upsert y
+  .single() que usa el código, más los triggers y RPC de sql/.
+- BotApiFalso: Bot API de Telegram (/bot<token>/<metodo>) que responde
+  mensajes plausibles, con latencia configurable e inyección de 429.
+
+Ambos corren en hilos con ThreadingHTTPServer y guardan contadores por
+endpoint. Para apuntar los procesos reales a ellos:
+
+    python benchmarks/falsos.py --latencia-db 20 --latencia-tg 80 --prob-429 0.02
+    # e imprime SUPABASE_URL / TELEGRAM_API_URL para exportar
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ESTADOS_PAGADOS = ("Pago Confirmado", "QR Enviados")
+
+
+def ahora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _dormir(ms: float):
+    if ms > 0:
+        time.sleep(random.uniform(0.5, 1.5) * ms / 1000)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # El backlog por defecto (5) hace que con decenas de clientes a la vez
+    # se pierdan conexiones y el cliente reintente el SYN (~1 s)
+    request_queue_size = 1024
+
+
+class _Servidor:
+    """ThreadingHTTPServer en un hilo daemon, con HTTP/1.1 keep-alive"""
+
+    def __init__(self, manejador, puerto: int = 0):
+        manejador.protocol_version = "HTTP/1.1"
+        manejador.servicio = self
+        self.httpd = _HTTPServer(("127.0.0.1", puerto), manejador)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.stats = {}
+        self._lock_stats = threading.Lock()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def contar(self, clave: str, campo: str = "peticiones"):
+        with self._lock_stats:
+            s = self.stats.setdefault(clave, {})
+            s[campo] = s.get(campo, 0) + 1
+
+    def cerrar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    servicio = None
+    # Cabeceras y cuerpo salen en dos write(): sin TCP_NODELAY cada respuesta
+    # keep-alive espera ~40 ms al ACK retrasado del cliente
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _cuerpo(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _responder(self, status: int, cuerpo=None, headers: dict = None):
+        datos = b"" if cuerpo is None else json.dumps(cuerpo, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+# ============================================================================
+# POSTGREST FALSO
+# ============================================================================
+
+def _dividir(texto: str, sep: str = ","):
+    """Divide por `sep` fuera de comillas y paréntesis"""
+    partes, actual, nivel, comillas = [], [], 0, False
+    for c in texto:
+        if c == '"':
+            comillas = not comillas
+        elif not comillas and c == "(":
+            nivel += 1
+        elif not comillas and c == ")":
+            nivel -= 1
+        if c == sep and nivel == 0 and not comillas:
+            partes.append("".join(actual))
+            actual = []
+        else:
+            actual.append(c)
+    partes.append("".join(actual))
+    return partes
+
+
+def _sin_comillas(v: str) -> str:
+    return v[1:-1] if len(v) >= 2 and v[0] == v[-1] == '"' else v
+
+
+def _coercer(valor_fila, texto: str):
+    if isinstance(valor_fila, bool):
+        return texto == "true"
+    if isinstance(valor_fila, int):
+        try:
+            return int(texto)
+        except ValueError:
+            return texto
+    if isinstance(valor_fila, float):
+        return float(texto)
+    return texto
+
+
+def _cumple(fila: dict, columna: str, op: str, valor: str) -> bool:
+    negado = op.startswith("not.")
+    if negado:
+        op = op[4:]
+    v = fila.get(columna)
+    if op == "is":
+        r = v is None if valor == "null" else v is (valor == "true")
+    elif op == "in":
+        opciones = [_sin_comillas(x.strip()) for x in _dividir(valor.strip("()"))]
+        r = v is not None and v in [_coercer(v, o) for o in opciones]
+    elif v is None:
+        r = False
+    else:
+        x = _coercer(v, _sin_comillas(valor))
+        if isinstance(v, (int, float)) != isinstance(x, (int, float)):
+            v, x = str(v), str(x)
+        r = {
+            "eq": lambda: v == x, "neq": lambda: v != x,
+            "gt": lambda: v > x, "gte": lambda: v >= x,
+            "lt": lambda: v < x, "lte": lambda: v <= x,
+            "like": lambda: re.fullmatch(str(x).replace("*", ".*"), str(v)) is not None,
+            "ilike": lambda: re.fullmatch(str(x).replace("*", ".*"), str(v), re.I) is not None,
+        }[op]()
+    return not r if negado else r
+
+
+def _condicion(expr: str):
+    """Compila 'col.op.valor', 'and(...)' u 'or(...)' a un predicado"""
+    expr = expr.strip()
+    for logico, combinar in (("and(", all), ("or(", any), ("not.and(", all), ("not.or(", any)):
+        if expr.startswith(logico) and expr.endswith(")"):
+            hijos = [_condicion(p) for p in _dividir(expr[len(logico):-1])]
+            negado = logico.startswith("not.")
+            return lambda f: combinar(h(f) for h in hijos) != negado
+    columna, _, resto = expr.partition(".")
+    op, _, valor = resto.partition(".")
+    if op == "not":
+        op2, _, valor = valor.partition(".")
+        op = f"not.{op2}"
+    return lambda f: _cumple(f, columna, op, valor)
+
+
+class PostgrestFalso(_Servidor):
+    """Tablas en memoria detrás de una API compatible con postgrest-py"""
+
+    def __init__(self, latencia_ms: float = 0, puerto: int = 0):
+        self.latencia_ms = latencia_ms
+        self.tablas = {}
+        self.secuencias = {}
+        # Agregados de sql/resumen_general.sql, mantenidos en cada escritura
+        # como los mantiene el trigger: estado -> [vuelos, monto]
+        self.resumen_por_estado = {}
+        self.resumen_usuarios_vuelos = {}
+        self.lock = threading.Lock()
+        self.vistas = {"resumen_usuarios": self._vista_resumen_usuarios}
+        self.rpcs = {
+            "resumen_general": self._rpc_resumen_general,
+            "marca_cotizaciones": self._rpc_marca_cotizaciones,
+        }
+        super().__init__(_ManejadorPostgrest, puerto)
+
+    def tabla(self, nombre: str) -> list:
+        return self.tablas.setdefault(nombre, [])
+
+    def insertar(self, nombre: str, fila: dict) -> dict:
+        fila = dict(fila)
+        if "id" not in fila and nombre not in ("cotizaciones_borradas",):
+            self.secuencias[nombre] = self.secuencias.get(nombre, 0) + 1
+            fila["id"] = self.secuencias[nombre]
+        if nombre == "cotizaciones":
+            fila.setdefault("created_at", ahora_iso())
+            fila["updated_at"] = ahora_iso()
+            self.resumen_aplicar(fila, 1)
+        self.tabla(nombre).append(fila)
+        return fila
+
+    def resumen_aplicar(self, fila: dict, signo: int):
+        """Equivalente de _resumen_aplicar() (trigger de cotizaciones)"""
+        r = self.resumen_por_estado.setdefault(fila.get("estado") or "", [0, 0.0])
+        r[0] += signo
+        r[1] += signo * float(fila.get("monto") or 0)
+        if fila.get("username"):
+            u = self.resumen_usuarios_vuelos
+            u[fila["username"]] = u.get(fila["username"], 0) + signo
+            if u[fila["username"]] <= 0:
+                del u[fila["username"]]
+
+    # --- vistas y funciones de sql/ ---
+
+    def _vista_resumen_usuarios(self) -> list:
+        por_usuario = {}
+        for f in self.tabla("cotizaciones"):
+            if not f.get("username"):
+                continue
+            r = por_usuario.setdefault(f["username"], {
+                "username": f["username"], "vuelos": 0, "pagados": 0,
+                "total_pagado": 0.0, "ultima_actividad": None,
+            })
+            r["vuelos"] += 1
+            if f.get("estado") in ESTADOS_PAGADOS:
+                r["pagados"] += 1
+                r["total_pagado"] += float(f.get("monto") or 0)
+            r["ultima_actividad"] = max(r["ultima_actividad"] or "", f.get("updated_at") or "")
+        return list(por_usuario.values())
+
+    def _rpc_resumen_general(self, _args) -> dict:
+        # Lee los agregados, no la tabla: su costo no crece con cotizaciones
+        return {
+            "usuarios_unicos": len(self.resumen_usuarios_vuelos),
+            "total_recaudado": sum(
+                r[1] for e, r in self.resumen_por_estado.items() if e in ESTADOS_PAGADOS
+            ),
+            "por_estado": {e: r[0] for e, r in self.resumen_por_estado.items() if r[0] > 0},
+        }
+
+    def _rpc_marca_cotizaciones(self, _args):
+        marcas = [f["updated_at"] for f in self.tabla("cotizaciones")]
+        marcas += [f["borrado_en"] for f in self.tabla("cotizaciones_borradas")]
+        return max(marcas) if marcas else None
+
+
+class _ManejadorPostgrest(_Manejador):
+
+    def _peticion(self):
+        partes = urlsplit(self.path)
+        ruta = partes.path
+        if not ruta.startswith("/rest/v1/"):
+            return None, None
+        return ruta[len("/rest/v1/"):], parse_qsl(partes.query, keep_blank_values=True)
+
+    def _filtrar(self, filas: list, params: list) -> list:
+        reservados = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+        condiciones = []
+        for k, v in params:
+            if k in reservados:
+                continue
+            if k in ("or", "and", "not.or", "not.and"):
+                condiciones.append(_condicion(f"{k}{v}"))
+            else:
+                condiciones.append(_condicion(f"{k}.{v}"))
+        return [f for f in filas if all(c(f) for c in condiciones)]
+
+    @staticmethod
+    def _ordenar(filas: list, orden: str) -> list:
+        for criterio in reversed(orden.split(",")):
+            col, *mods = criterio.strip().split(".")
+            desc = "desc" in mods
+            presentes = [f for f in filas if f.get(col) is not None]
+            nulos = [f for f in filas if f.get(col) is None]
+            presentes.sort(key=lambda f: f[col], reverse=desc)
+            filas = nulos + presentes if desc else presentes + nulos
+        return filas
+
+    @staticmethod
+    def _proyectar(filas: list, select: str) -> list:
+        if not select or select.strip() == "*":
+            return [dict(f) for f in filas]
+        cols = [c.strip() for c in select.split(",")]
+        return [{c: f.get(c) for c in cols} for f in filas]
+
+    def _salida(self, filas: list, params: list, status: int = 200):
+        dic = dict(params)
+        if "select" in dic or self.command == "GET":
+            filas = self._proyectar(filas, dic.get("select", "*"))
+        if "application/vnd.pgrst.object+json" in (self.headers.get("Accept") or ""):
+            if len(filas) != 1:
+                return self._responder(406, {
+                    "code": "PGRST116",
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                    "details": f"The result contains {len(filas)} rows", "hint": None,
+                })
+            return self._responder(status, filas[0])
+        if "return=minimal" in (self.headers.get("Prefer") or ""):
+            return self._responder(204 if status == 200 else status, None)
+        rango = f"0-{len(filas) - 1}/*" if filas else "*/0"
+        return self._responder(status, filas, {"Content-Range": rango})
+
+    def _inicio(self, metodo: str):
+        servicio = self.servicio
+        tabla, params = self._peticion()
+        if tabla is None:
+            self._responder(404, {"message": "ruta desconocida"})
+            return None, None, None
+        servicio.contar(f"{metodo} {tabla}")
+        _dormir(servicio.latencia_ms)
+        return servicio, tabla, params
+
+    def do_GET(self):
+        servicio, tabla, params = self._inicio("GET")
+        if servicio is None:
+            return
+        dic = dict(params)
+        with servicio.lock:
+            vista = servicio.vistas.get(tabla)
+            filas = vista() if vista else list(servicio.tabla(tabla))
+            filas = self._filtrar(filas, params)
+            if "order" in dic:
+                filas = self._ordenar(filas, dic["order"])
+            offset = int(dic.get("offset", 0))
+            if "limit" in dic:
+                filas = filas[offset:offset + int(dic["limit"])]
+            elif offset:
+                filas = filas[offset:]
+            filas = [dict(f) for f in filas]
+        self._salida(filas, params)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        servicio, tabla, params = self._inicio("POST")
+        if servicio is None:
+            return
+        cuerpo = json.loads(self._cuerpo() or b"null")
+        if tabla.startswith("rpc/"):
+            fn = servicio.rpcs.get(tabla[4:])
+            if fn is None:
+                return self._responder(404, {"code": "PGRST202", "message": f"función {tabla[4:]}"})
+            with servicio.lock:
+                return self._responder(200, fn(cuerpo or {}))
+
+        filas_nuevas = cuerpo if isinstance(cuerpo, list) else [cuerpo]
+        prefer = self.headers.get("Prefer") or ""
+        conflicto = [c.strip() for c in dict(params).get("on_conflict", "").split(",") if c.strip()]
+        if not conflicto and "resolution=" in prefer:
+            conflicto = ["id"]
+        salida = []
+        with servicio.lock:
+            filas = servicio.tabla(tabla)
+            for nueva in filas_nuevas:
+                existente = None
+                if conflicto:
+                    existente = next(
+                        (f for f in filas if all(str(f.get(c)) == str(nueva.get(c)) for c in conflicto)),
+                        None,
+                    )
+                if existente is not None:
+                    if "resolution=ignore-duplicates" in prefer:
+                        continue
+                    if tabla == "cotizaciones":
+                        servicio.resumen_aplicar(existente, -1)
+                    existente.update(nueva)
+                    if tabla == "cotizaciones":
+                        servicio.resumen_aplicar(existente, 1)
+                    salida.append(dict(existente))
+                else:
+                    salida.append(dict(servicio.insertar(tabla, nueva)))
+        self._salida(salida, params, 201)
+
+    def do_PATCH(self):
+        servicio, tabla, params = self._inicio("PATCH")
+        if servicio is None:
+            return
+        cambios = json.loads(self._cuerpo() or b"{}")
+        with servicio.lock:
+            filas = self._filtrar(servicio.tabla(tabla), params)
+            for f in filas:
+                if tabla == "cotizaciones":
+                    servicio.resumen_aplicar(f, -1)
+                f.update(cambios)
+                if tabla == "cotizaciones":
+                    f["updated_at"] = ahora_iso()
+                    servicio.resumen_aplicar(f, 1)
+            filas = [dict(f) for f in filas]
+        self._salida(filas, params)
+
+    def do_DELETE(self):
+        servicio, tabla, params = self._inicio("DELETE")
+        if servicio is None:
+            return
+        self._cuerpo()  # el cliente sync manda "{}": dejarlo en el socket rompe el keep-alive
+        with servicio.lock:
+            borrar = self._filtrar(servicio.tabla(tabla), params)
+            ids = {id(f) for f in borrar}
+            servicio.tablas[tabla] = [f for f in servicio.tabla(tabla) if id(f) not in ids]
+            if tabla == "cotizaciones":
+                for f in borrar:
+                    servicio.resumen_aplicar(f, -1)
+                    servicio.tabla("cotizaciones_borradas").append(
+                        {"id": f["id"], "borrado_en": ahora_iso()}
+                    )
+            borrar = [dict(f) for f in borrar]
+        self._salida(borrar, params)
+
+
+# ============================================================================
+# BOT API FALSA
+# ============================================================================
+
+class BotApiFalso(_Servidor):
+    """Bot API con latencia y 429 aleatorios (nunca en getMe)"""
+
+    def __init__(self, latencia_ms: float = 0, prob_429: float = 0.0,
+                 retry_after: int = 1, puerto: int = 0):
+        self.latencia_ms = latencia_ms
+        self.prob_429 = prob_429
+        self.retry_after = retry_after
+        self._n = 0
+        self._lock_n = threading.Lock()
+        super().__init__(_ManejadorBotApi, puerto)
+
+    def siguiente(self) -> int:
+        with self._lock_n:
+            self._n += 1
+            return self._n
+
+
+def _parametros(tipo: str, cuerpo: bytes) -> dict:
+    if "json" in tipo:
+        return json.loads(cuerpo or b"{}")
+    if "multipart" in tipo:
+        # Solo los campos de texto; los archivos (con filename=) se ignoran
+        return {
+            m.group(1).decode(): m.group(2).decode(errors="ignore")
+            for m in re.finditer(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', cuerpo, re.S)
+        }
+    return dict(parse_qsl(cuerpo.decode(errors="ignore")))
+
+
+class _ManejadorBotApi(_Manejador):
+
+    def _mensaje(self, params: dict, foto: bool = False) -> dict:
+        servicio = self.servicio
+        n = servicio.siguiente()
+        try:
+            chat_id = int(params.get("chat_id") or 0)
+        except ValueError:
+            chat_id = 0
+        msg = {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        if params.get("caption"):
+            msg["caption"] = params["caption"]
+        if foto:
+            msg["photo"] = [
+                {"file_id": f"foto-{n}-s", "file_unique_id": f"u{n}s", "width": 90, "height": 90},
+                {"file_id": f"foto-{n}", "file_unique_id": f"u{n}", "width": 800, "height": 800},
+            ]
+        return msg
+
+    def do_POST(self):
+        servicio = self.servicio
+        metodo = self.path.rsplit("/", 1)[-1]
+        params = _parametros(self.headers.get("Content-Type") or "", self._cuerpo())
+        servicio.contar(metodo)
+        _dormir(servicio.latencia_ms)
+
+        if metodo != "getMe" and random.random() < servicio.prob_429:
+            servicio.contar(metodo, "429")
+            return self._responder(429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {servicio.retry_after}",
+                "parameters": {"retry_after": servicio.retry_after},
+            })
+
+        if metodo == "getMe":
+            resultado = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot_falso"}
+        elif metodo == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            resultado = [self._mensaje(params, foto=True) for _ in media]
+        elif metodo in ("sendPhoto", "editMessageCaption", "editMessageMedia"):
+            resultado = self._mensaje(params, foto=True)
+        elif metodo.startswith("send") or metodo.startswith("edit"):
+            resultado = self._mensaje(params)
+        else:
+            resultado = True
+        self._responder(200, {"ok": True, "result": resultado})
+
+    do_GET = do_POST
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--puerto-db", type=int, default=54321)
+    parser.add_argument("--puerto-tg", type=int, default=54322)
+    parser.add_argument("--latencia-db", type=float, default=0, help="ms por petición")
+    parser.add_argument("--latencia-tg", type=float, default=0, help="ms por petición")
+    parser.add_argument("--prob-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    db = PostgrestFalso(args.latencia_db, args.puerto_db)
+    tg = BotApiFalso(args.latencia_tg, args.prob_429, args.retry_after, args.puerto_tg)
+    print(f"export SUPABASE_URL={db.url}")
+    print("export SUPABASE_KEY=falsa.falsa.falsa")
+    print(f"export TELEGRAM_API_URL={tg.url}")
+    print("export BOT_TOKEN=123:falso")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps({"db": db.stats, "tg": tg.stats}))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,9 @@ import os
 import threading
 import asyncio
 import re
+import sys
 from datetime import datetime
 
-from flask import Flask
-from supabase import create_client, Client
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
     ReplyKeyboardMarkup, KeyboardButton
@@ -15,31 +14,47 @@ from telegram.ext import (
     ApplicationBuilder, ContextTypes, CommandHandler,
     MessageHandler, CallbackQueryHandler, filters
 )
+from telegram.request import HTTPXRequest
+
+from cotizaciones_repo import CotizacionesRepo, ESTADOS_CERRADOS
+from procesador_updates import ProcesadorPorUsuario
+from persistencia_estados import crear_persistencia, purgar_expirados
+from maquina_estados import MaquinaEstados, TEXTO, FOTO
+from cache_vuelos import CACHE_REALTIME, escuchar_cambios
+from telegram_api import TELEGRAM_API_URL
+from metricas import COLA_PROFUNDIDAD, TIPO_CONTENIDO, exponer, hooks_telegram
+
+# --- 1. SERVIDOR KEEP-ALIVE (solo en modo polling) ---
+# En modo webhook el health check lo sirve servidor_webhook.py
+def run_server():
+    from flask import Flask, Response
 
-# --- 1. SERVIDOR KEEP-ALIVE ---
-app_web = Flask('')
-app_web.secret_key = os.getenv(
-    "FLASK_SECRET_KEY",
-    "bf3145e6595577f099e00638d96e4405b24bb0cd17f6908d34b065943b97dd27"
-)
+    app_web = Flask('')
+    app_web.secret_key = os.getenv(
+        "FLASK_SECRET_KEY",
+        "bf3145e6595577f099e00638d96e4405b24bb0cd17f6908d34b065943b97dd27"
+    )
 
-@app_web.route('/')
-def home():
-    return "Sistema Vuelos Pro - Online 🚀"
+    @app_web.route('/')
+    def home():
+        return "Sistema Vuelos Pro - Online 🚀"
+
+    @app_web.route('/metrics')
+    def metrics():
+        return Response(exponer(), content_type=TIPO_CONTENIDO)
 
-def run_server():
     port = int(os.environ.get("PORT", 10000))
     app_web.run(host='0.0.0.0', port=port)
 
 # --- 2. CONFIGURACIÓN ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # si está definido se usa modo webhook
 ADMIN_CHAT_ID = 7721918273
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SOPORTE_USER = "@TuUsuarioSoporte"
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+repo = CotizacionesRepo()
+persistencia = crear_persistencia(repo)
 logging.basicConfig(level=logging.INFO)
 
 # --- 3. TECLADOS ---
@@ -68,6 +83,15 @@ def extraer_fecha(texto: str):
         return None
 
 # --- 5. HANDLERS USUARIO ---
+# Cada paso de la conversación se registra en la tabla de transiciones;
+# handle_text y handle_media solo despachan según (estado, tipo de entrada).
+# Los botones del menú cancelan el paso en curso, salvo en los estados que
+# cada uno lista en salvo_en (mismo orden que la cadena if/elif anterior).
+
+# Pasos de editar y borrar en los que el texto se toma como dato del paso
+PASOS_EDITAR = ("usr_editando_id", "usr_editando_datos")
+
+maquina = MaquinaEstados()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -76,281 +100,292 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = update.effective_user.id
-    texto = update.message.text
-    udata = context.user_data
-
     # El admin no usa el bot para gestionar, solo el dashboard
-    if uid == ADMIN_CHAT_ID:
+    if update.effective_user.id == ADMIN_CHAT_ID:
         await update.message.reply_text("El panel de administración está en la web.")
         return
 
-    # --- NUEVA COTIZACIÓN ---
-    if texto == "📝 Datos de vuelo":
-        udata.clear()
-        udata["estado"] = "usr_esperando_datos"
-        await update.message.reply_text(
-            "Escribe el Origen, Destino y Fecha de tu vuelo.\n"
-            "Ejemplo: CDMX a Cancún el 25-12-2025."
-        )
-
-    # --- ENVIAR PAGO ---
-    elif texto == "📸 Enviar Pago":
-        udata.clear()
-        udata["estado"] = "usr_esperando_id_pago"
-        await update.message.reply_text(
-            "Escribe el ID del vuelo que vas a pagar."
-        )
+    await maquina.despachar(update, context, TEXTO, por_defecto=usar_menu)
 
-    # --- EDITAR VUELO (PASO 1: ID) ---
-    elif texto == "✏️ Editar vuelo":
-        udata.clear()
-        udata["estado"] = "usr_editando_id"
-        await update.message.reply_text(
-            "Escribe el ID del vuelo que deseas editar."
-        )
+async def usar_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Usa el menú para continuar.",
+        reply_markup=get_user_keyboard(),
+    )
 
-    elif udata.get("estado") == "usr_editando_id":
-        v_id = texto.strip()
-        res = (
-            supabase.table("cotizaciones")
-            .select("id, estado")
-            .eq("id", v_id)
-            .eq("user_id", str(uid))
-            .single()
-            .execute()
-        )
-        if not res.data:
-            await update.message.reply_text(
-                "❌ No se encontró ese ID asociado a tu cuenta."
-            )
-            return
+# --- NUEVA COTIZACIÓN ---
+@maquina.menu("📝 Datos de vuelo", destinos=["usr_esperando_datos"])
+async def menu_datos_vuelo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    udata.clear()
+    udata["estado"] = "usr_esperando_datos"
+    await update.message.reply_text(
+        "Escribe el Origen, Destino y Fecha de tu vuelo.\n"
+        "Ejemplo: CDMX a Cancún el 25-12-2025."
+    )
 
-        if res.data["estado"] in ["Pago Confirmado", "QR Enviados"]:
-            await update.message.reply_text(
-                "Este vuelo ya no se puede editar (ya confirmado o con QR)."
-            )
-            udata.clear()
-            return
+@maquina.en("usr_esperando_datos", destinos=["usr_esperando_foto_vuelo"])
+async def recibir_datos_vuelo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    texto = update.message.text
+    udata["tmp_datos"] = texto
+    fecha = extraer_fecha(texto)
+    udata["tmp_fecha"] = fecha
 
-        udata["edit_vuelo_id"] = v_id
-        udata["estado"] = "usr_editando_datos"
-        await update.message.reply_text(
-            "Escribe los nuevos datos de tu vuelo (origen, destino y fecha).\n"
-            "Ejemplo: CDMX a Cancún el 26-12-2025 06:00 AM."
+    if fecha:
+        msg_fecha = f"✅ Fecha detectada: {fecha}"
+    else:
+        msg_fecha = (
+            "⚠️ No se detectó una fecha válida. "
+            "Escribe la fecha como 25-12-2025."
         )
 
-    elif udata.get("estado") == "usr_editando_datos":
-        v_id = udata.get("edit_vuelo_id")
-        nuevos_datos = texto
-        fecha = extraer_fecha(nuevos_datos)
+    udata["estado"] = "usr_esperando_foto_vuelo"
+    await update.message.reply_text(
+        f"{msg_fecha}\nAhora envía una imagen de referencia del vuelo."
+    )
 
-        supabase.table("cotizaciones").update(
-            {
-                "pedido_completo": nuevos_datos,
-                "fecha": fecha,
-                "estado": "Esperando atención",  # vuelve a cola de revisión
-            }
-        ).eq("id", v_id).execute()
+# --- ENVIAR PAGO ---
+@maquina.menu("📸 Enviar Pago", destinos=["usr_esperando_id_pago"])
+async def menu_enviar_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    udata.clear()
+    udata["estado"] = "usr_esperando_id_pago"
+    await update.message.reply_text(
+        "Escribe el ID del vuelo que vas a pagar."
+    )
 
-        await update.message.reply_text("✅ Tu vuelo ha sido actualizado.")
-        udata.clear()
+@maquina.en("usr_esperando_id_pago", destinos=["usr_esperando_comprobante"])
+async def recibir_id_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    v_id = update.message.text.strip()
+    # El monto lo pone el dashboard (otro proceso): la caché podría no
+    # tenerlo todavía o tener uno anterior
+    vuelo = await repo.obtener_resumen(v_id, fresco=True)
 
-    # --- BORRAR VUELO ---
-    elif texto == "🗑 Borrar vuelo":
-        udata.clear()
-        udata["estado"] = "usr_borrando_id"
-        await update.message.reply_text(
-            "Escribe el ID del vuelo que deseas borrar."
-        )
+    if not vuelo:
+        await update.message.reply_text("❌ ID no encontrado. Verifica tu ID.")
+        return
 
-    elif udata.get("estado") == "usr_borrando_id":
-        v_id = texto.strip()
-        res = (
-            supabase.table("cotizaciones")
-            .select("id, estado")
-            .eq("id", v_id)
-            .eq("user_id", str(uid))
-            .single()
-            .execute()
+    monto = vuelo.get("monto")
+    if not monto:
+        await update.message.reply_text(
+            "⚠️ Ese vuelo aún no tiene monto. Espera a que sea cotizado."
         )
-        if not res.data:
-            await update.message.reply_text(
-                "❌ No se encontró ese ID asociado a tu cuenta."
-            )
-            return
+        return
 
-        if res.data["estado"] in ["Pago Confirmado", "QR Enviados"]:
-            await update.message.reply_text(
-                "No puedes borrar un vuelo ya pagado o con QR enviado."
-            )
-            udata.clear()
-            return
+    udata["pago_vuelo_id"] = v_id
+    udata["estado"] = "usr_esperando_comprobante"
+
+    texto_msj = (
+        f"💳 ID de vuelo: {v_id}\n"
+        f"💰 Monto a pagar: {monto}\n\n"
+        "🏦 Datos de Pago\n"
+        "Banco: BBVA\n"
+        "CLABE: 012180015886058959\n"
+        "Titular: Antonio Garcia\n\n"
+        "Ahora envía la captura del pago como foto."
+    )
+    await update.message.reply_text(texto_msj)
 
-        supabase.table("cotizaciones").delete().eq("id", v_id).execute()
-        await update.message.reply_text("🗑 Vuelo borrado correctamente.")
-        udata.clear()
+# --- EDITAR VUELO ---
+@maquina.menu("✏️ Editar vuelo", destinos=["usr_editando_id"])
+async def menu_editar_vuelo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    udata.clear()
+    udata["estado"] = "usr_editando_id"
+    await update.message.reply_text(
+        "Escribe el ID del vuelo que deseas editar."
+    )
 
-    # --- SOPORTE ---
-    elif texto == "🆘 Soporte":
-        btn = InlineKeyboardMarkup(
-            [[InlineKeyboardButton(
-                "Contactar Soporte 💬",
-                url=f"https://t.me/{SOPORTE_USER.replace('@','')}"
-            )]]
-        )
+@maquina.en("usr_editando_id", destinos=["usr_editando_datos", None])
+async def recibir_id_editar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    v_id = update.message.text.strip()
+    vuelo = await repo.obtener_resumen(v_id)
+    if not vuelo or str(vuelo["user_id"]) != str(update.effective_user.id):
         await update.message.reply_text(
-            "Haz clic abajo para hablar con un agente:",
-            reply_markup=btn,
+            "❌ No se encontró ese ID asociado a tu cuenta."
         )
+        return
 
-    # --- FLUJO EXISTENTE: DATOS DE VUELO ---
-    elif udata.get("estado") == "usr_esperando_datos":
-        udata["tmp_datos"] = texto
-        fecha = extraer_fecha(texto)
-        udata["tmp_fecha"] = fecha
-
-        if fecha:
-            msg_fecha = f"✅ Fecha detectada: {fecha}"
-        else:
-            msg_fecha = (
-                "⚠️ No se detectó una fecha válida. "
-                "Escribe la fecha como 25-12-2025."
-            )
-
-        udata["estado"] = "usr_esperando_foto_vuelo"
+    if vuelo["estado"] in ESTADOS_CERRADOS:
         await update.message.reply_text(
-            f"{msg_fecha}\nAhora envía una imagen de referencia del vuelo."
+            "Este vuelo ya no se puede editar (ya confirmado o con QR)."
         )
+        udata.clear()
+        return
 
-    # --- FLUJO EXISTENTE: PAGO (ID) ---
-    elif udata.get("estado") == "usr_esperando_id_pago":
-        v_id = texto.strip()
-        res = (
-            supabase.table("cotizaciones")
-            .select("monto, estado")
-            .eq("id", v_id)
-            .single()
-            .execute()
+    udata["edit_vuelo_id"] = v_id
+    udata["estado"] = "usr_editando_datos"
+    await update.message.reply_text(
+        "Escribe los nuevos datos de tu vuelo (origen, destino y fecha).\n"
+        "Ejemplo: CDMX a Cancún el 26-12-2025 06:00 AM."
+    )
+
+@maquina.en("usr_editando_datos", destinos=[None])
+async def recibir_datos_editar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    v_id = udata.get("edit_vuelo_id")
+    nuevos_datos = update.message.text
+    fecha = extraer_fecha(nuevos_datos)
+
+    # La condición va en el mismo UPDATE: si el admin confirmó el pago
+    # mientras el usuario escribía, no se pisa el estado
+    filas = await repo.actualizar(
+        v_id,
+        {
+            "pedido_completo": nuevos_datos,
+            "fecha": fecha,
+            "estado": "Esperando atención",  # vuelve a cola de revisión
+        },
+        user_id=update.effective_user.id,
+        estados_excluidos=ESTADOS_CERRADOS,
+    )
+
+    if filas:
+        await update.message.reply_text("✅ Tu vuelo ha sido actualizado.")
+    else:
+        await update.message.reply_text(
+            "Este vuelo ya no se puede editar (ya confirmado o con QR)."
         )
+    udata.clear()
 
-        if not res.data:
-            await update.message.reply_text("❌ ID no encontrado. Verifica tu ID.")
-            return
+# --- BORRAR VUELO ---
+@maquina.menu("🗑 Borrar vuelo", destinos=["usr_borrando_id"], salvo_en=PASOS_EDITAR)
+async def menu_borrar_vuelo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    udata.clear()
+    udata["estado"] = "usr_borrando_id"
+    await update.message.reply_text(
+        "Escribe el ID del vuelo que deseas borrar."
+    )
 
-        monto = res.data.get("monto")
-        if not monto:
-            await update.message.reply_text(
-                "⚠️ Ese vuelo aún no tiene monto. Espera a que sea cotizado."
-            )
-            return
+@maquina.en("usr_borrando_id", destinos=[None])
+async def recibir_id_borrar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    v_id = update.message.text.strip()
+    uid = update.effective_user.id
 
-        udata["pago_vuelo_id"] = v_id
-        udata["estado"] = "usr_esperando_comprobante"
-
-        texto_msj = (
-            f"💳 ID de vuelo: {v_id}\n"
-            f"💰 Monto a pagar: {monto}\n\n"
-            "🏦 Datos de Pago\n"
-            "Banco: BBVA\n"
-            "CLABE: 012180015886058959\n"
-            "Titular: Antonio Garcia\n\n"
-            "Ahora envía la captura del pago como foto."
-        )
-        await update.message.reply_text(texto_msj)
+    borradas = await repo.borrar(v_id, user_id=uid, estados_excluidos=ESTADOS_CERRADOS)
+    if borradas:
+        await update.message.reply_text("🗑 Vuelo borrado correctamente.")
+        udata.clear()
+        return
 
-    else:
+    # No se borró: solo aquí averiguamos el motivo para el mensaje
+    vuelo = await repo.obtener_resumen(v_id)
+    if not vuelo or str(vuelo["user_id"]) != str(uid):
         await update.message.reply_text(
-            "Usa el menú para continuar.",
-            reply_markup=get_user_keyboard(),
+            "❌ No se encontró ese ID asociado a tu cuenta."
         )
+        return
+
+    await update.message.reply_text(
+        "No puedes borrar un vuelo ya pagado o con QR enviado."
+    )
+    udata.clear()
+
+# --- SOPORTE ---
+@maquina.menu("🆘 Soporte", salvo_en=PASOS_EDITAR + ("usr_borrando_id",))
+async def menu_soporte(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    btn = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(
+            "Contactar Soporte 💬",
+            url=f"https://t.me/{SOPORTE_USER.replace('@','')}"
+        )]]
+    )
+    await update.message.reply_text(
+        "Haz clic abajo para hablar con un agente:",
+        reply_markup=btn,
+    )
 
 # --- 6. FOTOS: NUEVA COTIZACIÓN y COMPROBANTE ---
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = update.effective_user.id
-    if uid == ADMIN_CHAT_ID:
+    if update.effective_user.id == ADMIN_CHAT_ID:
         return  # admin no gestiona desde el bot
 
-    udata = context.user_data
     if not update.message.photo:
         return
 
-    fid = update.message.photo[-1].file_id
+    await maquina.despachar(update, context, FOTO)
 
-    # 1) Foto de referencia de la cotización
-    if udata.get("estado") == "usr_esperando_foto_vuelo":
-        fecha = udata.get("tmp_fecha")
-        res = (
-            supabase.table("cotizaciones")
-            .insert(
-                {
-                    "user_id": str(uid),
-                    "username": update.effective_user.username or "SinUser",
-                    "pedido_completo": udata.get("tmp_datos"),
-                    "estado": "Esperando atención",
-                    "monto": None,
-                    "fecha": fecha,
-                }
-            )
-            .execute()
-        )
+# 1) Foto de referencia de la cotización
+@maquina.en("usr_esperando_foto_vuelo", FOTO, destinos=[None])
+async def recibir_foto_vuelo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    uid = update.effective_user.id
+    fid = update.message.photo[-1].file_id
+    fecha = udata.get("tmp_fecha")
+
+    nuevo = await repo.insertar(
+        {
+            "user_id": str(uid),
+            "username": update.effective_user.username or "SinUser",
+            "pedido_completo": udata.get("tmp_datos"),
+            "estado": "Esperando atención",
+            "monto": None,
+            "fecha": fecha,
+        }
+    )
 
-        v_id = res.data[0]["id"]
+    v_id = nuevo["id"]
 
-        await update.message.reply_text(
-            f"✅ Cotización recibida.\n"
-            f"ID de vuelo: {v_id}\n"
-            "Un agente revisará tu solicitud y te enviará el monto a pagar."
-        )
+    await update.message.reply_text(
+        f"✅ Cotización recibida.\n"
+        f"ID de vuelo: {v_id}\n"
+        "Un agente revisará tu solicitud y te enviará el monto a pagar."
+    )
 
-        # Aviso al admin (solo informativo)
-        await context.bot.send_photo(
-            ADMIN_CHAT_ID,
-            fid,
-            caption=(
-                "🔔 NUEVA SOLICITUD DE COTIZACIÓN\n"
-                f"ID: {v_id}\n"
-                f"User: @{update.effective_user.username}\n"
-                f"Info: {udata.get('tmp_datos')}"
-            ),
-        )
+    # Aviso al admin (solo informativo)
+    await context.bot.send_photo(
+        ADMIN_CHAT_ID,
+        fid,
+        caption=(
+            "🔔 NUEVA SOLICITUD DE COTIZACIÓN\n"
+            f"ID: {v_id}\n"
+            f"User: @{update.effective_user.username}\n"
+            f"Info: {udata.get('tmp_datos')}"
+        ),
+    )
 
-        udata.clear()
+    udata.clear()
 
-    # 2) Comprobante de pago (NO crea registros nuevos)
-    elif udata.get("estado") == "usr_esperando_comprobante":
-        v_id = udata.get("pago_vuelo_id")
+# 2) Comprobante de pago (NO crea registros nuevos)
+@maquina.en("usr_esperando_comprobante", FOTO, destinos=[None])
+async def recibir_comprobante(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    udata = context.user_data
+    fid = update.message.photo[-1].file_id
+    v_id = udata.get("pago_vuelo_id")
 
-        supabase.table("cotizaciones").update(
-            {"estado": "Esperando confirmación de pago"}
-        ).eq("id", v_id).execute()
+    await repo.actualizar(v_id, {"estado": "Esperando confirmación de pago"})
 
-        await update.message.reply_text(
-            "✅ Comprobante enviado. Tu pago está en revisión."
-        )
+    await update.message.reply_text(
+        "✅ Comprobante enviado. Tu pago está en revisión."
+    )
 
-        # Botón automático para confirmar pago desde el propio Telegram (admin)
-        btn_confirmar = InlineKeyboardMarkup(
-            [[InlineKeyboardButton(
-                f"Confirmar Pago ID {v_id} ✅",
-                callback_data=f"conf_pago_{v_id}",
-            )]]
-        )
+    # Botón automático para confirmar pago desde el propio Telegram (admin)
+    btn_confirmar = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(
+            f"Confirmar Pago ID {v_id} ✅",
+            callback_data=f"conf_pago_{v_id}",
+        )]]
+    )
 
-        await context.bot.send_photo(
-            ADMIN_CHAT_ID,
-            fid,
-            caption=(
-                "💰 COMPROBANTE DE PAGO RECIBIDO\n"
-                f"ID Vuelo: `{v_id}`\n"
-                f"User: @{update.effective_user.username}"
-            ),
-            reply_markup=btn_confirmar,
-            parse_mode="Markdown",
-        )
+    await context.bot.send_photo(
+        ADMIN_CHAT_ID,
+        fid,
+        caption=(
+            "💰 COMPROBANTE DE PAGO RECIBIDO\n"
+            f"ID Vuelo: `{v_id}`\n"
+            f"User: @{update.effective_user.username}"
+        ),
+        reply_markup=btn_confirmar,
+        parse_mode="Markdown",
+    )
 
-        udata.clear()
+    udata.clear()
 
 # --- 7. CALLBACK SOLO PARA BOTÓN DE TELEGRAM ---
 
@@ -364,18 +399,17 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data.startswith("conf_pago_"):
         v_id = query.data.split("_")[2]
 
-        res = (
-            supabase.table("cotizaciones")
-            .update({"estado": "Pago Confirmado"})
-            .eq("id", v_id)
-            .execute()
+        filas = await repo.actualizar(
+            v_id, {"estado": "Pago Confirmado"}, estados_excluidos=ESTADOS_CERRADOS
         )
 
-        if not res.data:
-            await query.message.reply_text("No se encontró el vuelo.")
+        if not filas:
+            await query.message.reply_text(
+                "No se encontró el vuelo o su pago ya estaba confirmado."
+            )
             return
 
-        user_id = res.data[0]["user_id"]
+        user_id = filas[0]["user_id"]
 
         await context.bot.send_message(
             user_id,
@@ -389,12 +423,69 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- 8. ARRANQUE ---
 
-if __name__ == "__main__":
-    threading.Thread(target=run_server).start()
-
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def iniciar_recursos(application):
+    application.bot_data["tarea_purga"] = asyncio.create_task(
+        purgar_expirados(application, persistencia)
+    )
+    if CACHE_REALTIME:
+        try:
+            application.bot_data["realtime"] = await escuchar_cambios(
+                repo.cache, repo.url, repo.key
+            )
+        except Exception as e:
+            logging.error(f"No se pudo suscribir a Realtime: {e}")
+
+async def cerrar_recursos(application):
+    tarea = application.bot_data.pop("tarea_purga", None)
+    if tarea:
+        tarea.cancel()
+    realtime = application.bot_data.pop("realtime", None)
+    if realtime:
+        await realtime.remove_all_channels()
+    await repo.cerrar()
+    logging.info("Métricas DB: %s", repo.metricas())
+    logging.info("Caché de vuelos: %s", repo.cache.metricas())
+    logging.info("Transiciones: %s", maquina.metricas())
+
+def construir_app():
+    procesador = ProcesadorPorUsuario()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        # Mismo pool que el request por defecto de PTB, con latencia y 429
+        # por método en /metrics (getUpdates usa su propio request, sin medir)
+        .request(HTTPXRequest(
+            connection_pool_size=256,
+            httpx_kwargs={"event_hooks": hooks_telegram()},
+        ))
+        .concurrent_updates(procesador)
+        .persistence(persistencia)
+        .post_init(iniciar_recursos)
+        .post_shutdown(cerrar_recursos)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(callbacks))
     app.add_handler(MessageHandler(filters.PHOTO, handle_media))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    app.run_polling()
+
+    COLA_PROFUNDIDAD.registrar_funcion(procesador.en_cola, cola="bot_updates")
+    COLA_PROFUNDIDAD.registrar_funcion(procesador.usuarios_activos, cola="bot_usuarios_activos")
+    return app
+
+if __name__ == "__main__":
+    # python bot.py --grafo | dot -Tpng > conversacion.png
+    if "--grafo" in sys.argv:
+        print(maquina.grafo_dot())
+        sys.exit(0)
+
+    app = construir_app()
+
+    if WEBHOOK_URL:
+        from servidor_webhook import correr_webhook
+        correr_webhook(app)
+    else:
+        threading.Thread(target=run_server).start()
+        app.run_polling()
@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+# --- 1. CONFIGURACIÓN ---
+CACHE_VUELOS_MAX = int(os.getenv("CACHE_VUELOS_MAX", 5000))
+CACHE_VUELOS_TTL_SEG = float(os.getenv("CACHE_VUELOS_TTL_SEG", 60))
+# Invalida también con los cambios que hace el dashboard (Supabase Realtime)
+CACHE_REALTIME = os.getenv("CACHE_REALTIME", "0") == "1"
+
+# Columnas que guarda la caché: dueño, estado y monto de cada cotización
+COLUMNAS = "id, user_id, estado, monto"
+
+log = logging.getLogger(__name__)
+
+
+# --- 2. CACHÉ LRU CON TTL ---
+
+class CacheVuelos:
+    """LRU con expiración para {user_id, estado, monto} por ID de cotización"""
+
+    def __init__(self, max_items: int = CACHE_VUELOS_MAX, ttl_seg: float = CACHE_VUELOS_TTL_SEG):
+        self.max_items = max_items
+        self.ttl_seg = ttl_seg
+        self._datos = OrderedDict()  # id -> (vence, valor)
+        self.stats = {"hits": 0, "misses": 0, "expirados": 0, "invalidaciones": 0}
+
+    @staticmethod
+    def _clave(v_id) -> str:
+        return str(v_id)
+
+    def get(self, v_id) -> Optional[dict]:
+        clave = self._clave(v_id)
+        item = self._datos.get(clave)
+        if item is None:
+            self.stats["misses"] += 1
+            return None
+        vence, valor = item
+        if vence < time.monotonic():
+            del self._datos[clave]
+            self.stats["expirados"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.stats["hits"] += 1
+        return valor
+
+    def set(self, v_id, fila: dict):
+        clave = self._clave(v_id)
+        valor = {
+            "user_id": fila.get("user_id"),
+            "estado": fila.get("estado"),
+            "monto": fila.get("monto"),
+        }
+        self._datos[clave] = (time.monotonic() + self.ttl_seg, valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_items:
+            self._datos.popitem(last=False)
+
+    def invalidar(self, v_id):
+        if self._datos.pop(self._clave(v_id), None) is not None:
+            self.stats["invalidaciones"] += 1
+
+    def metricas(self) -> dict:
+        consultas = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "tamano": len(self._datos),
+            "hit_rate": round(self.stats["hits"] / consultas, 3) if consultas else 0.0,
+        }
+
+
+# --- 3. FEED DE CAMBIOS (OPCIONAL) ---
+
+async def escuchar_cambios(cache: CacheVuelos, url: str, key: str):
+    """
+    Se suscribe a los cambios de cotizaciones en Supabase Realtime e
+    invalida la caché, para que lo que cambie el dashboard no quede viejo
+    hasta que venza el TTL. Devuelve el cliente para cerrarlo al salir.
+    """
+    from supabase import acreate_client
+
+    cliente = await acreate_client(url, key)
+
+    def al_cambiar(payload):
+        datos = payload.get("data", payload)
+        for registro in (datos.get("record"), datos.get("old_record")):
+            if registro and registro.get("id") is not None:
+                cache.invalidar(registro["id"])
+
+    await (
+        cliente.channel("cache-cotizaciones")
+        .on_postgres_changes("*", schema="public", table="cotizaciones", callback=al_cambiar)
+        .subscribe()
+    )
+    log.info("Caché de vuelos suscrita a Supabase Realtime")
+    return cliente
@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+from typing import Optional
+
+import httpx
+from postgrest import AsyncPostgrestClient
+
+from cache_vuelos import CacheVuelos, COLUMNAS as COLUMNAS_CACHE
+from metricas import hooks_postgrest
+
+# --- 1. CONFIGURACIÓN ---
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# Pool de conexiones keep-alive hacia PostgREST
+DB_MAX_CONEXIONES = int(os.getenv("DB_MAX_CONEXIONES", 20))
+DB_MAX_KEEPALIVE = int(os.getenv("DB_MAX_KEEPALIVE", 10))
+DB_KEEPALIVE_SEG = float(os.getenv("DB_KEEPALIVE_SEG", 30))
+DB_TIMEOUT_SEG = float(os.getenv("DB_TIMEOUT_SEG", 10))
+
+TABLA = "cotizaciones"
+
+# Una vez pagado el vuelo ya no se edita, borra ni reconfirma
+ESTADOS_CERRADOS = ["Pago Confirmado", "QR Enviados"]
+
+log = logging.getLogger(__name__)
+
+
+# --- 2. REPOSITORIO ASÍNCRONO ---
+
+class CotizacionesRepo:
+    """Acceso asíncrono a la tabla cotizaciones con pool de conexiones"""
+
+    def __init__(self, url: str = None, key: str = None, cache: CacheVuelos = None):
+        self.url = url or SUPABASE_URL
+        self.key = key or SUPABASE_KEY
+        self.cache = cache if cache is not None else CacheVuelos()
+        self._cliente: Optional[AsyncPostgrestClient] = None
+        self.stats = {}
+
+    def get_cliente(self) -> AsyncPostgrestClient:
+        """Crea el cliente la primera vez que se usa (ya dentro del loop)"""
+        if self._cliente is None:
+            cliente = AsyncPostgrestClient(
+                f"{self.url}/rest/v1",
+                headers={
+                    "apikey": self.key,
+                    "Authorization": f"Bearer {self.key}",
+                    "Accept": "application/json",
+                    "Content-Type": "application/json",
+                },
+            )
+            # Sustituimos la sesión por una con límites de pool explícitos
+            cliente.session = httpx.AsyncClient(
+                base_url=cliente.session.base_url,
+                headers=cliente.session.headers,
+                timeout=DB_TIMEOUT_SEG,
+                limits=httpx.Limits(
+                    max_connections=DB_MAX_CONEXIONES,
+                    max_keepalive_connections=DB_MAX_KEEPALIVE,
+                    keepalive_expiry=DB_KEEPALIVE_SEG,
+                ),
+                follow_redirects=True,
+                http2=True,
+                event_hooks=hooks_postgrest(asincrono=True),
+            )
+            self._cliente = cliente
+        return self._cliente
+
+    def tabla(self):
+        return self.get_cliente().table(TABLA)
+
+    async def _ejecutar(self, operacion: str, consulta):
+        """Ejecuta la consulta midiendo su latencia"""
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return await consulta.execute()
+        except Exception:
+            error = True
+            raise
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            self._registrar(operacion, ms, error)
+
+    def _registrar(self, operacion: str, ms: float, error: bool):
+        s = self.stats.setdefault(
+            operacion,
+            {"llamadas": 0, "errores": 0, "total_ms": 0.0, "max_ms": 0.0},
+        )
+        s["llamadas"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+        if error:
+            s["errores"] += 1
+
+    def metricas(self) -> dict:
+        """Latencia por operación: llamadas, errores, promedio y máximo"""
+        salida = {}
+        for op, s in self.stats.items():
+            salida[op] = {
+                **s,
+                "prom_ms": round(s["total_ms"] / s["llamadas"], 2) if s["llamadas"] else 0.0,
+            }
+        return salida
+
+    # --- 3. OPERACIONES ---
+
+    async def obtener(self, v_id, columnas: str = "*", user_id=None) -> Optional[dict]:
+        """Devuelve la cotización o None si no existe (o no es del usuario)"""
+        q = self.tabla().select(columnas).eq("id", v_id)
+        if user_id is not None:
+            q = q.eq("user_id", str(user_id))
+        res = await self._ejecutar("obtener", q.limit(1))
+        return res.data[0] if res.data else None
+
+    async def obtener_resumen(self, v_id, fresco: bool = False) -> Optional[dict]:
+        """
+        {user_id, estado, monto} de la cotización, desde la caché si está
+        vigente. Es lo que necesitan los flujos de editar, borrar y pagar
+        para decidir antes de escribir. fresco=True lee de la BD (y
+        refresca la caché) cuando el dato no puede estar atrasado.
+        """
+        resumen = None if fresco else self.cache.get(v_id)
+        if resumen is not None:
+            return resumen
+        fila = await self.obtener(v_id, COLUMNAS_CACHE)
+        if fila is None:
+            return None
+        self.cache.set(v_id, fila)
+        return self.cache.get(v_id)
+
+    async def insertar(self, datos: dict) -> dict:
+        res = await self._ejecutar("insertar", self.tabla().insert(datos))
+        fila = res.data[0]
+        self.cache.set(fila["id"], fila)
+        return fila
+
+    @staticmethod
+    def _condicion(q, v_id, user_id=None, estados_excluidos=None):
+        """Filtros de un UPDATE/DELETE condicional (una sola sentencia)"""
+        q = q.eq("id", v_id)
+        if user_id is not None:
+            q = q.eq("user_id", str(user_id))
+        if estados_excluidos:
+            q = q.not_.in_("estado", estados_excluidos)
+        return q
+
+    async def actualizar(self, v_id, cambios: dict, user_id=None, estados_excluidos=None) -> list:
+        """
+        Actualiza y devuelve las filas afectadas. Con user_id/estados_excluidos
+        la condición va en el mismo UPDATE: lista vacía = no existe, no es del
+        usuario o ya no está en un estado que permita el cambio.
+        """
+        self.cache.invalidar(v_id)
+        q = self._condicion(self.tabla().update(cambios), v_id, user_id, estados_excluidos)
+        res = await self._ejecutar("actualizar", q)
+        for fila in res.data:
+            self.cache.set(fila["id"], fila)
+        return res.data
+
+    async def borrar(self, v_id, user_id=None, estados_excluidos=None) -> list:
+        """Igual que actualizar(): devuelve las filas borradas"""
+        self.cache.invalidar(v_id)
+        q = self._condicion(self.tabla().delete(), v_id, user_id, estados_excluidos)
+        res = await self._ejecutar("borrar", q)
+        return res.data
+
+    async def cerrar(self):
+        """Cierra las conexiones del pool"""
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
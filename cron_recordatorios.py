@@ -1,21 +1,176 @@
 import os
-from datetime import datetime, timedelta
-import requests
+import sys
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
 from supabase import create_client, Client
 
+from telegram_api import TelegramAsync, ErrorTelegram, LimitadorTasa
+from ledger_recordatorios import crear_ledger, LedgerBase
+import metricas
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Envíos simultáneos y tope global por segundo (límite de Telegram ~30/s)
+CRON_CONCURRENCIA = int(os.getenv("CRON_CONCURRENCIA", 20))
+CRON_TG_POR_SEG = float(os.getenv("CRON_TG_POR_SEG", 25))
+CRON_MAX_INTENTOS = int(os.getenv("CRON_MAX_INTENTOS", 3))
+
+# Modo servicio (--servicio): reglas activas y cada cuánto corre cada una
+REGLAS_ACTIVAS = os.getenv("REGLAS_ACTIVAS", "24h,2h,vencido").split(",")
+REGLA_24H_CADA_SEG = int(os.getenv("REGLA_24H_CADA_SEG", 900))
+REGLA_2H_CADA_SEG = int(os.getenv("REGLA_2H_CADA_SEG", 300))
+REGLA_VENCIDO_CADA_SEG = int(os.getenv("REGLA_VENCIDO_CADA_SEG", 3600))
+REGLA_VENCIDO_HORAS = int(os.getenv("REGLA_VENCIDO_HORAS", 48))
+# Corridas siguientes en las que se reintenta un recordatorio fallido
+REGLA_REINTENTOS = int(os.getenv("REGLA_REINTENTOS", 5))
+# Margen sobre la marca de updated_at (reloj del cron vs. el de la BD); los
+# repetidos que trae los descarta el ledger
+REGLA_SOLAPE_SEG = int(os.getenv("REGLA_SOLAPE_SEG", 60))
+
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+metricas.instrumentar_supabase(supabase)
+ledger = crear_ledger(supabase)
+logging.basicConfig(level=logging.INFO)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+log = logging.getLogger("cron_recordatorios")
 
-def enviar_mensaje(chat_id: int, texto: str):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    data = {"chat_id": chat_id, "text": texto}
-    r = requests.post(url, data=data, timeout=10)
-    r.raise_for_status()
+# Sin servidor HTTP: se exportan por textfile/Pushgateway tras cada corrida
+CRON_RECORDATORIOS = metricas.REGISTRO.contador(
+    "cron_recordatorios_total", "Recordatorios por regla y resultado", ("regla", "resultado"),
+)
+CRON_DURACION = metricas.REGISTRO.medidor(
+    "cron_corrida_segundos", "Duración de la última corrida", ("regla",),
+)
+CRON_ULTIMA = metricas.REGISTRO.medidor(
+    "cron_ultima_corrida_timestamp_segundos", "Fin de la última corrida (epoch)", ("regla",),
+)
 
-def main():
+
+def texto_recordatorio(v: dict) -> str:
+    monto = v.get("monto") or "pendiente"
+    fecha = v["fecha"][:10]
+    return (
+        f"🔔 Recordatorio de pago\n\n"
+        f"ID de vuelo: {v['id']}\n"
+        f"Fecha: {fecha}\n"
+        f"Monto a pagar: {monto}\n\n"
+        "Si ya pagaste, envía tu comprobante con el botón "
+        "\"📸 Enviar Pago\" en el menú del bot."
+    )
+
+
+def texto_2h(v: dict) -> str:
+    return (
+        f"✈️ Tu vuelo ID {v['id']} sale pronto y el pago sigue pendiente.\n"
+        f"Monto a pagar: {v.get('monto') or 'pendiente'}\n\n"
+        "Envía tu comprobante con el botón \"📸 Enviar Pago\" para no perder tu lugar."
+    )
+
+
+def texto_vencido(v: dict) -> str:
+    return (
+        f"⏰ Tu cotización ID {v['id']} sigue sin pago.\n"
+        f"Monto a pagar: {v.get('monto') or 'pendiente'}\n\n"
+        "Si aún te interesa el vuelo, envía tu comprobante con el botón "
+        "\"📸 Enviar Pago\"."
+    )
+
+
+async def enviar_recordatorios(
+    tg: TelegramAsync, vuelos: list, ledger: LedgerBase = None, ventana: str = None,
+    generar_texto=texto_recordatorio,
+) -> dict:
+    """
+    Envía los recordatorios en paralelo (máx. CRON_CONCURRENCIA a la vez y
+    CRON_TG_POR_SEG por segundo). El fallo de un destinatario no detiene
+    al resto; los 429 se reintentan tras su retry_after.
+
+    Con ledger, cada envío se confirma en cuanto sale (o se libera si
+    falla) para que una corrida posterior, o la siguiente tras una caída,
+    no lo repita. Los ids que fallaron quedan en
+    resumen["fallidos_ids"].
+    """
+    resumen = {"enviados": 0, "fallidos": 0, "throttled": 0, "total": len(vuelos),
+               "fallidos_ids": []}
+    semaforo = asyncio.Semaphore(CRON_CONCURRENCIA)
+    limitador = LimitadorTasa(CRON_TG_POR_SEG)
+
+    async def enviar_uno(v: dict):
+        async with semaforo:
+            try:
+                chat_id = int(v["user_id"])
+                texto = generar_texto(v)
+            except (TypeError, ValueError, KeyError) as e:
+                log.error(f"Vuelo {v.get('id')}: datos inválidos ({e})")
+                resumen["fallidos"] += 1
+                resumen["fallidos_ids"].append(v.get("id"))
+                return
+
+            enviado = False
+            for intento in range(1, CRON_MAX_INTENTOS + 1):
+                await limitador.esperar()
+                try:
+                    await tg.enviar_mensaje(chat_id, texto)
+                    enviado = True
+                    break
+                except ErrorTelegram as e:
+                    if e.status == 429:
+                        resumen["throttled"] += 1
+                        await asyncio.sleep(e.retry_after or 1)
+                    elif e.reintentable and intento < CRON_MAX_INTENTOS:
+                        await asyncio.sleep(2 ** intento)
+                    else:
+                        log.error(f"Vuelo {v['id']} → {chat_id}: {e}")
+                        break
+
+            if enviado:
+                resumen["enviados"] += 1
+                if ledger:
+                    await asyncio.to_thread(ledger.enviado, ventana, v["id"])
+            else:
+                resumen["fallidos"] += 1
+                resumen["fallidos_ids"].append(v["id"])
+                if ledger:
+                    await asyncio.to_thread(ledger.fallido, ventana, v["id"])
+
+    await asyncio.gather(*(enviar_uno(v) for v in vuelos))
+    return resumen
+
+
+async def reservar_y_enviar(tg: TelegramAsync, vuelos: list, ventana: str, generar_texto) -> dict:
+    """Reserva en el ledger, envía solo lo nuevo y arma el resumen"""
+    inicio = time.perf_counter()
+    nuevos = await asyncio.to_thread(ledger.reservar, ventana, [v["id"] for v in vuelos])
+    pendientes = [v for v in vuelos if str(v["id"]) in nuevos]
+    # "pago:2024-05-01" -> "pago": una serie por regla, no por día
+    regla = ventana.split(":")[0]
+    metricas.COLA_PROFUNDIDAD.set(len(pendientes), cola=f"recordatorios_{regla}")
+
+    resumen = await enviar_recordatorios(tg, pendientes, ledger, ventana, generar_texto)
+    resumen["omitidos"] = len(vuelos) - len(pendientes)
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    for resultado in ("enviados", "fallidos", "throttled", "omitidos"):
+        CRON_RECORDATORIOS.inc(resumen[resultado], regla=regla, resultado=resultado)
+    CRON_DURACION.set(resumen["segundos"], regla=regla)
+    CRON_ULTIMA.set(time.time(), regla=regla)
+    log.info(
+        "Recordatorios [%(ventana)s]: %(total)s total, %(enviados)s enviados, "
+        "%(fallidos)s fallidos, %(throttled)s throttled, %(omitidos)s ya enviados "
+        "en %(segundos)ss",
+        {**resumen, "ventana": ventana},
+    )
+    return resumen
+
+
+# ============================================================================
+# MODO UNA VEZ (cron)
+# ============================================================================
+
+async def correr():
     hoy = datetime.utcnow().date()
     manana = hoy + timedelta(days=1)
 
@@ -30,21 +185,160 @@ def main():
         .data
     )
 
-    for v in vuelos:
-        chat_id = int(v["user_id"])
-        v_id = v["id"]
-        monto = v.get("monto") or "pendiente"
-        fecha = v["fecha"][:10]
-
-        texto = (
-            f"🔔 Recordatorio de pago\n\n"
-            f"ID de vuelo: {v_id}\n"
-            f"Fecha: {fecha}\n"
-            f"Monto a pagar: {monto}\n\n"
-            "Si ya pagaste, envía tu comprobante con el botón "
-            "\"📸 Enviar Pago\" en el menú del bot."
+    # Un recordatorio por vuelo y por día: lo ya enviado hoy (o en curso
+    # en otra corrida) se salta sin tocar la API de Telegram
+    tg = TelegramAsync(BOT_TOKEN, pool=CRON_CONCURRENCIA)
+    try:
+        return await reservar_y_enviar(tg, vuelos, f"pago:{hoy}", texto_recordatorio)
+    finally:
+        await tg.cerrar()
+
+
+# ============================================================================
+# MODO SERVICIO (--servicio)
+# ============================================================================
+
+class Regla:
+    """
+    Regla de recordatorio sobre cotizaciones en estado "Cotizado".
+
+    Cada corrida consulta, dentro de la ventana de la regla, solo lo que
+    pudo cambiar desde la corrida anterior: las filas cuya `columna` entró
+    en la ventana desde la marca de agua, y las que cambiaron (updated_at,
+    mantenido por trigger, ver sql/cambios_cotizaciones.sql) aunque su
+    `columna` ya estuviera dentro; p. ej. una cotización que pasa a
+    "Cotizado" o cuya fecha se edita a una ya cubierta. Las marcas solo
+    acotan la consulta: el ledger (ventana = nombre de la regla) evita
+    repetir envíos, también tras un reinicio, cuando la primera corrida
+    recorre la ventana entera.
+    Las marcas avanzan aunque haya envíos fallidos: esos ids (que el ledger
+    ya liberó) se vuelven a consultar por id en las siguientes
+    REGLA_REINTENTOS corridas.
+
+    - Con `anticipacion`: avisa cuando `columna` (fecha del vuelo) entra en
+      los próximos `anticipacion`.
+    - Con `plazo`: avisa cuando `columna` (created_at) queda más de `plazo`
+      en el pasado, es decir, cotización sin pagar.
+    """
+
+    def __init__(self, nombre, columna, cada_seg, generar_texto,
+                 anticipacion: timedelta = None, plazo: timedelta = None,
+                 ventana_inicial: timedelta = timedelta(days=7)):
+        self.nombre = nombre
+        self.columna = columna
+        self.cada_seg = cada_seg
+        self.generar_texto = generar_texto
+        self.anticipacion = anticipacion
+        self.plazo = plazo
+        self.ventana_inicial = ventana_inicial
+        self.marca = None           # hasta dónde llegó `columna` en la última corrida
+        self.marca_cambios = None   # inicio de la última corrida (para updated_at)
+        # vuelo_id -> corridas de reintento que le quedan
+        self.reintentos = {}
+
+    def rango(self, ahora: datetime):
+        """(inicio de la ventana, marca de `columna`, fin de la ventana)"""
+        if self.anticipacion is not None:
+            hasta = ahora + self.anticipacion
+            inicio = ahora
+        else:
+            hasta = ahora - self.plazo
+            inicio = hasta - self.ventana_inicial
+        desde = max(self.marca, inicio) if self.marca else inicio
+        return inicio, desde, hasta
+
+    def consultar(self, ahora: datetime) -> list:
+        inicio, desde, hasta = self.rango(ahora)
+        consulta = (
+            supabase.table("cotizaciones")
+            .select("id, user_id, fecha, monto, estado")
+            .eq("estado", "Cotizado")
+            .lte(self.columna, hasta.isoformat())
+        )
+        if self.marca_cambios is None:
+            return consulta.gt(self.columna, inicio.isoformat()).execute().data
+        cambios = self.marca_cambios - timedelta(seconds=REGLA_SOLAPE_SEG)
+        col = self.columna
+        return consulta.or_(
+            f'{col}.gt."{desde.isoformat()}",'
+            f'and(updated_at.gt."{cambios.isoformat()}",{col}.gt."{inicio.isoformat()}")'
+        ).execute().data
+
+    def consultar_reintentos(self, ahora: datetime, hasta: datetime) -> list:
+        """Los fallidos de corridas anteriores que siguen pendientes de pago"""
+        consulta = (
+            supabase.table("cotizaciones")
+            .select("id, user_id, fecha, monto, estado")
+            .in_("id", list(self.reintentos))
+            .eq("estado", "Cotizado")
+            .lte(self.columna, hasta.isoformat())
         )
-        enviar_mensaje(chat_id, texto)
+        if self.anticipacion is not None:
+            # Un vuelo que ya salió no necesita recordatorio
+            consulta = consulta.gt(self.columna, ahora.isoformat())
+        return consulta.execute().data
+
+    async def correr(self, tg: TelegramAsync) -> dict:
+        ahora = datetime.now(timezone.utc)
+        _, _, hasta = self.rango(ahora)
+        vuelos = await asyncio.to_thread(self.consultar, ahora)
+        if self.reintentos:
+            nuevos = {v["id"] for v in vuelos}
+            vuelos += [
+                v for v in await asyncio.to_thread(self.consultar_reintentos, ahora, hasta)
+                if v["id"] not in nuevos
+            ]
+        resumen = await reservar_y_enviar(tg, vuelos, self.nombre, self.generar_texto)
+        # Se avanza aunque haya fallidos: quedan para las próximas corridas
+        self.reintentos = {
+            vuelo_id: self.reintentos.get(vuelo_id, REGLA_REINTENTOS + 1) - 1
+            for vuelo_id in resumen["fallidos_ids"]
+            if self.reintentos.get(vuelo_id, REGLA_REINTENTOS + 1) > 1
+        }
+        self.marca, self.marca_cambios = hasta, ahora
+        return resumen
+
+
+REGLAS = {
+    "24h": Regla("24h", "fecha", REGLA_24H_CADA_SEG, texto_recordatorio,
+                 anticipacion=timedelta(hours=24)),
+    # fecha no siempre trae hora: para vuelos solo con día se toma la medianoche
+    "2h": Regla("2h", "fecha", REGLA_2H_CADA_SEG, texto_2h,
+                anticipacion=timedelta(hours=2)),
+    "vencido": Regla("vencido", "created_at", REGLA_VENCIDO_CADA_SEG, texto_vencido,
+                     plazo=timedelta(hours=REGLA_VENCIDO_HORAS)),
+}
+
+
+async def servicio(reglas: list):
+    """Proceso residente: clientes calientes y cada regla en su intervalo"""
+    tg = TelegramAsync(BOT_TOKEN, pool=CRON_CONCURRENCIA)
+    proxima = {r.nombre: 0.0 for r in reglas}
+    log.info("Servicio de recordatorios: %s", ", ".join(r.nombre for r in reglas))
+    try:
+        while True:
+            for r in reglas:
+                if time.monotonic() < proxima[r.nombre]:
+                    continue
+                try:
+                    await r.correr(tg)
+                except Exception as e:
+                    log.error(f"Regla {r.nombre}: {e}")
+                proxima[r.nombre] = time.monotonic() + r.cada_seg
+                await asyncio.to_thread(metricas.exportar_lote, "recordatorios")
+            espera = min(proxima.values()) - time.monotonic()
+            await asyncio.sleep(max(espera, 1))
+    finally:
+        await tg.cerrar()
+
+
+def main():
+    if "--servicio" in sys.argv:
+        reglas = [REGLAS[n.strip()] for n in REGLAS_ACTIVAS if n.strip()]
+        return asyncio.run(servicio(reglas))
+    resumen = asyncio.run(correr())
+    metricas.exportar_lote("recordatorios")
+    return resumen
 
 if __name__ == "__main__":
     main()
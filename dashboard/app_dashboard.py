@@ -1,18 +1,26 @@
 import os
 from datetime import datetime, timedelta
-import requests
 from flask import (
     Flask, render_template, request,
-    redirect, url_for, flash, jsonify
+    redirect, url_for, flash, jsonify, Response, send_from_directory
 )
 from supabase import create_client, Client
-from telegram import Bot, InputMediaPhoto
+from telegram import Bot
 import logging
 logging.getLogger('WDM').setLevel(logging.CRITICAL)
 from urllib.parse import quote
 import asyncio
 import threading
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+# Módulos compartidos con el bot y el cron (telegram_api, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from spam_telegram import SpamTelegram 
+from cola_envios import ColaEnvios, PENDIENTE, ENVIANDO
+from eventos import BusEventos, iniciar_fuente
+from cache_consultas import CacheConsultas
+from perfilado import Perfilador
+import metricas
 
 # ============================================================================
 # CONFIG
@@ -23,10 +31,48 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+metricas.instrumentar_supabase(supabase)
 bot = Bot(token=BOT_TOKEN)
 
+# Notificaciones a usuarios: se encolan y las envía un hilo en segundo plano
+cola_envios = ColaEnvios(BOT_TOKEN)
+cola_envios.iniciar()
+
+# Cambios de cotizaciones para los streams SSE de las pestañas abiertas
+bus_eventos = BusEventos()
+iniciar_fuente(bus_eventos, supabase, SUPABASE_URL, SUPABASE_KEY)
+
+# Páginas de las colas; se invalida con cada /accion/* y con los cambios
+# que llegan por el bus (bot, cron)
+cache_consultas = CacheConsultas()
+bus_eventos.escuchar(lambda tipo, datos: cache_consultas.invalidar())
+
+
+def _profundidad_envios():
+    resumen = cola_envios.resumen()
+    return {f"envios_{e}": resumen.get(e, 0) for e in (PENDIENTE, ENVIANDO)}
+
+
+metricas.COLA_PROFUNDIDAD.registrar_funcion(_profundidad_envios)
+metricas.COLA_PROFUNDIDAD.registrar_funcion(lambda: bus_eventos.suscriptores, cola="sse_suscriptores")
+
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "cambia_esto")
+# Tope por petición: Werkzeug rechaza con 413 antes de leer el cuerpo
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("DASHBOARD_MAX_SUBIDA_MB", 25)) * 1024 * 1024
+
+# Tiempo por fase de cada petición y perfiles de las lentas (DASHBOARD_PERFILADO=1)
+perfilador = Perfilador()
+perfilador.instalar(app)
+perfilador.medir_httpx(supabase.postgrest.session, "db")
+
+# Una vez pagado el vuelo ya no se borra ni se reconfirma
+ESTADOS_CERRADOS = ["Pago Confirmado", "QR Enviados"]
+
+# /api/resumen: filas por respuesta y margen para escrituras que confirman
+# con una marca de tiempo anterior a la última que vio el cliente
+RESUMEN_MAX_FILAS = int(os.getenv("RESUMEN_MAX_FILAS", 500))
+RESUMEN_SOLAPE_SEG = float(os.getenv("RESUMEN_SOLAPE_SEG", 5))
 
 
 # ============================================================================
@@ -39,19 +85,162 @@ def rango_proximos():
     return hoy, hasta
 
 
-def enviar_mensaje(chat_id: int, texto: str):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    data = {"chat_id": chat_id, "text": texto}
-    r = requests.post(url, data=data, timeout=10)
-    r.raise_for_status()
+# Hilos compartidos por todas las peticiones del worker para lanzar a la vez
+# las consultas independientes de una misma petición (0 = en serie)
+DASHBOARD_HILOS_IO = int(os.getenv("DASHBOARD_HILOS_IO", 8))
+pool_io = (
+    ThreadPoolExecutor(DASHBOARD_HILOS_IO, thread_name_prefix="dashboard-io")
+    if DASHBOARD_HILOS_IO > 0 else None
+)
+_hilo_io = threading.local()
+
+
+def en_paralelo(*funciones, fase="db"):
+    """
+    Ejecuta funciones sin argumentos a la vez en pool_io y devuelve sus
+    resultados en el mismo orden: la petición espera a la más lenta, no a
+    la suma. Si alguna falla, se relanza su excepción tras esperar a todas.
+    Las funciones no deben tocar request/g (se ejecutan en otro hilo).
+    """
+    # Desde un hilo del pool se va en serie: esperar al propio pool lo bloquearía
+    if pool_io is None or len(funciones) < 2 or getattr(_hilo_io, "activo", False):
+        return [f() for f in funciones]
+
+    def en_hilo(f):
+        _hilo_io.activo = True
+        try:
+            return f()
+        finally:
+            _hilo_io.activo = False
+
+    # Los hilos del pool no ven la petición: el perfilador cuenta el bloque entero
+    with perfilador.fase(fase):
+        futuros = [pool_io.submit(en_hilo, f) for f in funciones]
+        wait(futuros)
+    return [f.result() for f in futuros]
+
+
+POR_PAGINA = int(os.getenv("DASHBOARD_POR_PAGINA", 50))
+
+
+def pagina_keyset(consulta, cursor=None, limite=POR_PAGINA, columna="created_at",
+                  desc=True, cachear=False):
+    """
+    Una página de `consulta` ordenada por (columna, id), por defecto
+    (created_at, id) descendente. cursor es "valor|id" de la última fila de
+    la página anterior; devuelve (filas, cursor_siguiente o None si no hay más).
+    Con cachear=True la página sale de cache_consultas mientras no cambie nada.
+    """
+    consulta = consulta_keyset(consulta, cursor, limite, columna, desc)
+    if cachear:
+        filas = cache_consultas.obtener(
+            f"{consulta.path}?{consulta.params}", lambda: consulta.execute().data
+        )
+    else:
+        filas = consulta.execute().data
+    return cortar_pagina(filas, limite, columna)
+
+
+class CursorInvalido(ValueError):
+    """?cursor= que no tiene la forma "valor|id"; se responde 400"""
+
+
+def leer_cursor(cursor):
+    """(valor, id) de un cursor "valor|id", o None si no hay cursor"""
+    if not cursor:
+        return None
+    valor, separador, ultimo_id = cursor.rpartition("|")
+    if not separador or not valor or not ultimo_id.isdigit():
+        raise CursorInvalido(cursor)
+    return valor, int(ultimo_id)
 
 
-def enviar_foto(chat_id: int, fileobj, caption: str = ""):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
-    files = {"photo": (fileobj.filename, fileobj.stream, fileobj.mimetype)}
-    data = {"chat_id": chat_id, "caption": caption}
-    r = requests.post(url, data=data, files=files, timeout=20)
-    r.raise_for_status()
+def literal_postgrest(valor: str) -> str:
+    """Valor entre comillas para un filtro or=(...): las comas y paréntesis no cortan"""
+    return '"' + valor.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def consulta_keyset(consulta, cursor, limite, columna="created_at", desc=True):
+    """La consulta de pagina_keyset() sin ejecutar (sirve igual para el cliente async)"""
+    posicion = leer_cursor(cursor)
+    if posicion:
+        valor, ultimo_id = literal_postgrest(posicion[0]), posicion[1]
+        op = "lt" if desc else "gt"
+        consulta = consulta.or_(
+            f"{columna}.{op}.{valor},"
+            f"and({columna}.eq.{valor},id.{op}.{ultimo_id})"
+        )
+    return consulta.order(columna, desc=desc).order("id", desc=desc).limit(limite + 1)
+
+
+def cortar_pagina(filas, limite, columna="created_at"):
+    """(filas de la página, cursor siguiente o None) a partir de limite + 1 filas"""
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, f"{filas[-1][columna]}|{filas[-1]['id']}"
+
+
+COLUMNAS_RESUMEN = "id, username, fecha, monto, estado, created_at, updated_at"
+
+
+def consultas_resumen(db, desde: str):
+    """
+    Consultas del delta de /api/resumen sin ejecutar: (cambios, borrados).
+    db es el cliente sync o el PostgREST async (servidor_asgi). None si
+    `desde` no es una marca ni un cursor de continuación (p. ej. el "0" que
+    se responde con la tabla vacía): el cliente debe recargar entero.
+    """
+    consulta = db.table("cotizaciones").select(COLUMNAS_RESUMEN)
+    try:
+        if "|" in desde:
+            # Continuación de una respuesta truncada: cursor exacto
+            base, cursor = desde.partition("|")[0], desde
+            leer_cursor(cursor)
+            datetime.fromisoformat(base)
+        else:
+            base = (
+                datetime.fromisoformat(desde) - timedelta(seconds=RESUMEN_SOLAPE_SEG)
+            ).isoformat()
+            consulta, cursor = consulta.gt("updated_at", base), None
+    except ValueError:
+        return None
+    cambios = consulta_keyset(
+        consulta, cursor, RESUMEN_MAX_FILAS, columna="updated_at", desc=False
+    )
+    borrados = (
+        db.table("cotizaciones_borradas")
+        .select("id")
+        .gt("borrado_en", base)
+        .order("borrado_en")
+        .limit(RESUMEN_MAX_FILAS + 1)
+    )
+    return cambios, borrados
+
+
+def cuerpo_resumen(marca: str, resumen: dict, filas=(), filas_borrados=(), recargar=False):
+    """(JSON, 200, cabeceras) de /api/resumen a partir de lo ya leído"""
+    etag = f'"{marca}"'
+    cambios, siguiente = cortar_pagina(list(filas), RESUMEN_MAX_FILAS, columna="updated_at")
+    borrados = [r["id"] for r in filas_borrados]
+    hay_mas = False
+    if len(borrados) > RESUMEN_MAX_FILAS:
+        # Demasiados borrados para un delta: mejor recargar desde `marca`
+        cambios, borrados, recargar = [], [], True
+    elif siguiente:
+        marca, hay_mas = siguiente, True
+
+    cabeceras = {"Cache-Control": "no-cache"}
+    if not hay_mas:
+        cabeceras["ETag"] = etag
+    return {
+        "marca": marca,
+        "hay_mas": hay_mas,
+        "recargar": recargar,
+        "cambios": cambios,
+        "borrados": borrados,
+        "resumen": resumen,
+    }, 200, cabeceras
 
 
 # ============================================================================
@@ -381,24 +570,33 @@ def borrar_vuelo():
         flash("Falta ID de vuelo.", "error")
         return redirect(url_for("historial"))
 
+    # Borrado condicional en una sola sentencia (sin carrera con el bot)
     res = (
         supabase.table("cotizaciones")
-        .select("estado")
+        .delete()
         .eq("id", v_id)
-        .single()
+        .not_.in_("estado", ESTADOS_CERRADOS)
         .execute()
     )
-    if not res.data:
-        flash("Vuelo no encontrado.", "error")
+    if res.data:
+        bus_eventos.publicar_cotizacion(borrado_id=res.data[0]["id"])
+        flash("Vuelo borrado correctamente.", "success")
         return redirect(url_for("historial"))
 
-    if res.data["estado"] in ["Pago Confirmado", "QR Enviados"]:
-        flash("No se puede borrar un vuelo ya pagado o con QR.", "error")
-        return redirect(url_for("detalle_vuelo", vuelo_id=v_id))
+    existe = (
+        supabase.table("cotizaciones")
+        .select("id")
+        .eq("id", v_id)
+        .limit(1)
+        .execute()
+        .data
+    )
+    if not existe:
+        flash("Vuelo no encontrado.", "error")
+        return redirect(url_for("historial"))
 
-    supabase.table("cotizaciones").delete().eq("id", v_id).execute()
-    flash("Vuelo borrado correctamente.", "success")
-    return redirect(url_for("historial"))
+    flash("No se puede borrar un vuelo ya pagado o con QR.", "error")
+    return redirect(url_for("detalle_vuelo", vuelo_id=v_id))
 
 
 @app.route("/")
@@ -406,60 +604,92 @@ def general():
     hoy = datetime.utcnow().date()
     manana = hoy + timedelta(days=1)
 
-    res_usuarios = (
-        supabase.table("cotizaciones")
-        .select("username")
-        .execute()
-        .data
-    )
-    usernames = [r["username"] for r in res_usuarios if r.get("username")]
-    usuarios_unicos = len(set(usernames))
-
-    res_total = (
-        supabase.table("cotizaciones")
-        .select("monto")
-        .in_("estado", ["Pago Confirmado", "QR Enviados"])
-        .execute()
-        .data
-    )
-    total_recaudado = sum(float(r["monto"]) for r in res_total if r["monto"])
-
-    urgentes = (
-        supabase.table("cotizaciones")
-        .select("*")
-        .gte("fecha", str(hoy))
-        .lte("fecha", str(manana))
-        .in_("estado", ["Esperando confirmación de pago", "Pago Confirmado"])
-        .order("fecha", desc=False)
-        .order("created_at", desc=True)
-        .execute()
-        .data
+    # Agregados calculados en la BD (ver sql/resumen_general.sql) y los
+    # urgentes del día, las dos consultas a la vez
+    resumen, urgentes = en_paralelo(
+        lambda: supabase.rpc("resumen_general", {}).execute().data or {},
+        lambda: (
+            supabase.table("cotizaciones")
+            .select("*")
+            .gte("fecha", str(hoy))
+            .lte("fecha", str(manana))
+            .in_("estado", ["Esperando confirmación de pago", "Pago Confirmado"])
+            .order("fecha", desc=False)
+            .order("created_at", desc=True)
+            .execute()
+            .data
+        ),
     )
+    usuarios_unicos = resumen.get("usuarios_unicos", 0)
+    total_recaudado = float(resumen.get("total_recaudado") or 0)
+    por_estado = resumen.get("por_estado") or {}
 
     return render_template(
         "general.html",
         usuarios_unicos=usuarios_unicos,
         total_recaudado=total_recaudado,
+        por_estado=por_estado,
         urgentes=urgentes,
         hoy=hoy,
     )
 
 
+@app.route("/api/resumen")
+def api_resumen():
+    """
+    Cambios en cotizaciones desde la marca `desde` (la `marca` de la
+    respuesta anterior). Si nada cambió responde 304 tras una sola consulta
+    a marca_cotizaciones() (ver sql/cambios_cotizaciones.sql). Con más de
+    RESUMEN_MAX_FILAS borrados desde la marca, o con una marca `desde` que
+    no se puede usar, responde recargar: true y el cliente debe volver a
+    pedir todo.
+    """
+    marca = supabase.rpc("marca_cotizaciones", {}).execute().data or "0"
+    if request.if_none_match.contains(marca):
+        return "", 304, {"ETag": f'"{marca}"', "Cache-Control": "no-cache"}
+
+    def leer_resumen():
+        return supabase.rpc("resumen_general", {}).execute().data or {}
+
+    desde = request.args.get("desde")
+    if not desde or desde == marca:
+        return cuerpo_resumen(marca, leer_resumen())
+    consultas = consultas_resumen(supabase, desde)
+    if consultas is None:
+        return cuerpo_resumen(marca, leer_resumen(), recargar=True)
+    cambios, borrados = consultas
+    # Delta, borrados y resumen no dependen entre sí
+    filas, filas_borrados, resumen = en_paralelo(
+        lambda: cambios.execute().data,
+        lambda: borrados.execute().data,
+        leer_resumen,
+    )
+    return cuerpo_resumen(marca, resumen, filas, filas_borrados)
+
+
+@app.context_processor
+def eventos_disponibles():
+    """
+    Las colas usan el stream SSE (/api/eventos) solo si lo sirve
+    servidor_asgi; con Flask solo (gunicorn, app.run) sondean /api/resumen.
+    """
+    return {"eventos_sse": app.config.get("EVENTOS_SSE", False)}
+
+
 # ============================================================================
 # RUTAS - POR COTIZAR
 # ============================================================================
 
 @app.route("/por-cotizar")
 def por_cotizar():
-    pendientes = (
+    pendientes, siguiente = pagina_keyset(
         supabase.table("cotizaciones")
-        .select("*")
-        .eq("estado", "Esperando atención")
-        .order("created_at", desc=True)
-        .execute()
-        .data
+        .select("id, username, fecha, pedido_completo, created_at")
+        .eq("estado", "Esperando atención"),
+        request.args.get("cursor"),
+        cachear=True,
     )
-    return render_template("por_cotizar.html", vuelos=pendientes)
+    return render_template("por_cotizar.html", vuelos=pendientes, siguiente=siguiente)
 
 
 @app.route("/accion/cotizar", methods=["POST"])
@@ -492,6 +722,7 @@ def accion_cotizar():
         flash("No se encontró el vuelo.", "error")
         return redirect(url_for("por_cotizar"))
 
+    bus_eventos.publicar_cotizacion(res.data[0])
     user_id_raw = res.data[0]["user_id"]
     try:
         user_id = int(user_id_raw)
@@ -508,10 +739,10 @@ def accion_cotizar():
     )
 
     try:
-        enviar_mensaje(user_id, texto)
-        flash("Cotización enviada y usuario notificado.", "success")
+        cola_envios.encolar_mensaje(user_id, texto, ref=v_id)
+        flash("Cotización guardada; notificación en cola de envío.", "success")
     except Exception as e:
-        app.logger.error(f"Error Telegram: {e}")
+        app.logger.error(f"Error encolando notificación: {e}")
         flash("Cotización guardada pero no se notificó al usuario.", "error")
 
     return redirect(url_for("por_cotizar"))
@@ -523,15 +754,14 @@ def accion_cotizar():
 
 @app.route("/validar-pagos")
 def validar_pagos():
-    pendientes = (
+    pendientes, siguiente = pagina_keyset(
         supabase.table("cotizaciones")
-        .select("*")
-        .eq("estado", "Esperando confirmación de pago")
-        .order("created_at", desc=True)
-        .execute()
-        .data
+        .select("id, username, fecha, monto, created_at")
+        .eq("estado", "Esperando confirmación de pago"),
+        request.args.get("cursor"),
+        cachear=True,
     )
-    return render_template("validar_pagos.html", vuelos=pendientes)
+    return render_template("validar_pagos.html", vuelos=pendientes, siguiente=siguiente)
 
 
 @app.route("/accion/confirmar_pago", methods=["POST"])
@@ -542,17 +772,21 @@ def accion_confirmar_pago():
         flash("Falta ID.", "error")
         return redirect(url_for("validar_pagos"))
 
+    # Condicional: si ya se confirmó (p. ej. desde el botón de Telegram)
+    # no se vuelve a notificar al usuario
     res = (
         supabase.table("cotizaciones")
         .update({"estado": "Pago Confirmado"})
         .eq("id", v_id)
+        .not_.in_("estado", ESTADOS_CERRADOS)
         .execute()
     )
 
     if not res.data:
-        flash("No se encontró el vuelo.", "error")
+        flash("No se encontró el vuelo o su pago ya estaba confirmado.", "error")
         return redirect(url_for("validar_pagos"))
 
+    bus_eventos.publicar_cotizacion(res.data[0])
     user_id_raw = res.data[0]["user_id"]
     try:
         user_id = int(user_id_raw)
@@ -567,10 +801,10 @@ def accion_confirmar_pago():
     )
 
     try:
-        enviar_mensaje(user_id, texto)
-        flash("Pago confirmado y usuario notificado.", "success")
+        cola_envios.encolar_mensaje(user_id, texto, ref=v_id)
+        flash("Pago confirmado; notificación en cola de envío.", "success")
     except Exception as e:
-        app.logger.error(f"Error Telegram: {e}")
+        app.logger.error(f"Error encolando notificación: {e}")
         flash("Pago confirmado pero no se notificó.", "error")
 
     return redirect(url_for("validar_pagos"))
@@ -582,15 +816,34 @@ def accion_confirmar_pago():
 
 @app.route("/por-enviar-qr")
 def por_enviar_qr():
-    pendientes = (
+    pendientes, siguiente = pagina_keyset(
         supabase.table("cotizaciones")
-        .select("*")
+        .select("id, username, fecha, monto, created_at")
+        .eq("estado", "Pago Confirmado"),
+        request.args.get("cursor"),
+        cachear=True,
+    )
+    # Estado del último envío de QRs de cada vuelo (cola local, sin ir a la BD)
+    envios = cola_envios.trabajos([v["id"] for v in pendientes])
+    return render_template(
+        "por_enviar_qr.html", vuelos=pendientes, siguiente=siguiente, envios=envios
+    )
+
+
+def marcar_qr_enviados(v_id):
+    """Acción del último paso del envío de QRs: corre en el worker de la cola"""
+    actualizado = (
+        supabase.table("cotizaciones")
+        .update({"estado": "QR Enviados"})
+        .eq("id", v_id)
         .eq("estado", "Pago Confirmado")
-        .order("created_at", desc=True)
         .execute()
-        .data
     )
-    return render_template("por_enviar_qr.html", vuelos=pendientes)
+    if actualizado.data:
+        bus_eventos.publicar_cotizacion(actualizado.data[0])
+
+
+cola_envios.registrar_accion("qr_enviados", marcar_qr_enviados)
 
 
 @app.route("/accion/enviar_qr", methods=["POST"])
@@ -602,30 +855,42 @@ def accion_enviar_qr():
         flash("Falta ID de vuelo.", "error")
         return redirect(url_for("por_enviar_qr"))
 
-    res = (
-        supabase.table("cotizaciones")
-        .select("user_id")
-        .eq("id", v_id)
-        .single()
-        .execute()
+    if not fotos or fotos[0].filename == "":
+        flash("Adjunta al menos una imagen de QR.", "error")
+        return redirect(url_for("por_enviar_qr"))
+
+    if cola_envios.trabajos([v_id]).get(v_id, {}).get("estado") == "en_curso":
+        flash("Los QRs de este vuelo ya se están enviando.", "error")
+        return redirect(url_for("por_enviar_qr"))
+
+    # La búsqueda del vuelo y la copia de las fotos a disco no dependen una
+    # de la otra; si el vuelo no sirve, las copias se descartan
+    res, guardadas = en_paralelo(
+        lambda: (
+            supabase.table("cotizaciones")
+            .select("user_id")
+            .eq("id", v_id)
+            .limit(1)
+            .execute()
+            .data
+        ),
+        lambda: [cola_envios.guardar_archivo(f) for f in fotos],
     )
 
-    if not res.data:
+    if not res:
+        cola_envios.descartar_archivos(guardadas)
         flash("No se encontró el vuelo.", "error")
         return redirect(url_for("por_enviar_qr"))
 
-    user_id_raw = res.data["user_id"]
+    user_id_raw = res[0]["user_id"]
     try:
         user_id = int(user_id_raw)
     except Exception:
+        cola_envios.descartar_archivos(guardadas)
         app.logger.error(f"user_id no es entero: {user_id_raw}")
         flash("No se pudieron enviar QRs: user_id inválido.", "error")
         return redirect(url_for("por_enviar_qr"))
 
-    if not fotos or fotos[0].filename == "":
-        flash("Adjunta al menos una imagen de QR.", "error")
-        return redirect(url_for("por_enviar_qr"))
-
     instrucciones = (
         f"🎫 INSTRUCCIONES ID: {v_id}\n\n"
         "Instrucciones para evitar caídas:\n"
@@ -638,25 +903,112 @@ def accion_enviar_qr():
         "llegar al aeropuerto y escanear directamente."
     )
 
+    # Tres pasos en la cola (instrucciones, álbum de QRs, cierre) en un mismo
+    # lote: salen en orden por ser del mismo chat y si uno falla se cancelan
+    # los siguientes. El vuelo pasa a "QR Enviados" solo cuando se entrega
+    # el cierre (marcar_qr_enviados); mientras, la cola muestra el progreso.
     try:
-        enviar_mensaje(user_id, instrucciones)
+        lote = cola_envios.nuevo_lote()
+        cola_envios.encolar_mensaje(
+            user_id, instrucciones, ref=v_id, paso="instrucciones", lote=lote
+        )
+        cola_envios.encolar_album(
+            user_id, guardadas, caption=f"Códigos QR vuelo ID {v_id}", ref=v_id, paso="qr",
+            lote=lote,
+        )
+        cola_envios.encolar_mensaje(
+            user_id, "🎉 Disfruta tu vuelo.", ref=v_id, paso="cierre", lote=lote,
+            accion="qr_enviados",
+        )
+        flash("QRs en cola de envío.", "success")
+    except Exception as e:
+        app.logger.error(f"Error encolando QRs: {e}")
+        flash("No se pudieron encolar los QRs para el usuario.", "error")
 
-        for idx, f in enumerate(fotos):
-            caption = f"Códigos QR vuelo ID {v_id}" if idx == 0 else ""
-            enviar_foto(user_id, f, caption=caption)
+    return redirect(url_for("por_enviar_qr"))
 
-        enviar_mensaje(user_id, "🎉 Disfruta tu vuelo.")
 
-        supabase.table("cotizaciones").update(
-            {"estado": "QR Enviados"}
-        ).eq("id", v_id).execute()
+# ============================================================================
+# RUTAS - ESTADO DE ENVÍOS
+# ============================================================================
 
-        flash("QRs enviados correctamente.", "success")
-    except Exception as e:
-        app.logger.error(f"Error enviando QRs: {e}")
-        flash("No se pudieron enviar los QRs al usuario.", "error")
+@app.errorhandler(413)
+def subida_demasiado_grande(e):
+    limite = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    flash(f"Los archivos superan el máximo de {limite} MB por envío.", "error")
+    return redirect(request.referrer or url_for("general"))
+
+
+@app.errorhandler(CursorInvalido)
+def cursor_invalido(e):
+    if request.path.startswith("/api/"):
+        return jsonify({"error": "Cursor inválido"}), 400
+    return "Cursor inválido", 400
+
+
+@app.after_request
+def invalidar_tras_accion(resp):
+    # Toda /accion/* puede mover vuelos entre colas
+    if request.method == "POST" and request.path.startswith("/accion/"):
+        cache_consultas.invalidar()
+    return resp
+
+
+@app.route("/api/cache")
+def api_cache():
+    """Hit rate y tiempo ahorrado por la caché de consultas"""
+    return jsonify({
+        "consultas": cache_consultas.metricas(),
+        "eventos": bus_eventos.metricas(),
+    })
+
+
+@app.route("/admin/lentas")
+def admin_lentas():
+    """Peticiones recientes más lentas con su desglose por fase"""
+    return render_template(
+        "lentas.html",
+        peticiones=perfilador.mas_lentas(),
+        estado=perfilador.metricas(),
+    )
+
+
+@app.route("/admin/perfiles/<path:nombre>")
+def admin_perfil(nombre):
+    return send_from_directory(os.path.abspath(perfilador.directorio), nombre, as_attachment=True)
+
+
+@app.route("/metrics")
+def metrics():
+    """Métricas de este worker en formato Prometheus"""
+    return Response(metricas.exponer(), content_type=metricas.TIPO_CONTENIDO)
+
+
+@app.route("/api/envios")
+def api_envios():
+    """Últimos envíos a Telegram (filtrables por ?ref=<id de vuelo>)"""
+    ref = request.args.get("ref")
+    limite = max(1, min(request.args.get("limite", 50, type=int), 500))
+    return jsonify({
+        "resumen": cola_envios.resumen(),
+        "telegram": cola_envios.tg.metricas(),
+        "archivos": cola_envios.metricas_archivos(),
+        "envios": cola_envios.recientes(limite=limite, ref=ref),
+    })
 
-    return redirect(url_for("por_enviar_qr"))
+
+@app.route("/api/vuelo/<int:vuelo_id>/envios")
+def api_envios_vuelo(vuelo_id):
+    """Estado de cada paso de las notificaciones de un vuelo"""
+    return jsonify(cola_envios.pasos(vuelo_id))
+
+
+@app.route("/api/envios/<int:envio_id>")
+def api_envio(envio_id):
+    envio = cola_envios.estado(envio_id)
+    if not envio:
+        return jsonify({"error": "Envío no encontrado"}), 404
+    return jsonify(envio)
 
 
 # ============================================================================
@@ -666,16 +1018,17 @@ def accion_enviar_qr():
 @app.route("/proximos-vuelos")
 def proximos_vuelos():
     hoy, hasta = rango_proximos()
-    proximos = (
+    proximos, siguiente = pagina_keyset(
         supabase.table("cotizaciones")
-        .select("*")
+        .select("id, username, fecha, monto, estado")
         .gte("fecha", str(hoy))
-        .lte("fecha", str(hasta))
-        .order("fecha", desc=False)
-        .execute()
-        .data
+        .lte("fecha", str(hasta)),
+        request.args.get("cursor"),
+        columna="fecha",
+        desc=False,
+        cachear=True,
     )
-    return render_template("proximos_vuelos.html", vuelos=proximos)
+    return render_template("proximos_vuelos.html", vuelos=proximos, siguiente=siguiente)
 
 
 # ============================================================================
@@ -684,44 +1037,47 @@ def proximos_vuelos():
 
 @app.route("/historial")
 def historial():
-    vuelos = (
+    vuelos, siguiente = pagina_keyset(
         supabase.table("cotizaciones")
-        .select("*")
-        .order("created_at", desc=True)
-        .limit(300)
-        .execute()
-        .data
+        .select("id, username, fecha, monto, estado, created_at"),
+        request.args.get("cursor"),
     )
-    return render_template("historial.html", vuelos=vuelos)
+    return render_template("historial.html", vuelos=vuelos, siguiente=siguiente)
 
 
 @app.route("/historial-usuario/<username>")
 def historial_usuario(username):
-    vuelos = (
-        supabase.table("cotizaciones")
-        .select("*")
-        .eq("username", username)
-        .order("created_at", desc=True)
-        .execute()
-        .data
-    )
-
-    total_pagado = sum(
-        float(v["monto"]) for v in vuelos
-        if v.get("monto") and v.get("estado") in ["Pago Confirmado", "QR Enviados"]
-    )
-
-    pagos_confirmados = sum(
-        1 for v in vuelos
-        if v.get("estado") in ["Pago Confirmado", "QR Enviados"]
+    cursor = request.args.get("cursor")
+    leer_cursor(cursor)  # 400 antes de lanzar las consultas
+    # Totales precalculados por trigger (ver sql/resumen_general.sql) y la
+    # página de vuelos, a la vez
+    resumen, (vuelos, siguiente) = en_paralelo(
+        lambda: (
+            supabase.table("resumen_usuarios")
+            .select("vuelos, pagados, total_pagado, ultima_actividad")
+            .eq("username", username)
+            .limit(1)
+            .execute()
+            .data
+        ),
+        lambda: pagina_keyset(
+            supabase.table("cotizaciones")
+            .select("id, estado, monto, fecha, created_at")
+            .eq("username", username),
+            cursor,
+        ),
     )
+    resumen = resumen[0] if resumen else {}
 
     return render_template(
         "historial_usuario.html",
         username=username,
         vuelos=vuelos,
-        total_pagado=total_pagado,
-        pagos_confirmados=pagos_confirmados,
+        siguiente=siguiente,
+        total_vuelos=resumen.get("vuelos", 0),
+        total_pagado=float(resumen.get("total_pagado") or 0),
+        pagos_confirmados=resumen.get("pagados", 0),
+        ultima_actividad=resumen.get("ultima_actividad"),
     )
 
 # ============================================================================
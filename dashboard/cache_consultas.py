@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+CACHE_CONSULTAS_TTL_SEG = float(os.getenv("CACHE_CONSULTAS_TTL_SEG", 10))
+CACHE_CONSULTAS_MAX = int(os.getenv("CACHE_CONSULTAS_MAX", 500))
+# redis://... para compartir la caché (y sus invalidaciones) entre workers
+CACHE_CONSULTAS_REDIS_URL = os.getenv("CACHE_CONSULTAS_REDIS_URL")
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================================
+# ALMACENES
+# ============================================================================
+
+class _Memoria:
+    """LRU con expiración dentro del proceso"""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._datos = OrderedDict()  # clave -> (vence, valor)
+        self._generacion = 0
+        self._lock = threading.Lock()
+
+    def generacion(self) -> int:
+        return self._generacion
+
+    def avanzar(self):
+        with self._lock:
+            self._generacion += 1
+            self._datos.clear()
+
+    def get(self, clave: str):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            vence, valor = item
+            if vence < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave: str, valor, ttl: float):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class _Redis:
+    """Mismo contrato sobre Redis; la generación es un contador compartido"""
+
+    GENERACION = "cache_consultas:generacion"
+
+    def __init__(self, url: str):
+        import redis
+
+        self.r = redis.Redis.from_url(url)
+
+    def generacion(self) -> int:
+        return int(self.r.get(self.GENERACION) or 0)
+
+    def avanzar(self):
+        # Las claves viejas quedan huérfanas y vencen solas por TTL
+        self.r.incr(self.GENERACION)
+
+    def get(self, clave: str):
+        valor = self.r.get(f"cache_consultas:{clave}")
+        return json.loads(valor) if valor is not None else None
+
+    def set(self, clave: str, valor, ttl: float):
+        self.r.set(f"cache_consultas:{clave}", json.dumps(valor, default=str), px=int(ttl * 1000))
+
+    def __len__(self):
+        return -1
+
+
+# ============================================================================
+# CACHÉ READ-THROUGH
+# ============================================================================
+
+class CacheConsultas:
+    """
+    Caché de resultados de consultas de lectura, por clave de consulta.
+    invalidar() descarta todo lo guardado (cualquier escritura en
+    cotizaciones puede mover filas entre colas).
+    """
+
+    def __init__(self, ttl_seg: float = CACHE_CONSULTAS_TTL_SEG,
+                 max_items: int = CACHE_CONSULTAS_MAX,
+                 redis_url: str = CACHE_CONSULTAS_REDIS_URL):
+        self.ttl_seg = ttl_seg
+        self.almacen = _Redis(redis_url) if redis_url else _Memoria(max_items)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidaciones": 0, "errores": 0}
+        self._costo_ms = {}  # clave -> ms que costó la consulta
+        self.ahorrado_ms = 0.0
+
+    def obtener(self, clave: str, cargar: Callable):
+        """Devuelve el valor guardado o ejecuta cargar() y lo guarda"""
+        try:
+            completa = f"{self.almacen.generacion()}:{clave}"
+            valor = self.almacen.get(completa)
+        except Exception as e:
+            log.error(f"Caché de consultas no disponible: {e}")
+            with self._lock:
+                self.stats["errores"] += 1
+            return cargar()
+
+        if valor is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+                self.ahorrado_ms += self._costo_ms.get(clave, 0.0)
+            return valor
+
+        inicio = time.perf_counter()
+        valor = cargar()
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.stats["misses"] += 1
+            self._costo_ms[clave] = ms
+            if len(self._costo_ms) > 4 * CACHE_CONSULTAS_MAX:
+                self._costo_ms.clear()
+        try:
+            self.almacen.set(completa, valor, self.ttl_seg)
+        except Exception as e:
+            log.error(f"No se pudo guardar en la caché de consultas: {e}")
+        return valor
+
+    def invalidar(self):
+        try:
+            self.almacen.avanzar()
+        except Exception as e:
+            log.error(f"No se pudo invalidar la caché de consultas: {e}")
+            return
+        with self._lock:
+            self.stats["invalidaciones"] += 1
+
+    def metricas(self) -> dict:
+        consultas = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "backend": "redis" if isinstance(self.almacen, _Redis) else "memoria",
+            "tamano": len(self.almacen),
+            "hit_rate": round(self.stats["hits"] / consultas, 3) if consultas else 0.0,
+            "ahorrado_ms": round(self.ahorrado_ms, 1),
+        }
@@ -0,0 +1,783 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from telegram_api import TelegramAsync, ErrorTelegram
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+COLA_DB_PATH = os.getenv("COLA_DB_PATH", "envios.db")
+COLA_ARCHIVOS_DIR = os.getenv("COLA_ARCHIVOS_DIR", "envios_archivos")
+COLA_WORKERS = int(os.getenv("COLA_WORKERS", 4))
+COLA_MAX_INTENTOS = int(os.getenv("COLA_MAX_INTENTOS", 6))
+COLA_BACKOFF_BASE_SEG = float(os.getenv("COLA_BACKOFF_BASE_SEG", 2))
+COLA_BACKOFF_MAX_SEG = float(os.getenv("COLA_BACKOFF_MAX_SEG", 300))
+
+# Límites de Telegram: ~30 mensajes/s en total y ~1 mensaje/s por chat.
+# Se llevan en la base de la cola (tabla limites_tg), así que los comparten
+# todos los procesos que usan el mismo COLA_DB_PATH
+TG_GLOBAL_POR_SEG = float(os.getenv("TG_GLOBAL_POR_SEG", 25))
+TG_CHAT_POR_SEG = float(os.getenv("TG_CHAT_POR_SEG", 1))
+
+# Un envío que lleva más de esto en "enviando" se da por huérfano (caída)
+COLA_HUERFANO_SEG = 300
+
+# sendMediaGroup acepta de 2 a 10 fotos por álbum
+ALBUM_MAX = 10
+
+# Los uploads se copian a disco en bloques de este tamaño
+COLA_BLOQUE_BYTES = 64 * 1024
+
+# Descripciones de la Bot API para un file_id que ya no acepta
+ERRORES_FILE_ID = ("wrong file identifier", "wrong remote file identifier", "wrong file_id")
+
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+# Pasos de un lote que no salen porque uno anterior falló
+CANCELADO = "cancelado"
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================================
+# COLA DURABLE
+# ============================================================================
+
+class ColaEnvios:
+    """
+    Cola local (SQLite) de notificaciones a Telegram.
+
+    Las rutas del dashboard solo encolan y responden; un hilo con workers
+    asíncronos drena la cola respetando el límite global, el de cada chat y
+    el retry_after de los 429. Los mensajes de un mismo chat salen en orden.
+    Cada proceso (p. ej. cada worker de gunicorn) corre sus propios workers
+    sobre la misma base, y los límites se reservan en ella, no en memoria.
+
+    Los pasos de un mismo trabajo comparten `lote`: si uno falla, los
+    siguientes del lote se cancelan. Un paso puede llevar una `accion`
+    (ver registrar_accion) que corre cuando ese paso se entrega.
+    """
+
+    def __init__(self, token: str, db_path: str = COLA_DB_PATH, archivos_dir: str = COLA_ARCHIVOS_DIR):
+        self.token = token
+        self.tg = TelegramAsync(token, pool=COLA_WORKERS)
+        self.db_path = db_path
+        self.archivos_dir = archivos_dir
+        os.makedirs(archivos_dir, exist_ok=True)
+        self._hilo = None
+        self._loop = None
+        self._hay_trabajo = None
+        self.stats_archivos = {"subidos": 0, "reutilizados": 0, "file_id_invalidos": 0}
+        self._acciones = {}
+        self._crear_tabla()
+
+    # --- SQLite ---
+
+    def _conectar(self):
+        con = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def _crear_tabla(self):
+        con = self._conectar()
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS envios ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " chat_id INTEGER NOT NULL,"
+                " metodo TEXT NOT NULL,"
+                " datos TEXT NOT NULL,"
+                " archivos TEXT,"
+                " ref TEXT,"
+                " paso TEXT,"
+                " estado TEXT NOT NULL,"
+                " intentos INTEGER NOT NULL DEFAULT 0,"
+                " proximo_intento REAL NOT NULL,"
+                " error TEXT,"
+                " creado REAL NOT NULL,"
+                " actualizado REAL NOT NULL)"
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS envios_pendientes "
+                "ON envios (estado, proximo_intento)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS envios_chat ON envios (chat_id, id)")
+            con.execute("CREATE INDEX IF NOT EXISTS envios_ref ON envios (ref)")
+            # sha256 del archivo -> file_id que Telegram le asignó al subirlo
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS archivos_telegram ("
+                " hash TEXT PRIMARY KEY,"
+                " file_id TEXT NOT NULL,"
+                " creado REAL NOT NULL)"
+            )
+            columnas = {r["name"] for r in con.execute("PRAGMA table_info(envios)")}
+            for columna in ("paso", "lote", "accion"):
+                if columna not in columnas:
+                    con.execute(f"ALTER TABLE envios ADD COLUMN {columna} TEXT")
+            # sha256 -> copias guardadas que aún lo usan (envíos en cola o
+            # copias que la ruta todavía no encoló); a 0 se borra el archivo
+            existia = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archivos_spool'"
+            ).fetchone()
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS archivos_spool ("
+                " hash TEXT PRIMARY KEY,"
+                " refs INTEGER NOT NULL)"
+            )
+            if not existia:
+                self._contar_refs(con)
+            # Límites de Telegram compartidos entre procesos: clave "global"
+            # o "chat:<id>" -> time.time() a partir del cual se puede enviar
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS limites_tg ("
+                " clave TEXT PRIMARY KEY,"
+                " libre REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS limites_tg_libre ON limites_tg (libre)")
+        finally:
+            con.close()
+
+    @staticmethod
+    def _contar_refs(con):
+        """Referencias de los envíos ya en cola al crear archivos_spool"""
+        refs = {}
+        for r in con.execute(
+            "SELECT archivos FROM envios WHERE estado IN (?, ?) AND archivos IS NOT NULL",
+            (PENDIENTE, ENVIANDO),
+        ):
+            for archivo in json.loads(r["archivos"]):
+                if archivo.get("hash"):
+                    refs[archivo["hash"]] = refs.get(archivo["hash"], 0) + 1
+        con.executemany("INSERT INTO archivos_spool (hash, refs) VALUES (?, ?)", refs.items())
+
+    # --- encolar (desde las rutas de Flask) ---
+
+    def encolar(self, chat_id: int, metodo: str, datos: dict, archivos: list = None,
+                ref=None, paso: str = None, lote: str = None, accion: str = None) -> int:
+        """
+        paso: nombre del envío dentro de un trabajo de varios (ver pasos())
+        lote: id del trabajo (nuevo_lote()); si un paso falla se cancela el resto
+        accion: nombre registrado con registrar_accion(), corre al entregarse
+        """
+        ahora = time.time()
+        con = self._conectar()
+        try:
+            cur = con.execute(
+                "INSERT INTO envios (chat_id, metodo, datos, archivos, ref, paso, lote, accion,"
+                " estado, proximo_intento, creado, actualizado)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    chat_id, metodo, json.dumps(datos),
+                    json.dumps(archivos) if archivos else None,
+                    str(ref) if ref is not None else None, paso, lote, accion,
+                    PENDIENTE, ahora, ahora, ahora,
+                ),
+            )
+            envio_id = cur.lastrowid
+        finally:
+            con.close()
+        self._despertar()
+        return envio_id
+
+    def encolar_mensaje(self, chat_id: int, texto: str, ref=None, paso: str = None,
+                        lote: str = None, accion: str = None) -> int:
+        return self.encolar(
+            chat_id, "sendMessage", {"chat_id": chat_id, "text": texto},
+            ref=ref, paso=paso, lote=lote, accion=accion,
+        )
+
+    @staticmethod
+    def nuevo_lote() -> str:
+        return uuid.uuid4().hex
+
+    def registrar_accion(self, nombre: str, funcion):
+        """
+        funcion(ref) corre en un hilo del worker cuando se entrega el paso
+        encolado con accion=nombre. Se guarda el nombre, no la función, así
+        que sobrevive a un reinicio; registrarla antes de iniciar().
+        """
+        self._acciones[nombre] = funcion
+
+    def guardar_archivo(self, fileobj) -> dict:
+        """
+        Copia el upload a disco (el stream de Werkzeug muere con la petición)
+        en bloques, calculando su sha256 en la misma pasada. El archivo se
+        llama como su hash: una imagen repetida ocupa un solo archivo y, si ya
+        se subió antes, se envía por file_id (ver _preparar).
+        """
+        sha = hashlib.sha256()
+        temporal = os.path.join(self.archivos_dir, f".{uuid.uuid4().hex}")
+        with open(temporal, "wb") as destino:
+            for bloque in iter(lambda: fileobj.stream.read(COLA_BLOQUE_BYTES), b""):
+                sha.update(bloque)
+                destino.write(bloque)
+        digest = sha.hexdigest()
+        ruta = os.path.join(self.archivos_dir, digest)
+        # La referencia y el archivo en la misma transacción que el borrado
+        # de _soltar_archivo: ningún otro worker lo borra entre medias
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(
+                "INSERT INTO archivos_spool (hash, refs) VALUES (?, 1) "
+                "ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+                (digest,),
+            )
+            os.replace(temporal, ruta)
+            con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            self._eliminar(temporal)
+            raise
+        finally:
+            con.close()
+        return {"ruta": ruta, "nombre": fileobj.filename, "tipo": fileobj.mimetype, "hash": digest}
+
+    def _guardado(self, fileobj) -> dict:
+        """Acepta un upload o lo que ya devolvió guardar_archivo()"""
+        return fileobj if isinstance(fileobj, dict) else self.guardar_archivo(fileobj)
+
+    def descartar_archivos(self, guardados: list):
+        """Suelta copias de guardar_archivo() que al final no se encolaron"""
+        for archivo in guardados:
+            self._soltar_archivo(archivo)
+
+    def encolar_foto(self, chat_id: int, fileobj, caption: str = "", ref=None, paso: str = None,
+                     lote: str = None) -> int:
+        archivo = {"campo": "photo", **self._guardado(fileobj)}
+        return self.encolar(
+            chat_id, "sendPhoto", {"chat_id": chat_id, "caption": caption},
+            archivos=[archivo], ref=ref, paso=paso, lote=lote,
+        )
+
+    def encolar_album(self, chat_id: int, fileobjs: list, caption: str = "",
+                      ref=None, paso: str = "album", lote: str = None) -> list:
+        """
+        Fotos como álbum: un sendMediaGroup por cada ALBUM_MAX fotos en
+        lugar de un sendPhoto por foto. El caption va en la primera.
+        fileobjs: uploads o archivos ya copiados con guardar_archivo().
+        """
+        ids = []
+        grupos = [fileobjs[i:i + ALBUM_MAX] for i in range(0, len(fileobjs), ALBUM_MAX)]
+        for n, grupo in enumerate(grupos):
+            nombre = paso if len(grupos) == 1 else f"{paso} {n + 1}/{len(grupos)}"
+            if len(grupo) == 1:
+                ids.append(self.encolar_foto(
+                    chat_id, grupo[0], caption if n == 0 else "", ref=ref, paso=nombre, lote=lote
+                ))
+                continue
+            media, archivos = [], []
+            for i, fileobj in enumerate(grupo):
+                campo = f"foto{i}"
+                archivos.append({"campo": campo, **self._guardado(fileobj)})
+                item = {"type": "photo", "media": f"attach://{campo}"}
+                if n == 0 and i == 0 and caption:
+                    item["caption"] = caption
+                media.append(item)
+            ids.append(self.encolar(
+                chat_id, "sendMediaGroup",
+                {"chat_id": chat_id, "media": json.dumps(media)},
+                archivos=archivos, ref=ref, paso=nombre, lote=lote,
+            ))
+        return ids
+
+    # --- estado de entrega ---
+
+    @staticmethod
+    def _fila(r) -> dict:
+        return {
+            "id": r["id"],
+            "chat_id": r["chat_id"],
+            "metodo": r["metodo"],
+            "ref": r["ref"],
+            "paso": r["paso"],
+            "lote": r["lote"],
+            "estado": r["estado"],
+            "intentos": r["intentos"],
+            "error": r["error"],
+            "creado": r["creado"],
+            "actualizado": r["actualizado"],
+        }
+
+    def estado(self, envio_id: int) -> Optional[dict]:
+        con = self._conectar()
+        try:
+            r = con.execute("SELECT * FROM envios WHERE id = ?", (envio_id,)).fetchone()
+        finally:
+            con.close()
+        return self._fila(r) if r else None
+
+    def recientes(self, limite: int = 50, ref=None) -> list:
+        con = self._conectar()
+        try:
+            if ref is not None:
+                filas = con.execute(
+                    "SELECT * FROM envios WHERE ref = ? ORDER BY id DESC LIMIT ?",
+                    (str(ref), limite),
+                ).fetchall()
+            else:
+                filas = con.execute(
+                    "SELECT * FROM envios ORDER BY id DESC LIMIT ?", (limite,)
+                ).fetchall()
+        finally:
+            con.close()
+        return [self._fila(r) for r in filas]
+
+    def pasos(self, ref) -> list:
+        """Estado de cada paso de un trabajo (los envíos de un mismo ref), en orden"""
+        con = self._conectar()
+        try:
+            filas = con.execute(
+                "SELECT * FROM envios WHERE ref = ? ORDER BY id", (str(ref),)
+            ).fetchall()
+        finally:
+            con.close()
+        return [self._fila(r) for r in filas]
+
+    def trabajos(self, refs: list) -> dict:
+        """
+        ref -> estado del último lote de ese ref: "en_curso", "enviado" o
+        "fallido" (con el paso y el error), para mostrarlo en las colas
+        """
+        refs = [str(r) for r in refs]
+        if not refs:
+            return {}
+        con = self._conectar()
+        try:
+            filas = con.execute(
+                f"SELECT * FROM envios WHERE ref IN ({','.join('?' * len(refs))})"
+                " AND lote IS NOT NULL ORDER BY id",
+                refs,
+            ).fetchall()
+        finally:
+            con.close()
+        lotes = {}
+        for r in filas:
+            # El último lote de cada ref es el que cuenta
+            if lotes.get(r["ref"], {}).get("lote") != r["lote"]:
+                lotes[r["ref"]] = {"lote": r["lote"], "pasos": []}
+            lotes[r["ref"]]["pasos"].append(r)
+        estados = {}
+        for ref, lote in lotes.items():
+            fallido = next((r for r in lote["pasos"] if r["estado"] == FALLIDO), None)
+            if fallido is not None:
+                estados[ref] = {"estado": "fallido", "paso": fallido["paso"], "error": fallido["error"]}
+            elif any(r["estado"] in (PENDIENTE, ENVIANDO) for r in lote["pasos"]):
+                estados[ref] = {"estado": "en_curso"}
+            else:
+                estados[ref] = {"estado": "enviado"}
+        return estados
+
+    def resumen(self) -> dict:
+        con = self._conectar()
+        try:
+            filas = con.execute("SELECT estado, COUNT(*) FROM envios GROUP BY estado").fetchall()
+        finally:
+            con.close()
+        return {estado: n for estado, n in filas}
+
+    def metricas_archivos(self) -> dict:
+        con = self._conectar()
+        try:
+            (conocidos,) = con.execute("SELECT COUNT(*) FROM archivos_telegram").fetchone()
+        finally:
+            con.close()
+        return {**self.stats_archivos, "file_ids": conocidos}
+
+    # --- file_id de archivos ya subidos ---
+
+    def _file_ids(self, hashes: list) -> dict:
+        hashes = [h for h in hashes if h]
+        if not hashes:
+            return {}
+        con = self._conectar()
+        try:
+            filas = con.execute(
+                f"SELECT hash, file_id FROM archivos_telegram"
+                f" WHERE hash IN ({','.join('?' * len(hashes))})",
+                hashes,
+            ).fetchall()
+        finally:
+            con.close()
+        return {h: f for h, f in filas}
+
+    def _guardar_file_ids(self, pares: list):
+        if not pares:
+            return
+        con = self._conectar()
+        try:
+            con.executemany(
+                "INSERT OR REPLACE INTO archivos_telegram (hash, file_id, creado) VALUES (?, ?, ?)",
+                [(h, f, time.time()) for h, f in pares],
+            )
+        finally:
+            con.close()
+
+    def _olvidar_file_ids(self, hashes: list):
+        con = self._conectar()
+        try:
+            con.executemany("DELETE FROM archivos_telegram WHERE hash = ?", [(h,) for h in hashes])
+        finally:
+            con.close()
+
+    # --- reclamar / cerrar envíos (desde los workers) ---
+
+    def _reclamar(self) -> Optional[dict]:
+        """
+        Toma el siguiente envío vencido cuyo chat no tenga otro anterior
+        pendiente o en curso (así se respeta el orden por chat) y cuyo chat
+        ya respete su límite (limites_tg, de cualquier proceso).
+        """
+        ahora = time.time()
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            r = con.execute(
+                "SELECT * FROM envios e WHERE e.estado = ? AND e.proximo_intento <= ?"
+                " AND NOT EXISTS (SELECT 1 FROM envios o WHERE o.chat_id = e.chat_id"
+                "   AND o.id < e.id AND o.estado IN (?, ?))"
+                " AND NOT EXISTS (SELECT 1 FROM limites_tg l"
+                "   WHERE l.clave = 'chat:' || e.chat_id AND l.libre > ?)"
+                " ORDER BY e.proximo_intento, e.id LIMIT 1",
+                (PENDIENTE, ahora, PENDIENTE, ENVIANDO, ahora),
+            ).fetchone()
+            if r is None:
+                con.execute("COMMIT")
+                return None
+            con.execute(
+                "UPDATE envios SET estado = ?, actualizado = ? WHERE id = ?",
+                (ENVIANDO, ahora, r["id"]),
+            )
+            con.execute("COMMIT")
+            return dict(r)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def _actualizar(self, envio_id: int, **campos):
+        campos["actualizado"] = time.time()
+        columnas = ", ".join(f"{c} = ?" for c in campos)
+        con = self._conectar()
+        try:
+            con.execute(
+                f"UPDATE envios SET {columnas} WHERE id = ?",
+                (*campos.values(), envio_id),
+            )
+        finally:
+            con.close()
+
+    def _turno_global(self) -> float:
+        """
+        Reserva el próximo hueco del límite global (1 / TG_GLOBAL_POR_SEG
+        entre envíos de todos los procesos) y devuelve cuándo llega.
+        """
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            ahora = time.time()
+            r = con.execute("SELECT libre FROM limites_tg WHERE clave = 'global'").fetchone()
+            turno = max(ahora, r["libre"]) if r else ahora
+            con.execute(
+                "INSERT OR REPLACE INTO limites_tg (clave, libre) VALUES ('global', ?)",
+                (turno + 1 / TG_GLOBAL_POR_SEG,),
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return turno
+
+    def _espaciar_chat(self, chat_id: int, segundos: float):
+        """El chat no vuelve a reclamarse hasta dentro de `segundos`"""
+        ahora = time.time()
+        con = self._conectar()
+        try:
+            con.execute(
+                "INSERT OR REPLACE INTO limites_tg (clave, libre) VALUES (?, ?)",
+                (f"chat:{chat_id}", ahora + segundos),
+            )
+            # Los chats ya libres no hace falta guardarlos
+            con.execute(
+                "DELETE FROM limites_tg WHERE libre < ? AND clave != 'global'",
+                (ahora - COLA_HUERFANO_SEG,),
+            )
+        finally:
+            con.close()
+
+    def _recuperar_huerfanos(self):
+        limite = time.time() - COLA_HUERFANO_SEG
+        con = self._conectar()
+        try:
+            con.execute(
+                "UPDATE envios SET estado = ? WHERE estado = ? AND actualizado < ?",
+                (PENDIENTE, ENVIANDO, limite),
+            )
+        finally:
+            con.close()
+
+    def _borrar_archivos(self, envio: dict):
+        for archivo in json.loads(envio["archivos"] or "[]"):
+            self._soltar_archivo(archivo)
+
+    def _soltar_archivo(self, archivo: dict):
+        """
+        Quita una referencia al archivo y lo borra si era la última. El mismo
+        archivo (mismo hash) puede estar en otro envío o recién guardado por
+        otra petición que aún no lo encoló.
+        """
+        if not archivo.get("hash"):
+            self._eliminar(archivo["ruta"])
+            return
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(
+                "UPDATE archivos_spool SET refs = refs - 1 WHERE hash = ?", (archivo["hash"],)
+            )
+            fila = con.execute(
+                "SELECT refs FROM archivos_spool WHERE hash = ?", (archivo["hash"],)
+            ).fetchone()
+            if fila is None or fila["refs"] <= 0:
+                con.execute("DELETE FROM archivos_spool WHERE hash = ?", (archivo["hash"],))
+                self._eliminar(archivo["ruta"])
+            con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    @staticmethod
+    def _eliminar(ruta: str):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    # --- workers ---
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) el hilo que drena la cola"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=lambda: asyncio.run(self._correr()), daemon=True)
+        self._hilo.start()
+
+    def _despertar(self):
+        if self._loop is not None and self._hay_trabajo is not None:
+            self._loop.call_soon_threadsafe(self._hay_trabajo.set)
+
+    async def _correr(self):
+        self._loop = asyncio.get_running_loop()
+        self._hay_trabajo = asyncio.Event()
+        await asyncio.to_thread(self._recuperar_huerfanos)
+
+        try:
+            await asyncio.gather(*(self._trabajador() for _ in range(COLA_WORKERS)))
+        finally:
+            await self.tg.cerrar()
+
+    async def _trabajador(self):
+        while True:
+            try:
+                envio = await asyncio.to_thread(self._reclamar)
+            except Exception as e:
+                log.error(f"Error leyendo la cola de envíos: {e}")
+                envio = None
+
+            if envio is None:
+                self._hay_trabajo.clear()
+                try:
+                    await asyncio.wait_for(self._hay_trabajo.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._enviar(envio)
+            except Exception as e:
+                log.error(f"Error enviando {envio['id']}: {e}")
+                await asyncio.to_thread(self._reintentar, envio, str(e))
+
+    async def _enviar(self, envio: dict):
+        chat_id = envio["chat_id"]
+        espera = await asyncio.to_thread(self._turno_global) - time.time()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+        datos = json.loads(envio["datos"])
+        archivos = json.loads(envio["archivos"] or "[]")
+        conocidos = await asyncio.to_thread(self._file_ids, [a.get("hash") for a in archivos])
+        a_subir = self._preparar(datos, archivos, conocidos)
+
+        abiertos = []
+        try:
+            files = {}
+            for a in a_subir:
+                f = open(a["ruta"], "rb")
+                abiertos.append(f)
+                files[a["campo"]] = (a["nombre"], f, a["tipo"])
+            resultado = await self.tg.llamar(envio["metodo"], datos, files or None)
+        except ErrorTelegram as e:
+            await self._esperar_chat(chat_id, 1 / TG_CHAT_POR_SEG)
+            if conocidos and e.status == 400 and self._es_error_file_id(e):
+                # file_id que Telegram ya no acepta: se olvida y se sube de nuevo
+                self.stats_archivos["file_id_invalidos"] += 1
+                await asyncio.to_thread(self._olvidar_file_ids, list(conocidos))
+                await asyncio.to_thread(self._reintentar, envio, str(e))
+                return
+            await asyncio.to_thread(self._fallo, envio, e)
+            return
+        finally:
+            for f in abiertos:
+                f.close()
+
+        await self._esperar_chat(chat_id, 1 / TG_CHAT_POR_SEG)
+        self.stats_archivos["subidos"] += len(a_subir)
+        self.stats_archivos["reutilizados"] += len(archivos) - len(a_subir)
+        await asyncio.to_thread(
+            self._guardar_file_ids, self._file_ids_de(archivos, conocidos, resultado)
+        )
+        await asyncio.to_thread(self._actualizar, envio["id"], estado=ENVIADO, error=None)
+        await asyncio.to_thread(self._borrar_archivos, envio)
+        if envio.get("accion"):
+            await asyncio.to_thread(self._ejecutar_accion, envio)
+
+    async def _esperar_chat(self, chat_id: int, segundos: float):
+        await asyncio.to_thread(self._espaciar_chat, chat_id, segundos)
+        # Los workers de este proceso vuelven a mirar la cola cuando el chat
+        # se libera, sin esperar a su sondeo
+        self._loop.call_later(segundos, self._hay_trabajo.set)
+
+    def _ejecutar_accion(self, envio: dict):
+        funcion = self._acciones.get(envio["accion"])
+        try:
+            if funcion is None:
+                raise LookupError(f"acción no registrada: {envio['accion']}")
+            funcion(envio["ref"])
+        except Exception as e:
+            # El mensaje ya salió: no se reintenta, queda el error en el paso
+            log.error(f"Acción {envio['accion']} del envío {envio['id']}: {e}")
+            self._actualizar(envio["id"], error=f"Acción {envio['accion']}: {e}")
+
+    @staticmethod
+    def _preparar(datos: dict, archivos: list, conocidos: dict) -> list:
+        """
+        Sustituye en `datos` los archivos con file_id conocido (sin volver a
+        subir sus bytes) y devuelve los que sí hay que adjuntar.
+        """
+        media = json.loads(datos["media"]) if "media" in datos else None
+        a_subir = []
+        for a in archivos:
+            file_id = conocidos.get(a.get("hash"))
+            if file_id is None:
+                a_subir.append(a)
+            elif media is not None:
+                for item in media:
+                    if item["media"] == f"attach://{a['campo']}":
+                        item["media"] = file_id
+            else:
+                datos[a["campo"]] = file_id
+        if media is not None:
+            datos["media"] = json.dumps(media)
+        return a_subir
+
+    @staticmethod
+    def _file_ids_de(archivos: list, conocidos: dict, resultado) -> list:
+        """(hash, file_id) de los archivos recién subidos, según la respuesta"""
+        mensajes = resultado if isinstance(resultado, list) else [resultado]
+        pares = []
+        for a, msg in zip(archivos, mensajes):
+            if not a.get("hash") or a["hash"] in conocidos or not isinstance(msg, dict):
+                continue
+            if msg.get("photo"):
+                pares.append((a["hash"], msg["photo"][-1]["file_id"]))
+            elif msg.get("document"):
+                pares.append((a["hash"], msg["document"]["file_id"]))
+        return pares
+
+    @staticmethod
+    def _es_error_file_id(e: ErrorTelegram) -> bool:
+        descripcion = (e.descripcion or "").lower()
+        return any(texto in descripcion for texto in ERRORES_FILE_ID)
+
+    def _fallo(self, envio: dict, e: ErrorTelegram):
+        if e.status == 429:
+            # Telegram indica cuánto esperar; no cuenta como intento fallido
+            retry_after = e.retry_after or 1
+            self._espaciar_chat(envio["chat_id"], retry_after)
+            self._actualizar(
+                envio["id"], estado=PENDIENTE,
+                proximo_intento=time.time() + retry_after, error=str(e),
+            )
+        elif e.reintentable:
+            self._reintentar(envio, str(e))
+        else:
+            # 400/403 (chat inexistente, bot bloqueado...): reintentar no sirve
+            self._marcar_fallido(envio, str(e))
+
+    def _reintentar(self, envio: dict, error: str):
+        intentos = envio["intentos"] + 1
+        if intentos >= COLA_MAX_INTENTOS:
+            self._marcar_fallido(envio, error, intentos=intentos)
+            return
+        espera = min(COLA_BACKOFF_BASE_SEG * 2 ** intentos, COLA_BACKOFF_MAX_SEG)
+        self._actualizar(
+            envio["id"], estado=PENDIENTE, intentos=intentos,
+            proximo_intento=time.time() + espera, error=error,
+        )
+
+    def _marcar_fallido(self, envio: dict, error: str, **campos):
+        """
+        Marca el envío como fallido y cancela los pasos siguientes de su
+        lote en la misma transacción: _reclamar ya no bloquea el chat por
+        este envío, así que sin cancelar saldría el paso siguiente.
+        """
+        ahora = time.time()
+        cancelados = []
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            campos = {**campos, "estado": FALLIDO, "error": error, "actualizado": ahora}
+            con.execute(
+                f"UPDATE envios SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?",
+                (*campos.values(), envio["id"]),
+            )
+            if envio.get("lote"):
+                cancelados = [dict(r) for r in con.execute(
+                    "SELECT * FROM envios WHERE lote = ? AND id > ? AND estado = ?",
+                    (envio["lote"], envio["id"], PENDIENTE),
+                )]
+                con.execute(
+                    "UPDATE envios SET estado = ?, error = ?, actualizado = ?"
+                    " WHERE lote = ? AND id > ? AND estado = ?",
+                    (CANCELADO, f"Falló el paso {envio.get('paso') or envio['id']}", ahora,
+                     envio["lote"], envio["id"], PENDIENTE),
+                )
+            con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        for e in (envio, *cancelados):
+            self._borrar_archivos(e)
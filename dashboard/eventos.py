@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+# Eventos pendientes por pestaña; si una pestaña no los consume se descartan
+EVENTOS_MAX_COLA = int(os.getenv("EVENTOS_MAX_COLA", 100))
+# Eventos recientes guardados para reanudar con Last-Event-ID
+EVENTOS_HISTORIA = int(os.getenv("EVENTOS_HISTORIA", 200))
+EVENTOS_LATIDO_SEG = float(os.getenv("EVENTOS_LATIDO_SEG", 15))
+# Fuente de cambios hechos fuera del dashboard (bot, cron): Supabase
+# Realtime (por defecto; la tabla va en la publicación supabase_realtime,
+# ver sql/cambios_cotizaciones.sql). Con EVENTOS_REALTIME=0, o si Realtime
+# no conecta, un único sondeo de marca_cotizaciones() por proceso, solo
+# mientras haya pestañas abiertas
+EVENTOS_REALTIME = os.getenv("EVENTOS_REALTIME", "1") == "1"
+EVENTOS_REALTIME_ESPERA_SEG = float(os.getenv("EVENTOS_REALTIME_ESPERA_SEG", 10))
+EVENTOS_SONDEO_SEG = float(os.getenv("EVENTOS_SONDEO_SEG", 2))
+EVENTOS_SOLAPE_SEG = float(os.getenv("EVENTOS_SOLAPE_SEG", 5))
+# Filas por consulta del sondeo; una ráfaga mayor se lee en varias páginas
+EVENTOS_LOTE_SONDEO = int(os.getenv("EVENTOS_LOTE_SONDEO", 500))
+
+COLUMNAS = "id, username, fecha, monto, estado, created_at, updated_at"
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================================
+# BUS
+# ============================================================================
+
+class _ColaAsync:
+    """
+    Cola de un stream servido por el loop asyncio del servidor ASGI.
+    publicar() llega desde cualquier hilo, así que la entrega se agenda en
+    el loop; si la pestaña no consume, los eventos se descartan allí.
+    """
+
+    def __init__(self, bus: "BusEventos", loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.bus = bus
+        self.loop = loop
+        self.cola = asyncio.Queue(maxsize=maxsize)
+
+    def put_nowait(self, evento: dict):
+        self.loop.call_soon_threadsafe(self._poner, evento)
+
+    def _poner(self, evento: dict):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.bus.descartados += 1
+
+
+class BusEventos:
+    """
+    Pub/sub en memoria del proceso del dashboard. Cada stream SSE (una
+    pestaña) recibe su propia cola; publicar() nunca bloquea al que escribe.
+    Los streams solo los sirve servidor_asgi: bajo WSGI cada pestaña
+    retendría un hilo mientras siga abierta.
+    """
+
+    def __init__(self, max_cola: int = EVENTOS_MAX_COLA, historia: int = EVENTOS_HISTORIA):
+        self.max_cola = max_cola
+        self._lock = threading.Lock()
+        self._suscriptores = set()
+        self._oyentes = []
+        self._historia = deque(maxlen=historia)
+        self._seq = 0
+        self.publicados = 0
+        self.descartados = 0
+
+    def publicar(self, tipo: str, datos: dict):
+        # Los oyentes (p. ej. invalidar cachés) van antes que las pestañas,
+        # para que lo que éstas pidan al recibir el evento ya salga fresco
+        for oyente in self._oyentes:
+            try:
+                oyente(tipo, datos)
+            except Exception as e:
+                log.error(f"Error en oyente de eventos: {e}")
+        with self._lock:
+            self._seq += 1
+            evento = {"id": self._seq, "tipo": tipo, "datos": datos}
+            self._historia.append(evento)
+            self.publicados += 1
+            for cola in self._suscriptores:
+                cola.put_nowait(evento)
+
+    def escuchar(self, oyente):
+        """Registra oyente(tipo, datos), llamado en el hilo que publica"""
+        self._oyentes.append(oyente)
+
+    def publicar_cotizacion(self, fila: dict = None, borrado_id=None):
+        """Cambio de una cotización: la fila nueva o el id borrado"""
+        if borrado_id is not None:
+            self.publicar("cotizacion", {"id": borrado_id, "borrado": True})
+        elif fila and fila.get("id") is not None:
+            self.publicar("cotizacion", {"id": fila["id"], "estado": fila.get("estado"), "fila": fila})
+
+    def suscribir(self, loop: asyncio.AbstractEventLoop, ultimo_id: int = None):
+        """Cola para un stream de `loop`, que se consume con stream()"""
+        cola = _ColaAsync(self, loop, self.max_cola)
+        with self._lock:
+            if ultimo_id is not None:
+                for evento in self._historia:
+                    if evento["id"] > ultimo_id:
+                        cola.put_nowait(evento)
+            self._suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._suscriptores.discard(cola)
+
+    @property
+    def suscriptores(self) -> int:
+        return len(self._suscriptores)
+
+    async def stream(self, cola: _ColaAsync, latido: float = EVENTOS_LATIDO_SEG):
+        """Generador de texto SSE; el latido mantiene viva la conexión"""
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(cola.cola.get(), timeout=latido)
+                except asyncio.TimeoutError:
+                    yield ": latido\n\n"
+                    continue
+                yield self._sse(evento)
+        finally:
+            self.desuscribir(cola)
+
+    @staticmethod
+    def _sse(evento: dict) -> str:
+        return (
+            f"id: {evento['id']}\n"
+            f"event: {evento['tipo']}\n"
+            f"data: {json.dumps(evento['datos'], default=str)}\n\n"
+        )
+
+    def metricas(self) -> dict:
+        return {
+            "suscriptores": self.suscriptores,
+            "publicados": self.publicados,
+            "descartados": self.descartados,
+        }
+
+
+# ============================================================================
+# FUENTES EXTERNAS (bot, cron)
+# ============================================================================
+
+def _leer_desde(supabase, tabla: str, columnas: str, columna: str, base: str) -> list:
+    """
+    Todas las filas con `columna` > base, por páginas de keyset
+    (columna, id): una ráfaga de cambios no se corta en la primera página.
+    """
+    filas = []
+    consulta = supabase.table(tabla).select(columnas).gt(columna, base)
+    while True:
+        pagina = consulta.order(columna).order("id").limit(EVENTOS_LOTE_SONDEO).execute().data
+        filas.extend(pagina)
+        if len(pagina) < EVENTOS_LOTE_SONDEO:
+            return filas
+        ultima = pagina[-1]
+        consulta = supabase.table(tabla).select(columnas).or_(
+            f'{columna}.gt."{ultima[columna]}",'
+            f'and({columna}.eq."{ultima[columna]}",id.gt.{ultima["id"]})'
+        )
+
+
+def _sondear(bus: BusEventos, supabase, intervalo: float):
+    """Un solo sondeo por proceso; con 0 pestañas no consulta nada"""
+    marca = None
+    while True:
+        time.sleep(intervalo)
+        if not bus.suscriptores:
+            marca = None
+            continue
+        try:
+            actual = supabase.rpc("marca_cotizaciones", {}).execute().data
+            if marca is None or actual is None or actual == marca:
+                marca = actual
+                continue
+            base = (
+                datetime.fromisoformat(marca) - timedelta(seconds=EVENTOS_SOLAPE_SEG)
+            ).isoformat()
+            filas = _leer_desde(supabase, "cotizaciones", COLUMNAS, "updated_at", base)
+            borrados = _leer_desde(
+                supabase, "cotizaciones_borradas", "id, borrado_en", "borrado_en", base
+            )
+            for fila in filas:
+                bus.publicar_cotizacion(fila)
+            for r in borrados:
+                bus.publicar_cotizacion(borrado_id=r["id"])
+            # La marca avanza hasta lo último leído, no hasta `actual`: lo
+            # que cambie entre el rpc y las lecturas entra en el próximo ciclo
+            leidas = [f["updated_at"] for f in filas] + [r["borrado_en"] for r in borrados]
+            marca = max(leidas, key=datetime.fromisoformat) if leidas else actual
+        except Exception as e:
+            log.error(f"Error sondeando cambios: {e}")
+
+
+async def _escuchar_realtime(bus: BusEventos, url: str, key: str):
+    """
+    Publica en el bus los cambios de Supabase Realtime. Sale con excepción
+    si la suscripción no se confirma en EVENTOS_REALTIME_ESPERA_SEG o si
+    después se pierde, para que el hilo pase a sondear la BD.
+    """
+    from supabase import acreate_client
+
+    cliente = await acreate_client(url, key)
+    suscrito = asyncio.get_running_loop().create_future()
+    caida = asyncio.Event()
+
+    def al_cambiar(payload):
+        datos = payload.get("data", payload)
+        if datos.get("record"):
+            bus.publicar_cotizacion(datos["record"])
+        elif datos.get("old_record"):
+            bus.publicar_cotizacion(borrado_id=datos["old_record"].get("id"))
+
+    def al_suscribir(estado, error=None):
+        if suscrito.done():
+            if estado != "SUBSCRIBED":
+                caida.set()
+        elif estado == "SUBSCRIBED":
+            suscrito.set_result(None)
+        else:
+            suscrito.set_exception(RuntimeError(f"{estado} {error or ''}".strip()))
+
+    async def suscribir():
+        await (
+            cliente.channel("dashboard-cotizaciones")
+            .on_postgres_changes("*", schema="public", table="cotizaciones", callback=al_cambiar)
+            .subscribe(al_suscribir)
+        )
+        await suscrito
+
+    await asyncio.wait_for(suscribir(), timeout=EVENTOS_REALTIME_ESPERA_SEG)
+    log.info("Eventos del dashboard suscritos a Supabase Realtime")
+
+    # El cliente reconecta solo; si sigue desconectado en dos controles
+    # seguidos (o el canal se cierra) se deja Realtime
+    desconectado = 0
+    while desconectado < 2:
+        try:
+            await asyncio.wait_for(caida.wait(), timeout=EVENTOS_REALTIME_ESPERA_SEG)
+            raise RuntimeError("canal cerrado")
+        except asyncio.TimeoutError:
+            desconectado = 0 if cliente.realtime.is_connected else desconectado + 1
+    raise RuntimeError("conexión perdida")
+
+
+def _fuente(bus: BusEventos, supabase, url: str, key: str):
+    if EVENTOS_REALTIME and url and key:
+        try:
+            asyncio.run(_escuchar_realtime(bus, url, key))
+        except Exception as e:
+            log.error(f"Supabase Realtime no disponible, se sondea la BD: {e!r}")
+    _sondear(bus, supabase, EVENTOS_SONDEO_SEG)
+
+
+def iniciar_fuente(bus: BusEventos, supabase, url: str, key: str):
+    """Arranca el hilo que trae al bus los cambios hechos por otros procesos"""
+    hilo = threading.Thread(target=_fuente, args=(bus, supabase, url, key), daemon=True)
+    hilo.start()
+    return hilo
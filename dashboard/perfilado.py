@@ -0,0 +1,285 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+# Opt-in: sin DASHBOARD_PERFILADO=1 no se instala ningún hook
+PERFILADO_ACTIVO = os.getenv("DASHBOARD_PERFILADO", "0") == "1"
+# Peticiones más lentas que esto guardan su perfil (si fueron muestreadas)
+PERFILADO_UMBRAL_MS = float(os.getenv("PERFILADO_UMBRAL_MS", 500))
+# Fracción de peticiones que corren con el profiler encendido; no se sabe
+# si una petición será lenta hasta que termina, así que se muestrea antes
+PERFILADO_MUESTREO = float(os.getenv("PERFILADO_MUESTREO", 0.1))
+# cprofile (.prof, abrir con snakeviz/pstats) o pyinstrument (.html)
+PERFILADO_MOTOR = os.getenv("PERFILADO_MOTOR", "cprofile")
+PERFILADO_DIR = os.getenv("PERFILADO_DIR", "perfiles")
+PERFILADO_MAX_ARCHIVOS = int(os.getenv("PERFILADO_MAX_ARCHIVOS", 200))
+# Peticiones recientes que se conservan para la página de las más lentas
+PERFILADO_HISTORIA = int(os.getenv("PERFILADO_HISTORIA", 1000))
+
+FASES = ("db", "render", "http")
+
+log = logging.getLogger(__name__)
+
+# Un solo perfil a la vez por proceso: desde Python 3.12 cProfile usa
+# sys.monitoring, que es global, así que dos peticiones muestreadas en hilos
+# distintos chocarían (el segundo enable() falla) o mezclarían sus frames
+_muestreando = threading.Lock()
+
+
+# ============================================================================
+# PROFILERS
+# ============================================================================
+
+class _CProfile:
+    extension = "prof"
+
+    def __init__(self):
+        import cProfile
+
+        self.perfil = cProfile.Profile()
+
+    def iniciar(self):
+        self.perfil.enable()
+
+    def detener(self):
+        self.perfil.disable()
+
+    def guardar(self, ruta: str):
+        self.perfil.dump_stats(ruta)
+
+
+class _Pyinstrument:
+    extension = "html"
+
+    def __init__(self):
+        from pyinstrument import Profiler
+
+        self.perfil = Profiler()
+
+    def iniciar(self):
+        self.perfil.start()
+
+    def detener(self):
+        self.perfil.stop()
+
+    def guardar(self, ruta: str):
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(self.perfil.output_html())
+
+
+# ============================================================================
+# PERFILADOR
+# ============================================================================
+
+class Perfilador:
+    """
+    Desglose por fase de cada petición del dashboard: db (PostgREST), render
+    (Jinja), http (otras llamadas salientes) y python (el resto). Va en la
+    cabecera Server-Timing y en una historia en memoria; las peticiones
+    muestreadas que pasan del umbral dejan su perfil en PERFILADO_DIR.
+    Solo se perfila una petición a la vez por proceso (ver _muestreando).
+    """
+
+    def __init__(self, activo: bool = PERFILADO_ACTIVO, umbral_ms: float = PERFILADO_UMBRAL_MS,
+                 muestreo: float = PERFILADO_MUESTREO, motor: str = PERFILADO_MOTOR,
+                 directorio: str = PERFILADO_DIR, historia: int = PERFILADO_HISTORIA):
+        self.activo = activo
+        self.umbral_ms = umbral_ms
+        self.muestreo = muestreo
+        self.motor = _Pyinstrument if motor == "pyinstrument" else _CProfile
+        self.directorio = directorio
+        self._historia = deque(maxlen=historia)
+        self._lock = threading.Lock()
+        self.stats = {"peticiones": 0, "muestreadas": 0, "perfiles": 0}
+
+    # --- instalación ---
+
+    def instalar(self, app):
+        """Registra los hooks de Flask; no hace nada si no está activo"""
+        if not self.activo:
+            return
+        if self.motor is _Pyinstrument:
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                log.warning("pyinstrument no está instalado, se usa cProfile")
+                self.motor = _CProfile
+        os.makedirs(self.directorio, exist_ok=True)
+        app.before_request(self._al_empezar)
+        app.after_request(self._al_terminar)
+        app.teardown_request(self._al_cerrar)
+        before_render_template.connect(self._render_empieza, app)
+        template_rendered.connect(self._render_termina, app)
+        log.info("Perfilado de peticiones activo (umbral %s ms, muestreo %s)",
+                 self.umbral_ms, self.muestreo)
+
+    def hooks_httpx(self, fase: str) -> dict:
+        """event_hooks para un httpx.Client cuyas llamadas cuentan en `fase`"""
+        def marcar(req):
+            req.extensions["perfilado_inicio"] = time.perf_counter()
+
+        def observar(resp):
+            inicio = resp.request.extensions.get("perfilado_inicio")
+            if inicio is not None:
+                self.sumar(fase, (time.perf_counter() - inicio) * 1000)
+
+        return {"request": [marcar], "response": [observar]}
+
+    def medir_httpx(self, cliente, fase: str):
+        """Añade los hooks a un cliente httpx ya creado"""
+        if not self.activo:
+            return
+        hooks = cliente.event_hooks
+        for evento, funciones in self.hooks_httpx(fase).items():
+            hooks[evento].extend(funciones)
+        cliente.event_hooks = hooks
+
+    # --- medición ---
+
+    def sumar(self, fase: str, ms: float):
+        """Suma `ms` a la fase de la petición en curso (si la hay)"""
+        if not has_request_context():
+            return
+        fases = g.get("perfilado_fases")
+        if fases is None:
+            return
+        total, n = fases.get(fase, (0.0, 0))
+        fases[fase] = (total + ms, n + 1)
+
+    @contextmanager
+    def fase(self, nombre: str):
+        """Para medir a mano un tramo que no cubren los hooks"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sumar(nombre, (time.perf_counter() - inicio) * 1000)
+
+    def _render_empieza(self, sender, template, context, **extra):
+        g.setdefault("perfilado_render", []).append(time.perf_counter())
+
+    def _render_termina(self, sender, template, context, **extra):
+        pila = g.get("perfilado_render")
+        if pila:
+            inicio = pila.pop()
+            # Un include/extends anidado ya está dentro del render exterior
+            if not pila:
+                self.sumar("render", (time.perf_counter() - inicio) * 1000)
+
+    def _al_empezar(self):
+        if request.endpoint == "static":
+            return
+        g.perfilado_fases = {}
+        g.perfilado_inicio = time.perf_counter()
+        # Si otra petición ya se está perfilando, esta va sin perfil
+        if (self.muestreo > 0 and random.random() < self.muestreo
+                and _muestreando.acquire(blocking=False)):
+            try:
+                g.perfilado_perfil = self.motor()
+                g.perfilado_perfil.iniciar()
+            except Exception as e:
+                # Otro profiler del proceso (p. ej. un depurador) ya está activo
+                log.debug(f"No se pudo iniciar el perfil: {e}")
+                g.perfilado_perfil = None
+                _muestreando.release()
+
+    def _al_terminar(self, resp):
+        inicio = g.pop("perfilado_inicio", None)
+        if inicio is None or resp.is_streamed:
+            self._detener(g.pop("perfilado_perfil", None))
+            return resp
+        total_ms = (time.perf_counter() - inicio) * 1000
+        perfil = g.pop("perfilado_perfil", None)
+        self._detener(perfil)
+
+        fases = g.pop("perfilado_fases", {})
+        desglose = {f: round(fases.get(f, (0.0, 0))[0], 1) for f in FASES}
+        llamadas = {f: fases.get(f, (0.0, 0))[1] for f in FASES}
+        desglose["python"] = round(max(total_ms - sum(desglose.values()), 0.0), 1)
+
+        archivo = None
+        if perfil is not None and total_ms >= self.umbral_ms:
+            archivo = self._guardar(perfil, total_ms)
+
+        resp.headers["Server-Timing"] = ", ".join(
+            [f"{f};dur={ms}" for f, ms in desglose.items()] + [f"total;dur={total_ms:.1f}"]
+        )
+        with self._lock:
+            self.stats["peticiones"] += 1
+            if perfil is not None:
+                self.stats["muestreadas"] += 1
+            self._historia.append({
+                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "metodo": request.method,
+                "ruta": request.full_path.rstrip("?"),
+                "endpoint": request.endpoint,
+                "status": resp.status_code,
+                "total_ms": round(total_ms, 1),
+                "fases": desglose,
+                "llamadas": llamadas,
+                "perfil": archivo,
+            })
+        return resp
+
+    def _al_cerrar(self, exc):
+        # Sin after_request (excepción no manejada) el perfil sigue activo
+        self._detener(g.pop("perfilado_perfil", None))
+
+    @staticmethod
+    def _detener(perfil):
+        if perfil is not None:
+            try:
+                perfil.detener()
+            except Exception as e:
+                log.debug(f"No se pudo detener el perfil: {e}")
+            finally:
+                _muestreando.release()
+
+    def _guardar(self, perfil, total_ms: float):
+        nombre = (
+            f"{datetime.now():%Y%m%d-%H%M%S}-{request.endpoint or 'ruta'}"
+            f"-{int(total_ms)}ms-{os.getpid()}.{perfil.extension}"
+        )
+        try:
+            perfil.guardar(os.path.join(self.directorio, nombre))
+        except Exception as e:
+            log.error(f"No se pudo guardar el perfil {nombre}: {e}")
+            return None
+        with self._lock:
+            self.stats["perfiles"] += 1
+        self._podar()
+        return nombre
+
+    def _podar(self):
+        """Conserva solo los PERFILADO_MAX_ARCHIVOS perfiles más recientes"""
+        try:
+            archivos = sorted(
+                (e for e in os.scandir(self.directorio) if e.is_file()),
+                key=lambda e: e.stat().st_mtime,
+            )
+            for e in archivos[:-PERFILADO_MAX_ARCHIVOS]:
+                os.remove(e.path)
+        except OSError as e:
+            log.error(f"No se pudieron podar los perfiles: {e}")
+
+    # --- consulta ---
+
+    def mas_lentas(self, limite: int = 50) -> list:
+        with self._lock:
+            recientes = list(self._historia)
+        return sorted(recientes, key=lambda p: p["total_ms"], reverse=True)[:limite]
+
+    def metricas(self) -> dict:
+        return {**self.stats, "activo": self.activo, "umbral_ms": self.umbral_ms,
+                "muestreo": self.muestreo, "historia": len(self._historia)}
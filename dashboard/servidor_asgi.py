@@ -0,0 +1,155 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import anyio
+import httpx
+import uvicorn
+from postgrest import AsyncPostgrestClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+import app_dashboard as dashboard
+import metricas
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+# Modo de servicio asíncrono: python dashboard/servidor_asgi.py (o
+# uvicorn servidor_asgi:app). Solo dos rutas corren en el loop, sobre un
+# cliente PostgREST async: /api/eventos (SSE) y /api/resumen (sondeo), las
+# que atienden a todas las pestañas abiertas. Todo lo demás (páginas,
+# /accion/*, /metrics...) es la app Flask con el cliente Supabase sync,
+# detrás de un puente WSGI de DASHBOARD_HILOS_WSGI hilos: cada una de esas
+# peticiones sigue ocupando un hilo mientras dura.
+DASHBOARD_HILOS_WSGI = int(os.getenv("DASHBOARD_HILOS_WSGI", 20))
+ASGI_DB_CONEXIONES = int(os.getenv("ASGI_DB_CONEXIONES", 50))
+ASGI_DB_TIMEOUT_SEG = float(os.getenv("ASGI_DB_TIMEOUT_SEG", 10))
+
+log = logging.getLogger(__name__)
+
+try:
+    from a2wsgi import WSGIMiddleware
+
+    puente_wsgi = WSGIMiddleware(dashboard.app, workers=DASHBOARD_HILOS_WSGI)
+except ImportError:
+    # a2wsgi está en requirements.txt; el de Starlette (deprecado) queda
+    # como respaldo y usa el limitador de hilos de anyio
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+    puente_wsgi = WSGIMiddleware(dashboard.app)
+
+# Las páginas de las colas abren el EventSource solo si este servidor sirve
+# /api/eventos; con Flask solo sondean /api/resumen
+dashboard.app.config["EVENTOS_SSE"] = True
+
+
+# ============================================================================
+# CLIENTE POSTGREST ASÍNCRONO
+# ============================================================================
+
+def crear_cliente_db() -> AsyncPostgrestClient:
+    """Como CotizacionesRepo.get_cliente(): se crea ya dentro del loop"""
+    cliente = AsyncPostgrestClient(
+        f"{dashboard.SUPABASE_URL}/rest/v1",
+        headers={
+            "apikey": dashboard.SUPABASE_KEY,
+            "Authorization": f"Bearer {dashboard.SUPABASE_KEY}",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        },
+    )
+    cliente.session = httpx.AsyncClient(
+        base_url=cliente.session.base_url,
+        headers=cliente.session.headers,
+        timeout=ASGI_DB_TIMEOUT_SEG,
+        limits=httpx.Limits(
+            max_connections=ASGI_DB_CONEXIONES,
+            max_keepalive_connections=ASGI_DB_CONEXIONES,
+        ),
+        follow_redirects=True,
+        event_hooks=metricas.hooks_postgrest(asincrono=True),
+    )
+    return cliente
+
+
+# ============================================================================
+# RUTAS ASÍNCRONAS
+# ============================================================================
+
+async def api_resumen(request: Request):
+    """Misma respuesta que app_dashboard.api_resumen, sin ocupar un hilo"""
+    db: AsyncPostgrestClient = request.app.state.db
+    marca = (await db.rpc("marca_cotizaciones", {}).execute()).data or "0"
+    if parse_etags(request.headers.get("if-none-match")).contains(marca):
+        return Response(status_code=304, headers={"ETag": f'"{marca}"', "Cache-Control": "no-cache"})
+
+    async def leer_resumen():
+        return (await db.rpc("resumen_general", {}).execute()).data or {}
+
+    desde = request.query_params.get("desde")
+    if not desde or desde == marca:
+        return _json(*dashboard.cuerpo_resumen(marca, await leer_resumen()))
+    consultas = dashboard.consultas_resumen(db, desde)
+    if consultas is None:
+        return _json(*dashboard.cuerpo_resumen(marca, await leer_resumen(), recargar=True))
+    cambios, borrados = consultas
+    res_cambios, res_borrados, resumen = await asyncio.gather(
+        cambios.execute(), borrados.execute(), leer_resumen()
+    )
+    return _json(*dashboard.cuerpo_resumen(marca, resumen, res_cambios.data, res_borrados.data))
+
+
+def _json(cuerpo: dict, status: int, cabeceras: dict) -> JSONResponse:
+    return JSONResponse(cuerpo, status_code=status, headers=cabeceras)
+
+
+async def api_eventos(request: Request):
+    """Stream SSE de cotizaciones; cada pestaña es una tarea, no un hilo"""
+    ultimo = request.headers.get("last-event-id")
+    cola = dashboard.bus_eventos.suscribir(
+        asyncio.get_running_loop(),
+        int(ultimo) if ultimo and ultimo.isdigit() else None,
+    )
+    return StreamingResponse(
+        dashboard.bus_eventos.stream(cola),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ============================================================================
+# APP
+# ============================================================================
+
+@asynccontextmanager
+async def ciclo_de_vida(app_asgi: Starlette):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DASHBOARD_HILOS_WSGI
+    app_asgi.state.db = crear_cliente_db()
+    log.info("Dashboard ASGI: %s hilos para Flask, %s conexiones PostgREST async",
+             DASHBOARD_HILOS_WSGI, ASGI_DB_CONEXIONES)
+    try:
+        yield
+    finally:
+        await app_asgi.state.db.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/resumen", api_resumen, methods=["GET"]),
+        Route("/api/eventos", api_eventos, methods=["GET"]),
+        # Todo lo demás (páginas, acciones, /metrics...) lo atiende Flask
+        Mount("/", puente_wsgi),
+    ],
+    lifespan=ciclo_de_vida,
+)
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 8000))
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -0,0 +1,205 @@
+import os
+import time
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+# --- 1. CONFIGURACIÓN ---
+LEDGER_BACKEND = os.getenv("LEDGER_BACKEND", "sqlite")  # sqlite | supabase
+LEDGER_SQLITE_PATH = os.getenv("LEDGER_SQLITE_PATH", "recordatorios.db")
+LEDGER_TABLA = os.getenv("LEDGER_TABLA", "recordatorios_enviados")
+# Una reserva "enviando" más vieja que esto es de una corrida que murió
+LEDGER_RESERVA_SEG = int(os.getenv("LEDGER_RESERVA_SEG", 600))
+
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+
+# Tamaño máximo de cada IN (...) en las consultas por lote
+_TROZO = 500
+
+
+def _trozos(lista, n=_TROZO):
+    for i in range(0, len(lista), n):
+        yield lista[i:i + n]
+
+
+# --- 2. LEDGER ---
+
+class LedgerBase(ABC):
+    """
+    Registro de recordatorios ya enviados, por (vuelo, ventana).
+
+    reservar() marca en un solo paso los pares que esta corrida va a enviar
+    y descarta los que ya salieron o que otra corrida tiene en curso; así
+    dos corridas solapadas no duplican mensajes. Tras enviar, enviado()
+    confirma la reserva y fallido() la libera para la próxima corrida.
+
+    Cada envío se confirma en cuanto sale: si la corrida muere, solo los
+    mensajes en vuelo en ese momento (a lo sumo CRON_CONCURRENCIA) quedan
+    "enviando" y pueden repetirse cuando la reserva venza.
+    """
+
+    @abstractmethod
+    def reservar(self, ventana: str, vuelo_ids: list) -> set:
+        """Reserva los ids libres de la ventana y devuelve los reservados"""
+
+    @abstractmethod
+    def _confirmar(self, ventana: str, vuelo_ids: list):
+        """Pasa las reservas a enviado"""
+
+    @abstractmethod
+    def _liberar(self, ventana: str, vuelo_ids: list):
+        """Borra las reservas que siguen enviando"""
+
+    def enviado(self, ventana: str, vuelo_id):
+        self._confirmar(ventana, [str(vuelo_id)])
+
+    def fallido(self, ventana: str, vuelo_id):
+        self._liberar(ventana, [str(vuelo_id)])
+
+
+class LedgerSQLite(LedgerBase):
+
+    def __init__(self, ruta: str = LEDGER_SQLITE_PATH):
+        self.ruta = ruta
+        con = self._conectar()
+        try:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS recordatorios_enviados ("
+                " vuelo_id TEXT NOT NULL,"
+                " ventana TEXT NOT NULL,"
+                " estado TEXT NOT NULL,"
+                " actualizado REAL NOT NULL,"
+                " PRIMARY KEY (vuelo_id, ventana))"
+            )
+        finally:
+            con.close()
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+
+    def reservar(self, ventana: str, vuelo_ids: list) -> set:
+        ids = [str(i) for i in vuelo_ids]
+        ahora = time.time()
+        vigente = ahora - LEDGER_RESERVA_SEG
+        nuevos = set()
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            for trozo in _trozos(ids):
+                marcas = ",".join("?" * len(trozo))
+                tomados = {
+                    r[0] for r in con.execute(
+                        f"SELECT vuelo_id FROM recordatorios_enviados"
+                        f" WHERE ventana = ? AND vuelo_id IN ({marcas})"
+                        f" AND (estado = ? OR actualizado >= ?)",
+                        (ventana, *trozo, ENVIADO, vigente),
+                    )
+                }
+                libres = [i for i in trozo if i not in tomados]
+                con.executemany(
+                    "INSERT OR REPLACE INTO recordatorios_enviados"
+                    " (vuelo_id, ventana, estado, actualizado) VALUES (?, ?, ?, ?)",
+                    [(i, ventana, ENVIANDO, ahora) for i in libres],
+                )
+                nuevos.update(libres)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return nuevos
+
+    def _confirmar(self, ventana: str, vuelo_ids: list):
+        con = self._conectar()
+        try:
+            con.executemany(
+                "UPDATE recordatorios_enviados SET estado = ?, actualizado = ?"
+                " WHERE vuelo_id = ? AND ventana = ?",
+                [(ENVIADO, time.time(), i, ventana) for i in vuelo_ids],
+            )
+        finally:
+            con.close()
+
+    def _liberar(self, ventana: str, vuelo_ids: list):
+        con = self._conectar()
+        try:
+            con.executemany(
+                "DELETE FROM recordatorios_enviados"
+                " WHERE vuelo_id = ? AND ventana = ? AND estado = ?",
+                [(i, ventana, ENVIANDO) for i in vuelo_ids],
+            )
+        finally:
+            con.close()
+
+
+class LedgerSupabase(LedgerBase):
+    """Misma lógica sobre una tabla de Supabase (ver sql/recordatorios_enviados.sql)"""
+
+    def __init__(self, cliente, tabla: str = LEDGER_TABLA):
+        self.db = cliente
+        self.tabla = tabla
+
+    @staticmethod
+    def _iso(ts: float) -> str:
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+    def reservar(self, ventana: str, vuelo_ids: list) -> set:
+        ids = [str(i) for i in vuelo_ids]
+        ahora = self._iso(time.time())
+        vencidas = self._iso(time.time() - LEDGER_RESERVA_SEG)
+        nuevos = set()
+        for trozo in _trozos(ids):
+            # Pares nuevos: el insert ignora duplicados y devuelve solo lo insertado
+            insertados = (
+                self.db.table(self.tabla)
+                .upsert(
+                    [{"vuelo_id": i, "ventana": ventana, "estado": ENVIANDO, "actualizado": ahora}
+                     for i in trozo],
+                    on_conflict="vuelo_id,ventana",
+                    ignore_duplicates=True,
+                )
+                .execute()
+                .data
+            )
+            # Reservas abandonadas por una corrida que murió
+            retomados = (
+                self.db.table(self.tabla)
+                .update({"actualizado": ahora})
+                .eq("ventana", ventana)
+                .eq("estado", ENVIANDO)
+                .lt("actualizado", vencidas)
+                .in_("vuelo_id", trozo)
+                .execute()
+                .data
+            )
+            nuevos.update(r["vuelo_id"] for r in insertados + retomados)
+        return nuevos
+
+    def _confirmar(self, ventana: str, vuelo_ids: list):
+        for trozo in _trozos(vuelo_ids):
+            (
+                self.db.table(self.tabla)
+                .update({"estado": ENVIADO, "actualizado": self._iso(time.time())})
+                .eq("ventana", ventana)
+                .in_("vuelo_id", trozo)
+                .execute()
+            )
+
+    def _liberar(self, ventana: str, vuelo_ids: list):
+        (
+            self.db.table(self.tabla)
+            .delete()
+            .eq("ventana", ventana)
+            .eq("estado", ENVIANDO)
+            .in_("vuelo_id", vuelo_ids)
+            .execute()
+        )
+
+
+def crear_ledger(cliente_supabase=None) -> LedgerBase:
+    """SQLite local por defecto; LEDGER_BACKEND=supabase para compartirlo"""
+    if LEDGER_BACKEND == "supabase":
+        return LedgerSupabase(cliente_supabase)
+    return LedgerSQLite()
@@ -0,0 +1,133 @@
+import time
+from typing import Callable, Optional
+
+from metricas import HANDLER_SEGUNDOS
+
+# Tipos de entrada que distingue el despachador
+TEXTO = "texto"
+FOTO = "foto"
+
+# Estado comodín para los botones del menú (válidos desde cualquier estado)
+CUALQUIERA = "*"
+
+
+class MaquinaEstados:
+    """
+    Tabla de transiciones de la conversación del bot.
+
+    Cada handler se registra para una clave (estado, tipo de entrada) o para
+    una etiqueta del menú, y despachar() lo encuentra con una sola búsqueda
+    en diccionario en vez de recorrer una cadena de if/elif.
+
+    Un botón del menú interrumpe el paso en curso, salvo en los estados que
+    declara en `salvo_en`: ahí el texto va primero al handler del estado.
+    """
+
+    def __init__(self):
+        self._menu = {}           # etiqueta -> handler
+        self._salvo_en = {}       # etiqueta -> estados que no interrumpe
+        self._transiciones = {}   # (estado, tipo) -> handler
+        self._destinos = {}       # clave -> estados a los que puede llevar
+        self.stats = {}
+
+    # --- registro ---
+
+    def menu(self, etiqueta: str, destinos=(), salvo_en=()):
+        """
+        Botón del menú, válido desde cualquier estado y con prioridad sobre
+        el handler del estado actual, excepto en los estados de `salvo_en`.
+        Sin `destinos` el botón no cambia de estado.
+        """
+        def decorador(fn):
+            self._menu[etiqueta] = fn
+            self._salvo_en[etiqueta] = frozenset(salvo_en)
+            self._destinos[(CUALQUIERA, etiqueta)] = tuple(destinos)
+            return fn
+        return decorador
+
+    def en(self, estado: str, tipo: str = TEXTO, destinos=()):
+        """Entrada de tipo `tipo` recibida estando en `estado`"""
+        def decorador(fn):
+            self._transiciones[(estado, tipo)] = fn
+            self._destinos[(estado, tipo)] = tuple(destinos)
+            return fn
+        return decorador
+
+    # --- despacho ---
+
+    def resolver(self, estado: Optional[str], tipo: str, texto: Optional[str] = None):
+        """Devuelve (clave, handler); handler None si no hay transición"""
+        es_menu = tipo == TEXTO and texto in self._menu
+        if es_menu and estado not in self._salvo_en[texto]:
+            return (CUALQUIERA, texto), self._menu[texto]
+        clave = (estado, tipo)
+        handler = self._transiciones.get(clave)
+        if handler is None and es_menu:
+            return (CUALQUIERA, texto), self._menu[texto]
+        return clave, handler
+
+    async def despachar(self, update, context, tipo: str, por_defecto: Callable = None):
+        texto = update.message.text if tipo == TEXTO else None
+        clave, handler = self.resolver(context.user_data.get("estado"), tipo, texto)
+        if handler is None:
+            clave, handler = (context.user_data.get("estado"), tipo), por_defecto
+            if handler is None:
+                return
+
+        inicio = time.perf_counter()
+        try:
+            await handler(update, context)
+        finally:
+            self._registrar(clave, (time.perf_counter() - inicio) * 1000)
+
+    def _registrar(self, clave, ms: float):
+        s = self.stats.setdefault(clave, {"hits": 0, "total_ms": 0.0, "max_ms": 0.0})
+        s["hits"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+        HANDLER_SEGUNDOS.observar(ms / 1000, estado=clave[0] or "ninguno", entrada=clave[1])
+
+    # --- inspección ---
+
+    def metricas(self) -> list:
+        """Transiciones ordenadas por tiempo total acumulado"""
+        filas = []
+        for (estado, entrada), s in self.stats.items():
+            filas.append({
+                "estado": estado,
+                "entrada": entrada,
+                "hits": s["hits"],
+                "prom_ms": round(s["total_ms"] / s["hits"], 2),
+                "max_ms": round(s["max_ms"], 2),
+                "total_ms": round(s["total_ms"], 2),
+            })
+        return sorted(filas, key=lambda f: f["total_ms"], reverse=True)
+
+    def grafo_dot(self) -> str:
+        """
+        Grafo de la conversación en formato Graphviz. Los botones del menú
+        salen de cada estado en el que interrumpen (líneas punteadas: el
+        paso en curso se cancela).
+        """
+        nombre = lambda estado: estado or "inicio"
+        lineas = ["digraph conversacion {", "  rankdir=LR;"]
+        for (estado, entrada), destinos in self._destinos.items():
+            if estado == CUALQUIERA:
+                continue
+            for destino in destinos or (None,):
+                lineas.append(
+                    f'  "{nombre(estado)}" -> "{nombre(destino)}" [label="{entrada}"];'
+                )
+
+        estados = {None} | {e for e, _ in self._transiciones}
+        estados |= {d for destinos in self._destinos.values() for d in destinos}
+        for etiqueta in self._menu:
+            destinos = self._destinos[(CUALQUIERA, etiqueta)]
+            for estado in sorted(estados - self._salvo_en[etiqueta], key=nombre):
+                for destino in destinos or (estado,):
+                    estilo = ", style=dashed" if destinos else ""
+                    lineas.append(
+                        f'  "{nombre(estado)}" -> "{nombre(destino)}" [label="{etiqueta}"{estilo}];'
+                    )
+        lineas.append("}")
+        return "\n".join(lineas)
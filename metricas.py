@@ -0,0 +1,348 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import httpx
+
+# --- 1. CONFIGURACIÓN ---
+# Procesos sin servidor HTTP (cron): exportación al terminar cada corrida
+# Ruta .prom para el textfile collector de node_exporter
+METRICAS_TEXTFILE = os.getenv("METRICAS_TEXTFILE")
+# URL de un Pushgateway, ej. http://pushgateway:9091
+METRICAS_PUSHGATEWAY_URL = os.getenv("METRICAS_PUSHGATEWAY_URL")
+METRICAS_TIMEOUT_SEG = float(os.getenv("METRICAS_TIMEOUT_SEG", 5))
+
+# Segundos; cubren desde una lectura en caché hasta un envío de archivos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+log = logging.getLogger(__name__)
+
+
+# --- 2. TIPOS DE MÉTRICA ---
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: dict) -> tuple:
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"{self.nombre} espera las etiquetas {self.etiquetas}")
+        return tuple(str(etiquetas[n]) for n in self.etiquetas)
+
+    def _muestras(self):
+        """[(sufijo, etiquetas_texto, valor)]"""
+        with self._lock:
+            return [("", _etiquetas(self.etiquetas, k), v) for k, v in self._valores.items()]
+
+    def exponer(self) -> str:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for sufijo, etiquetas, valor in self._muestras():
+            lineas.append(f"{self.nombre}{sufijo}{etiquetas} {_numero(valor)}")
+        return "\n".join(lineas)
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """
+    Gauge. Además de set(), acepta funciones que se evalúan al exportar
+    (profundidad de una cola, suscriptores...): con etiquetas, la función
+    devuelve {valor_etiqueta o tupla: número}; sin ellas, un número.
+    """
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._funciones = []
+
+    def set(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    def registrar_funcion(self, funcion: Callable, **fijas):
+        """fijas: etiquetas de valor fijo; la función da el resto"""
+        self._funciones.append((funcion, fijas))
+
+    def _muestras(self):
+        muestras = super()._muestras()
+        for funcion, fijas in self._funciones:
+            try:
+                resultado = funcion()
+            except Exception as e:
+                log.error(f"Error evaluando {self.nombre}: {e}")
+                continue
+            if not isinstance(resultado, dict):
+                resultado = {(): resultado}
+            libres = [n for n in self.etiquetas if n not in fijas]
+            for clave, valor in resultado.items():
+                clave = clave if isinstance(clave, tuple) else (clave,)
+                valores = dict(fijas, **dict(zip(libres, clave)))
+                muestras.append(("", _etiquetas(self.etiquetas, self._clave(valores)), valor))
+        return muestras
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._valores.get(clave)
+            if serie is None:
+                # [conteos por bucket (no acumulados)..., suma]
+                serie = self._valores[clave] = [0] * len(self.buckets) + [0.0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+                    break
+            serie[-1] += valor
+
+    def _muestras(self):
+        muestras = []
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._valores.items()]
+        for clave, serie in series:
+            acumulado = 0
+            for limite, n in zip(self.buckets, serie):
+                acumulado += n
+                muestras.append(
+                    ("_bucket", _etiquetas(self.etiquetas, clave, f'le="{_numero(limite)}"'), acumulado)
+                )
+            muestras.append(("_sum", _etiquetas(self.etiquetas, clave), serie[-1]))
+            muestras.append(("_count", _etiquetas(self.etiquetas, clave), acumulado))
+        return muestras
+
+
+# --- 3. REGISTRO ---
+
+class Registro:
+    """Métricas del proceso; pedir dos veces el mismo nombre da la misma métrica"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _obtener(self, clase, nombre: str, ayuda: str, etiquetas: tuple, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, ayuda, etiquetas, **kwargs)
+            elif not isinstance(metrica, clase) or metrica.etiquetas != tuple(etiquetas):
+                raise ValueError(f"La métrica {nombre} ya existe con otro tipo o etiquetas")
+            return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        return self._obtener(Contador, nombre, ayuda, etiquetas)
+
+    def medidor(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Medidor:
+        return self._obtener(Medidor, nombre, ayuda, etiquetas)
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (),
+                   buckets: tuple = BUCKETS) -> Histograma:
+        return self._obtener(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+    def exponer(self) -> str:
+        """Formato de texto de Prometheus"""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return "\n".join(m.exponer() for m in metricas) + "\n"
+
+    def escribir_textfile(self, ruta: str):
+        # Escritura atómica: node_exporter nunca lee un archivo a medias
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(self.exponer())
+        os.replace(temporal, ruta)
+
+    def empujar(self, url: str, job: str):
+        """PUT al Pushgateway: reemplaza las métricas anteriores del job"""
+        r = httpx.put(
+            f"{url.rstrip('/')}/metrics/job/{job}",
+            content=self.exponer().encode(),
+            headers={"Content-Type": TIPO_CONTENIDO},
+            timeout=METRICAS_TIMEOUT_SEG,
+        )
+        r.raise_for_status()
+
+
+REGISTRO = Registro()
+
+
+def exponer() -> str:
+    return REGISTRO.exponer()
+
+
+def exportar_lote(job: str):
+    """Exportación para procesos sin /metrics: textfile y/o Pushgateway"""
+    if METRICAS_TEXTFILE:
+        try:
+            REGISTRO.escribir_textfile(METRICAS_TEXTFILE)
+        except OSError as e:
+            log.error(f"No se pudo escribir {METRICAS_TEXTFILE}: {e}")
+    if METRICAS_PUSHGATEWAY_URL:
+        try:
+            REGISTRO.empujar(METRICAS_PUSHGATEWAY_URL, job)
+        except httpx.HTTPError as e:
+            log.error(f"No se pudo empujar métricas al Pushgateway: {e}")
+
+
+# --- 4. MÉTRICAS COMPARTIDAS ---
+# Mismos nombres en bot, dashboard y cron; Prometheus los separa por job
+
+HANDLER_SEGUNDOS = REGISTRO.histograma(
+    "bot_handler_segundos",
+    "Duración de los handlers de la conversación por estado y entrada",
+    ("estado", "entrada"),
+)
+DB_SEGUNDOS = REGISTRO.histograma(
+    "supabase_consulta_segundos",
+    "Latencia de PostgREST hasta la respuesta, por tabla y operación",
+    ("tabla", "operacion"),
+)
+DB_ERRORES = REGISTRO.contador(
+    "supabase_errores_total",
+    "Respuestas de error (4xx/5xx) de PostgREST",
+    ("tabla", "operacion"),
+)
+TG_SEGUNDOS = REGISTRO.histograma(
+    "telegram_api_segundos",
+    "Latencia de las llamadas a la Bot API por método",
+    ("metodo",),
+)
+TG_ERRORES = REGISTRO.contador(
+    "telegram_api_errores_total",
+    "Llamadas a la Bot API con error (incluye 429)",
+    ("metodo",),
+)
+TG_429 = REGISTRO.contador(
+    "telegram_api_429_total",
+    "Respuestas 429 (flood control) de la Bot API",
+    ("metodo",),
+)
+COLA_PROFUNDIDAD = REGISTRO.medidor(
+    "cola_profundidad",
+    "Elementos esperando o en curso en cada cola del proceso",
+    ("cola",),
+)
+
+
+def registrar_telegram(metodo: str, segundos: float, status: Optional[int] = None):
+    """status: None si fue bien; código HTTP (o 0 si fue la red) si falló"""
+    TG_SEGUNDOS.observar(segundos, metodo=metodo)
+    if status is not None:
+        TG_ERRORES.inc(metodo=metodo)
+        if status == 429:
+            TG_429.inc(metodo=metodo)
+
+
+# --- 5. INSTRUMENTACIÓN DE CLIENTES httpx ---
+# Hooks de eventos: se mide hasta que llegan las cabeceras de la respuesta
+# (el cuerpo ya está calculado en el servidor). Los errores de red no
+# llegan al hook de respuesta y no se cuentan aquí.
+
+def _operacion_postgrest(request: httpx.Request):
+    partes = request.url.path.split("/rest/v1/", 1)[-1].strip("/").split("/")
+    if partes[0] == "rpc" and len(partes) > 1:
+        return partes[1], "rpc"
+    metodo = request.method
+    if metodo == "POST":
+        upsert = "resolution=" in request.headers.get("prefer", "")
+        return partes[0], "upsert" if upsert else "insert"
+    return partes[0], {
+        "GET": "select", "HEAD": "count", "PATCH": "update", "DELETE": "delete",
+    }.get(metodo, metodo.lower())
+
+
+def _observar_postgrest(response: httpx.Response):
+    inicio = response.request.extensions.get("metricas_inicio")
+    if inicio is None:
+        return
+    tabla, operacion = _operacion_postgrest(response.request)
+    DB_SEGUNDOS.observar(time.perf_counter() - inicio, tabla=tabla, operacion=operacion)
+    if response.status_code >= 400:
+        DB_ERRORES.inc(tabla=tabla, operacion=operacion)
+
+
+def _observar_telegram(response: httpx.Response):
+    inicio = response.request.extensions.get("metricas_inicio")
+    if inicio is None:
+        return
+    metodo = response.request.url.path.rsplit("/", 1)[-1]
+    status = response.status_code if response.status_code >= 400 else None
+    registrar_telegram(metodo, time.perf_counter() - inicio, status)
+
+
+def _marcar(request: httpx.Request):
+    request.extensions["metricas_inicio"] = time.perf_counter()
+
+
+def _hooks(observar: Callable, asincrono: bool) -> dict:
+    if not asincrono:
+        return {"request": [_marcar], "response": [observar]}
+
+    async def marcar(request):
+        _marcar(request)
+
+    async def observar_async(response):
+        observar(response)
+
+    return {"request": [marcar], "response": [observar_async]}
+
+
+def hooks_postgrest(asincrono: bool = False) -> dict:
+    """event_hooks para un cliente httpx que habla con PostgREST"""
+    return _hooks(_observar_postgrest, asincrono)
+
+
+def hooks_telegram(asincrono: bool = True) -> dict:
+    """event_hooks para un cliente httpx que habla con la Bot API"""
+    return _hooks(_observar_telegram, asincrono)
+
+
+def instrumentar_supabase(cliente):
+    """Añade los hooks a la sesión PostgREST de un cliente supabase síncrono"""
+    sesion = cliente.postgrest.session
+    hooks = sesion.event_hooks
+    for evento, funciones in hooks_postgrest(asincrono=False).items():
+        hooks[evento].extend(funciones)
+    sesion.event_hooks = hooks
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timezone
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# --- 1. CONFIGURACIÓN ---
+ESTADO_BACKEND = os.getenv("ESTADO_BACKEND", "sqlite")  # sqlite | supabase
+ESTADO_SQLITE_PATH = os.getenv("ESTADO_SQLITE_PATH", "estados.db")
+ESTADO_TABLA = os.getenv("ESTADO_TABLA", "estados_conversacion")
+# Conversaciones sin actividad por más de este tiempo se descartan
+ESTADO_TTL_SEG = int(os.getenv("ESTADO_TTL_SEG", 24 * 3600))
+# Cada cuánto se escriben en lote los estados modificados
+ESTADO_FLUSH_SEG = float(os.getenv("ESTADO_FLUSH_SEG", 5))
+# Reintento de un lote fallido: espera inicial, se duplica hasta el máximo
+ESTADO_REINTENTO_SEG = float(os.getenv("ESTADO_REINTENTO_SEG", 1))
+ESTADO_REINTENTO_MAX_SEG = float(os.getenv("ESTADO_REINTENTO_MAX_SEG", 60))
+
+log = logging.getLogger(__name__)
+
+
+# --- 2. BACKENDS ---
+
+class AlmacenSQLite:
+    """Estados en un archivo SQLite local (por defecto)"""
+
+    def __init__(self, ruta: str = ESTADO_SQLITE_PATH):
+        self.ruta = ruta
+        self._con = sqlite3.connect(ruta, check_same_thread=False)
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS estados ("
+            " user_id INTEGER PRIMARY KEY,"
+            " datos TEXT NOT NULL,"
+            " actualizado REAL NOT NULL)"
+        )
+        self._con.commit()
+
+    def _cargar(self, desde: float):
+        filas = self._con.execute(
+            "SELECT user_id, datos, actualizado FROM estados WHERE actualizado >= ?",
+            (desde,),
+        ).fetchall()
+        return {uid: (json.loads(datos), ts) for uid, datos, ts in filas}
+
+    def _guardar(self, lote: dict):
+        self._con.executemany(
+            "INSERT INTO estados (user_id, datos, actualizado) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "datos = excluded.datos, actualizado = excluded.actualizado",
+            [(uid, datos, ts) for uid, (datos, ts) in lote.items()],
+        )
+        self._con.commit()
+
+    def _borrar(self, ids):
+        self._con.executemany("DELETE FROM estados WHERE user_id = ?", [(i,) for i in ids])
+        self._con.commit()
+
+    def _purgar(self, antes_de: float):
+        self._con.execute("DELETE FROM estados WHERE actualizado < ?", (antes_de,))
+        self._con.commit()
+
+    async def cargar(self, desde: float) -> dict:
+        return await asyncio.to_thread(self._cargar, desde)
+
+    async def guardar(self, lote: dict):
+        await asyncio.to_thread(self._guardar, lote)
+
+    async def borrar(self, ids):
+        await asyncio.to_thread(self._borrar, list(ids))
+
+    async def purgar(self, antes_de: float):
+        await asyncio.to_thread(self._purgar, antes_de)
+
+    async def cerrar(self):
+        self._con.close()
+
+
+class AlmacenSupabase:
+    """Estados en una tabla de Supabase (ver sql/estados_conversacion.sql)"""
+
+    def __init__(self, cliente, tabla: str = ESTADO_TABLA):
+        # cliente: AsyncPostgrestClient ya configurado (p. ej. repo.get_cliente())
+        self.cliente = cliente
+        self.tabla = tabla
+
+    @staticmethod
+    def _iso(ts: float) -> str:
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+    async def cargar(self, desde: float) -> dict:
+        res = await (
+            self.cliente.table(self.tabla)
+            .select("user_id, datos, actualizado")
+            .gte("actualizado", self._iso(desde))
+            .execute()
+        )
+        return {
+            int(r["user_id"]): (
+                r["datos"],
+                datetime.fromisoformat(r["actualizado"]).timestamp(),
+            )
+            for r in res.data
+        }
+
+    async def guardar(self, lote: dict):
+        # Un solo upsert para todo el lote
+        filas = [
+            {"user_id": uid, "datos": json.loads(datos), "actualizado": self._iso(ts)}
+            for uid, (datos, ts) in lote.items()
+        ]
+        await self.cliente.table(self.tabla).upsert(filas, on_conflict="user_id").execute()
+
+    async def borrar(self, ids):
+        await self.cliente.table(self.tabla).delete().in_("user_id", list(ids)).execute()
+
+    async def purgar(self, antes_de: float):
+        await (
+            self.cliente.table(self.tabla)
+            .delete()
+            .lt("actualizado", self._iso(antes_de))
+            .execute()
+        )
+
+    async def cerrar(self):
+        pass
+
+
+# --- 3. PERSISTENCIA PARA LA APPLICATION ---
+
+class PersistenciaEstados(BasePersistence):
+    """
+    Guarda context.user_data (estado de los flujos del bot) para que un
+    reinicio o un segundo worker no pierda cotizaciones o pagos a medias.
+
+    La Application marca como modificados los user_data de cada update y
+    cada ESTADO_FLUSH_SEG los entrega aquí; todos los de una misma vuelta
+    se escriben en un solo lote.
+    """
+
+    def __init__(self, almacen, ttl_seg: int = ESTADO_TTL_SEG, flush_seg: float = ESTADO_FLUSH_SEG):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=flush_seg,
+        )
+        self.almacen = almacen
+        self.ttl_seg = ttl_seg
+        self._tocado = {}       # user_id -> última actividad (epoch)
+        self._pendientes = {}   # user_id -> (json, epoch)
+        self._borrados = set()
+        self._tarea_lote = None
+        self._tarea_reintento = None
+        self._espera_reintento = ESTADO_REINTENTO_SEG
+        self._lock = asyncio.Lock()
+
+    # --- user_data ---
+
+    async def get_user_data(self) -> dict:
+        ahora = time.time()
+        await self.almacen.purgar(ahora - self.ttl_seg)
+        cargados = await self.almacen.cargar(ahora - self.ttl_seg)
+        self._tocado = {uid: ts for uid, (_, ts) in cargados.items()}
+        log.info("Estados de conversación recuperados: %s", len(cargados))
+        return {uid: datos for uid, (datos, _) in cargados.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        ahora = time.time()
+        self._tocado[user_id] = ahora
+        self._borrados.discard(user_id)
+        self._pendientes[user_id] = (json.dumps(data), ahora)
+        self._programar_lote()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._tocado.pop(user_id, None)
+        self._pendientes.pop(user_id, None)
+        self._borrados.add(user_id)
+        self._programar_lote()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    def expirados(self) -> list:
+        """user_id sin actividad por más de ttl_seg"""
+        limite = time.time() - self.ttl_seg
+        return [uid for uid, ts in self._tocado.items() if ts < limite]
+
+    # --- escritura en lote ---
+
+    def _programar_lote(self):
+        # Todas las llamadas de una vuelta de update_persistence corren antes
+        # que esta tarea, así que terminan en la misma escritura
+        if self._tarea_lote is None or self._tarea_lote.done():
+            self._tarea_lote = asyncio.create_task(self._escribir_lote())
+
+    async def _escribir_lote(self):
+        await asyncio.sleep(0)
+        async with self._lock:
+            lote, self._pendientes = self._pendientes, {}
+            borrados, self._borrados = self._borrados, set()
+            try:
+                if lote:
+                    await self.almacen.guardar(lote)
+                if borrados:
+                    await self.almacen.borrar(borrados)
+                self._espera_reintento = ESTADO_REINTENTO_SEG
+            except Exception as e:
+                log.error(f"Error guardando estados, reintento en {self._espera_reintento}s: {e}")
+                # Vuelven a pendientes sin pisar datos más nuevos
+                for uid, valor in lote.items():
+                    self._pendientes.setdefault(uid, valor)
+                self._borrados |= borrados - set(self._pendientes)
+                self._programar_reintento()
+
+    def _programar_reintento(self):
+        if self._tarea_reintento is None or self._tarea_reintento.done():
+            espera = self._espera_reintento
+            self._espera_reintento = min(espera * 2, ESTADO_REINTENTO_MAX_SEG)
+            self._tarea_reintento = asyncio.create_task(self._reintentar(espera))
+
+    async def _reintentar(self, espera: float):
+        await asyncio.sleep(espera)
+        self._programar_lote()
+
+    async def flush(self) -> None:
+        if self._tarea_reintento is not None:
+            self._tarea_reintento.cancel()
+        if self._tarea_lote is not None:
+            await self._tarea_lote
+        await self._escribir_lote()
+        await self.almacen.cerrar()
+
+    # --- datos que no se persisten ---
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+
+def crear_persistencia(repo=None) -> PersistenciaEstados:
+    """SQLite local por defecto; ESTADO_BACKEND=supabase para el clúster"""
+    if ESTADO_BACKEND == "supabase":
+        if repo is None:
+            raise ValueError("El backend supabase necesita el repo de cotizaciones")
+        return PersistenciaEstados(AlmacenSupabase(repo.get_cliente()))
+    return PersistenciaEstados(AlmacenSQLite())
+
+
+async def purgar_expirados(application, persistencia: PersistenciaEstados, cada_seg: float = 600):
+    """Quita de memoria (y del backend) las conversaciones abandonadas"""
+    while True:
+        await asyncio.sleep(cada_seg)
+        for uid in persistencia.expirados():
+            application.drop_user_data(uid)
@@ -0,0 +1,63 @@
+import os
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Máximo de updates procesándose a la vez (usuarios distintos en paralelo)
+BOT_CONCURRENCIA = int(os.getenv("BOT_CONCURRENCIA", 32))
+
+
+class ProcesadorPorUsuario(BaseUpdateProcessor):
+    """
+    Procesa updates de usuarios distintos en paralelo, pero los de un mismo
+    usuario uno por uno y en orden de llegada (la máquina de estados de
+    user_data["estado"] depende de ello).
+
+    Cada update espera primero el turno de su usuario y solo entonces toma
+    uno de los `concurrencia` huecos de la clase base: los mensajes en cola
+    de un usuario no ocupan huecos, así que una ráfaga de uno solo no frena
+    a los demás.
+    """
+
+    def __init__(self, concurrencia: int = BOT_CONCURRENCIA):
+        super().__init__(concurrencia)
+        self.concurrencia = concurrencia
+        # user_id -> [lock, updates pendientes de ese usuario]
+        self._turnos = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        uid = None
+        if isinstance(update, Update) and update.effective_user:
+            uid = update.effective_user.id
+
+        if uid is None:
+            await super().process_update(update, coroutine)
+            return
+
+        turno = self._turnos.setdefault(uid, [asyncio.Lock(), 0])
+        turno[1] += 1
+        try:
+            async with turno[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            turno[1] -= 1
+            if turno[1] == 0:
+                self._turnos.pop(uid, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    def usuarios_activos(self) -> int:
+        return len(self._turnos)
+
+    def en_cola(self) -> int:
+        """Updates de usuarios esperando turno o procesándose"""
+        return sum(pendientes for _, pendientes in self._turnos.values())
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,125 @@
+import os
+import hmac
+import asyncio
+import logging
+import secrets
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application
+
+from metricas import COLA_PROFUNDIDAD, TIPO_CONTENIDO, exponer
+
+# --- 1. CONFIGURACIÓN ---
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # ej. https://mi-bot.onrender.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Si no se define, se genera uno nuevo en cada arranque (se registra con set_webhook)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Updates aceptados que aún no terminan de procesarse
+WEBHOOK_MAX_COLA = int(os.getenv("WEBHOOK_MAX_COLA", 256))
+# Cuánto espera una petición por un hueco antes de responder 503
+WEBHOOK_ESPERA_SEG = float(os.getenv("WEBHOOK_ESPERA_SEG", 2))
+
+log = logging.getLogger(__name__)
+
+
+# --- 2. SERVIDOR ASGI ---
+
+def crear_app_asgi(application: Application) -> Starlette:
+    """Health check y endpoint del webhook en el mismo servidor"""
+    cupos = asyncio.BoundedSemaphore(WEBHOOK_MAX_COLA)
+    estado = {"en_cola": 0, "rechazados": 0}
+
+    async def procesar(update: Update):
+        try:
+            await application.update_processor.process_update(
+                update, application.process_update(update)
+            )
+        finally:
+            estado["en_cola"] -= 1
+            cupos.release()
+
+    async def home(request: Request):
+        return PlainTextResponse("Sistema Vuelos Pro - Online 🚀")
+
+    async def metrics(request: Request):
+        return Response(exponer(), media_type=TIPO_CONTENIDO)
+
+    async def webhook(request: Request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+        # En bytes: compare_digest() con str no ASCII lanza TypeError (500)
+        if token is None or not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return Response(status_code=403)
+
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            return Response(status_code=400)
+
+        # Backpressure: si la cola está llena, Telegram reintenta más tarde
+        try:
+            await asyncio.wait_for(cupos.acquire(), timeout=WEBHOOK_ESPERA_SEG)
+        except asyncio.TimeoutError:
+            estado["rechazados"] += 1
+            log.warning("Cola de webhook llena (%s), update rechazado", WEBHOOK_MAX_COLA)
+            return Response(status_code=503)
+
+        estado["en_cola"] += 1
+        application.create_task(procesar(update), update=update)
+        return Response(status_code=200)
+
+    app_asgi = Starlette(
+        routes=[
+            Route("/", home, methods=["GET", "HEAD"]),
+            Route("/metrics", metrics, methods=["GET"]),
+            Route(WEBHOOK_PATH, webhook, methods=["POST"]),
+        ]
+    )
+    app_asgi.state.webhook = estado
+    COLA_PROFUNDIDAD.registrar_funcion(lambda: estado["en_cola"], cola="webhook")
+    return app_asgi
+
+
+# --- 3. ARRANQUE ---
+
+async def _correr(application: Application):
+    port = int(os.environ.get("PORT", 10000))
+    servidor = uvicorn.Server(
+        uvicorn.Config(
+            crear_app_asgi(application),
+            host="0.0.0.0",
+            port=port,
+            log_level="info",
+        )
+    )
+
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=min(100, WEBHOOK_MAX_COLA),
+            )
+            await application.start()
+            try:
+                await servidor.serve()
+            finally:
+                await application.stop()
+    finally:
+        # Como run_polling: después de shutdown(), que vuelca la persistencia
+        # con el cliente del repo todavía abierto
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def correr_webhook(application: Application):
+    """Sustituye a run_polling + hilo Flask: un solo servidor para todo"""
+    asyncio.run(_correr(application))
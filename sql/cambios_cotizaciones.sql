@@ -0,0 +1,61 @@
+-- Marca de cambios para /api/resumen (auto-refresco del dashboard).
+-- updated_at se mantiene por trigger y los borrados dejan una lápida, así
+-- marca_cotizaciones() responde "¿cambió algo?" leyendo solo dos índices.
+
+alter table cotizaciones add column if not exists updated_at timestamptz not null default now();
+create index if not exists cotizaciones_updated_idx on cotizaciones (updated_at, id);
+
+create or replace function _tocar_updated_at() returns trigger language plpgsql as $$
+begin
+    new.updated_at := clock_timestamp();
+    return new;
+end $$;
+
+drop trigger if exists cotizaciones_updated_at on cotizaciones;
+create trigger cotizaciones_updated_at
+    before update on cotizaciones
+    for each row execute function _tocar_updated_at();
+
+create table if not exists cotizaciones_borradas (
+    id         bigint primary key,
+    borrado_en timestamptz not null default clock_timestamp()
+);
+create index if not exists cotizaciones_borradas_idx on cotizaciones_borradas (borrado_en);
+
+create or replace function _registrar_borrado() returns trigger language plpgsql as $$
+begin
+    insert into cotizaciones_borradas (id) values (old.id)
+    on conflict (id) do update set borrado_en = clock_timestamp();
+    return null;
+end $$;
+
+drop trigger if exists cotizaciones_borrado on cotizaciones;
+create trigger cotizaciones_borrado
+    after delete on cotizaciones
+    for each row execute function _registrar_borrado();
+
+create or replace function marca_cotizaciones() returns timestamptz
+language sql stable as $$
+    select greatest(
+        (select max(updated_at) from cotizaciones),
+        (select max(borrado_en) from cotizaciones_borradas)
+    );
+$$;
+
+-- Supabase Realtime: fuente de eventos por defecto del dashboard
+-- (dashboard/eventos.py); sin esto cada proceso sondea marca_cotizaciones()
+do $$
+begin
+    if exists (select 1 from pg_publication where pubname = 'supabase_realtime')
+       and not exists (
+           select 1 from pg_publication_tables
+           where pubname = 'supabase_realtime'
+             and schemaname = 'public' and tablename = 'cotizaciones'
+       ) then
+        alter publication supabase_realtime add table public.cotizaciones;
+    end if;
+end $$;
+
+-- Las lápidas solo sirven a clientes con una marca reciente; un cliente
+-- con una marca más vieja que esto debe recargar la página completa.
+-- delete from cotizaciones_borradas where borrado_en < now() - interval '7 days';
@@ -0,0 +1,9 @@
+-- Estado de los flujos del bot (context.user_data) para ESTADO_BACKEND=supabase
+create table if not exists estados_conversacion (
+    user_id     bigint primary key,
+    datos       jsonb not null default '{}'::jsonb,
+    actualizado timestamptz not null default now()
+);
+
+create index if not exists estados_conversacion_actualizado_idx
+    on estados_conversacion (actualizado);
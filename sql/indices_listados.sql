@@ -0,0 +1,15 @@
+-- Índices para la paginación por cursor de las vistas del dashboard
+-- (pagina_keyset en dashboard/app_dashboard.py): cada página es un
+-- recorrido acotado del índice, sin importar el tamaño de la cola.
+
+-- por_cotizar, validar_pagos, por_enviar_qr: estado + (created_at, id)
+create index if not exists cotizaciones_estado_created_idx
+    on cotizaciones (estado, created_at desc, id desc);
+
+-- historial: (created_at, id)
+create index if not exists cotizaciones_created_idx
+    on cotizaciones (created_at desc, id desc);
+
+-- proximos_vuelos: (fecha, id)
+create index if not exists cotizaciones_fecha_idx
+    on cotizaciones (fecha, id);
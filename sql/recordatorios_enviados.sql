@@ -0,0 +1,8 @@
+-- Ledger de recordatorios del cron para LEDGER_BACKEND=supabase
+create table if not exists recordatorios_enviados (
+    vuelo_id    text not null,
+    ventana     text not null,
+    estado      text not null,
+    actualizado timestamptz not null default now(),
+    primary key (vuelo_id, ventana)
+);
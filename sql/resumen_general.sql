@@ -0,0 +1,97 @@
+-- Agregados de la página General (/) y de historial_usuario mantenidos
+-- por trigger. resumen_general() y la fila de resumen_usuarios se leen en
+-- una sola llamada, sin recorrer cotizaciones: su costo no crece con el
+-- tamaño de la tabla.
+
+create table if not exists resumen_por_estado (
+    estado text primary key,
+    vuelos bigint not null default 0,
+    monto  numeric not null default 0
+);
+
+create table if not exists resumen_usuarios (
+    username text primary key,
+    vuelos   bigint not null default 0
+);
+-- Estadísticas por usuario (pagos = estado Pago Confirmado / QR Enviados)
+alter table resumen_usuarios add column if not exists pagados bigint not null default 0;
+alter table resumen_usuarios add column if not exists total_pagado numeric not null default 0;
+alter table resumen_usuarios add column if not exists ultima_actividad timestamptz;
+
+-- Historial por usuario paginado por (created_at, id)
+create index if not exists cotizaciones_username_created_idx
+    on cotizaciones (username, created_at desc, id desc);
+
+create or replace function _resumen_aplicar(p_estado text, p_username text, p_monto numeric, p_signo int)
+returns void language plpgsql as $$
+declare
+    v_pagado int := case when p_estado in ('Pago Confirmado', 'QR Enviados') then p_signo else 0 end;
+begin
+    insert into resumen_por_estado as r (estado, vuelos, monto)
+    values (coalesce(p_estado, ''), p_signo, p_signo * coalesce(p_monto, 0))
+    on conflict (estado) do update
+        set vuelos = r.vuelos + excluded.vuelos,
+            monto  = r.monto + excluded.monto;
+
+    if coalesce(p_username, '') <> '' then
+        insert into resumen_usuarios as u
+            (username, vuelos, pagados, total_pagado, ultima_actividad)
+        values (
+            p_username, p_signo, v_pagado, v_pagado * coalesce(p_monto, 0),
+            case when p_signo > 0 then now() end
+        )
+        on conflict (username) do update
+            set vuelos = u.vuelos + excluded.vuelos,
+                pagados = u.pagados + excluded.pagados,
+                total_pagado = u.total_pagado + excluded.total_pagado,
+                ultima_actividad = greatest(u.ultima_actividad, excluded.ultima_actividad);
+        delete from resumen_usuarios where username = p_username and vuelos <= 0;
+    end if;
+end $$;
+
+create or replace function _resumen_trigger() returns trigger language plpgsql as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform _resumen_aplicar(old.estado, old.username, old.monto::numeric, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform _resumen_aplicar(new.estado, new.username, new.monto::numeric, 1);
+    end if;
+    return null;
+end $$;
+
+drop trigger if exists cotizaciones_resumen on cotizaciones;
+create trigger cotizaciones_resumen
+    after insert or update of estado, username, monto or delete on cotizaciones
+    for each row execute function _resumen_trigger();
+
+-- Carga inicial (bloquea escrituras mientras recalcula)
+begin;
+lock table cotizaciones in share row exclusive mode;
+truncate resumen_por_estado, resumen_usuarios;
+insert into resumen_por_estado (estado, vuelos, monto)
+    select coalesce(estado, ''), count(*), coalesce(sum(monto::numeric), 0)
+    from cotizaciones group by 1;
+insert into resumen_usuarios (username, vuelos, pagados, total_pagado, ultima_actividad)
+    select username,
+           count(*),
+           count(*) filter (where estado in ('Pago Confirmado', 'QR Enviados')),
+           coalesce(sum(monto::numeric) filter (where estado in ('Pago Confirmado', 'QR Enviados')), 0),
+           max(created_at)
+    from cotizaciones where coalesce(username, '') <> '' group by 1;
+commit;
+
+create or replace function resumen_general() returns json
+language sql stable as $$
+    select json_build_object(
+        'usuarios_unicos', (select count(*) from resumen_usuarios),
+        'total_recaudado', (
+            select coalesce(sum(monto), 0) from resumen_por_estado
+            where estado in ('Pago Confirmado', 'QR Enviados')
+        ),
+        'por_estado', (
+            select coalesce(json_object_agg(estado, vuelos), '{}'::json)
+            from resumen_por_estado where vuelos > 0
+        )
+    );
+$$;
@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import registrar_telegram
+
+# --- 1. CONFIGURACIÓN ---
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TG_TIMEOUT_SEG = float(os.getenv("TG_TIMEOUT_SEG", 10))
+TG_TIMEOUT_ARCHIVOS_SEG = float(os.getenv("TG_TIMEOUT_ARCHIVOS_SEG", 30))
+TG_POOL = int(os.getenv("TG_POOL", 10))
+
+
+class ErrorTelegram(Exception):
+    """Respuesta de error de la Bot API (status None = error de red)"""
+
+    def __init__(self, status: Optional[int], descripcion: str, retry_after: float = None):
+        super().__init__(f"{status}: {descripcion}" if status else descripcion)
+        self.status = status
+        self.descripcion = descripcion
+        self.retry_after = retry_after
+
+    @property
+    def reintentable(self) -> bool:
+        """Red caída, 429 o 5xx; un 400/403 no mejora reintentando"""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+# --- 2. LIMITADOR DE TASA ---
+
+class LimitadorTasa:
+    """Token bucket asíncrono: como máximo `por_seg` envíos por segundo"""
+
+    def __init__(self, por_seg: float, rafaga: int = None):
+        self.por_seg = por_seg
+        self.capacidad = rafaga or max(1, int(por_seg))
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def esperar(self):
+        async with self._lock:
+            while True:
+                ahora = time.monotonic()
+                self._tokens = min(
+                    self.capacidad, self._tokens + (ahora - self._ultimo) * self.por_seg
+                )
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.por_seg)
+
+
+# --- 3. MÉTRICAS ---
+
+class _Metricas:
+    def __init__(self):
+        self.stats = {}
+
+    def registrar(self, metodo: str, ms: float, error: Optional[ErrorTelegram] = None):
+        s = self.stats.setdefault(
+            metodo,
+            {"llamadas": 0, "errores": 0, "throttled": 0, "total_ms": 0.0, "max_ms": 0.0},
+        )
+        s["llamadas"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+        if error is not None:
+            s["errores"] += 1
+            if error.status == 429:
+                s["throttled"] += 1
+        registrar_telegram(metodo, ms / 1000, None if error is None else error.status or 0)
+
+    def metricas(self) -> dict:
+        salida = {}
+        for metodo, s in self.stats.items():
+            salida[metodo] = {
+                **s,
+                "prom_ms": round(s["total_ms"] / s["llamadas"], 2) if s["llamadas"] else 0.0,
+            }
+        return salida
+
+
+def _resultado(status: int, cuerpo: dict, texto: str):
+    """Devuelve result o lanza ErrorTelegram"""
+    if status == 200 and cuerpo.get("ok", True):
+        return cuerpo.get("result")
+    retry_after = cuerpo.get("parameters", {}).get("retry_after")
+    raise ErrorTelegram(
+        status,
+        cuerpo.get("description") or texto[:200],
+        float(retry_after) if retry_after is not None else None,
+    )
+
+
+# --- 4. CLIENTE SÍNCRONO (scripts) ---
+
+class TelegramSync:
+    """Bot API sobre una requests.Session con conexiones keep-alive"""
+
+    def __init__(self, token: str, timeout: float = TG_TIMEOUT_SEG, pool: int = TG_POOL):
+        self.base = f"{TELEGRAM_API_URL}/bot{token}"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        self._metricas = _Metricas()
+
+    def llamar(self, metodo: str, datos: dict, files: dict = None):
+        timeout = TG_TIMEOUT_ARCHIVOS_SEG if files else self.timeout
+        inicio = time.perf_counter()
+        error = None
+        try:
+            try:
+                r = self.session.post(
+                    f"{self.base}/{metodo}", data=datos, files=files, timeout=timeout
+                )
+            except requests.RequestException as e:
+                raise ErrorTelegram(None, f"red: {e}") from e
+            try:
+                cuerpo = r.json()
+            except ValueError:
+                cuerpo = {}
+            return _resultado(r.status_code, cuerpo, r.text)
+        except ErrorTelegram as e:
+            error = e
+            raise
+        finally:
+            self._metricas.registrar(metodo, (time.perf_counter() - inicio) * 1000, error)
+
+    def enviar_mensaje(self, chat_id: int, texto: str):
+        return self.llamar("sendMessage", {"chat_id": chat_id, "text": texto})
+
+    def enviar_foto(self, chat_id: int, foto, caption: str = ""):
+        """foto: tupla (nombre, archivo, mimetype) como en requests"""
+        return self.llamar("sendPhoto", {"chat_id": chat_id, "caption": caption}, {"photo": foto})
+
+    def metricas(self) -> dict:
+        return self._metricas.metricas()
+
+    def cerrar(self):
+        self.session.close()
+
+
+# --- 5. CLIENTE ASÍNCRONO (workers, cron) ---
+
+class TelegramAsync:
+    """Bot API sobre un httpx.AsyncClient con pool keep-alive"""
+
+    def __init__(self, token: str, timeout: float = TG_TIMEOUT_SEG, pool: int = TG_POOL):
+        self.base = f"{TELEGRAM_API_URL}/bot{token}"
+        self.timeout = timeout
+        self.pool = pool
+        self._http: Optional[httpx.AsyncClient] = None
+        self._metricas = _Metricas()
+
+    def _get_http(self) -> httpx.AsyncClient:
+        # Se crea dentro del loop que lo va a usar
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool, max_keepalive_connections=self.pool),
+            )
+        return self._http
+
+    async def llamar(self, metodo: str, datos: dict, files: dict = None):
+        timeout = TG_TIMEOUT_ARCHIVOS_SEG if files else self.timeout
+        inicio = time.perf_counter()
+        error = None
+        try:
+            try:
+                r = await self._get_http().post(
+                    f"{self.base}/{metodo}", data=datos, files=files, timeout=timeout
+                )
+            except httpx.HTTPError as e:
+                raise ErrorTelegram(None, f"red: {e}") from e
+            try:
+                cuerpo = r.json()
+            except ValueError:
+                cuerpo = {}
+            return _resultado(r.status_code, cuerpo, r.text)
+        except ErrorTelegram as e:
+            error = e
+            raise
+        finally:
+            self._metricas.registrar(metodo, (time.perf_counter() - inicio) * 1000, error)
+
+    async def enviar_mensaje(self, chat_id: int, texto: str):
+        return await self.llamar("sendMessage", {"chat_id": chat_id, "text": texto})
+
+    async def enviar_foto(self, chat_id: int, foto, caption: str = ""):
+        return await self.llamar(
+            "sendPhoto", {"chat_id": chat_id, "caption": caption}, {"photo": foto}
+        )
+
+    def metricas(self) -> dict:
+        return self._metricas.metricas()
+
+    async def cerrar(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
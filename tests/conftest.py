@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "dashboard"), os.path.join(RAIZ, "benchmarks")]
+
+from falsos import PostgrestFalso, BotApiFalso
+
+
+@pytest.fixture(scope="session")
+def postgrest():
+    """PostgREST falso en memoria, compartido por toda la sesión"""
+    db = PostgrestFalso(0)
+    yield db
+    db.cerrar()
+
+
+@pytest.fixture(scope="session")
+def dashboard(postgrest, tmp_path_factory):
+    """app_dashboard importado contra los falsos (se configura al importar)"""
+    tg = BotApiFalso(0)
+    spool = tmp_path_factory.mktemp("cola")
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "falsa.falsa.falsa",
+        "TELEGRAM_API_URL": tg.url,
+        "BOT_TOKEN": "123:falso",
+        "EVENTOS_REALTIME": "0",
+        "COLA_DB_PATH": str(spool / "envios.db"),
+        "COLA_ARCHIVOS_DIR": str(spool / "archivos"),
+    })
+    import app_dashboard
+
+    yield app_dashboard
+    tg.cerrar()
@@ -0,0 +1,133 @@
+import io
+import os
+import asyncio
+
+import pytest
+
+import cola_envios
+from cola_envios import ColaEnvios, ErrorTelegram, PENDIENTE, ENVIADO, FALLIDO, CANCELADO
+
+
+class Upload:
+    """Lo mínimo de un FileStorage de Werkzeug que usa guardar_archivo()"""
+
+    def __init__(self, datos: bytes):
+        self.stream = io.BytesIO(datos)
+        self.filename = "qr.png"
+        self.mimetype = "image/png"
+
+
+@pytest.fixture
+def cola(tmp_path, monkeypatch):
+    # Sin espaciado por chat: cada test reclama en cuanto el envío se cierra
+    monkeypatch.setattr(cola_envios, "TG_CHAT_POR_SEG", 1000)
+    return ColaEnvios("123:falso", str(tmp_path / "envios.db"), str(tmp_path / "archivos"))
+
+
+def drenar(cola, llamar):
+    """Reclama y envía hasta vaciar la cola, con un loop propio"""
+    cola.tg.llamar = llamar
+
+    async def principal():
+        cola._loop = asyncio.get_running_loop()
+        cola._hay_trabajo = asyncio.Event()
+        while (envio := await asyncio.to_thread(cola._reclamar)) is not None:
+            await cola._enviar(envio)
+
+    try:
+        asyncio.run(principal())
+    finally:
+        cola._loop = cola._hay_trabajo = None
+
+
+def test_orden_por_chat(cola):
+    a1 = cola.encolar_mensaje(1, "uno")
+    a2 = cola.encolar_mensaje(1, "dos")
+    b1 = cola.encolar_mensaje(2, "otro chat")
+
+    assert cola._reclamar()["id"] == a1
+    # a2 espera a que a1 se cierre; el otro chat no
+    assert cola._reclamar()["id"] == b1
+    assert cola._reclamar() is None
+    assert cola.estado(a2)["estado"] == PENDIENTE
+
+    cola._actualizar(a1, estado=ENVIADO)
+    assert cola._reclamar()["id"] == a2
+
+
+def test_reintento_bloquea_los_siguientes_del_chat(cola):
+    a1 = cola.encolar_mensaje(1, "uno")
+    cola.encolar_mensaje(1, "dos")
+    envio = cola._reclamar()
+    cola._reintentar(envio, "red caída")
+    # a1 volvió a pendiente con backoff: a2 no puede adelantarse
+    assert cola.estado(a1)["estado"] == PENDIENTE
+    assert cola._reclamar() is None
+
+
+def test_chat_espaciado_no_se_reclama(cola):
+    cola.encolar_mensaje(1, "uno")
+    cola._espaciar_chat(1, 60)
+    assert cola._reclamar() is None
+    cola._espaciar_chat(1, 0)
+    assert cola._reclamar() is not None
+
+
+def test_archivo_compartido_vive_hasta_la_ultima_referencia(cola):
+    a = cola.guardar_archivo(Upload(b"mismo qr"))
+    b = cola.guardar_archivo(Upload(b"mismo qr"))
+    assert a["ruta"] == b["ruta"]
+    assert os.listdir(cola.archivos_dir) == [a["hash"]]
+
+    envio_id = cola.encolar_foto(1, a)
+    cola._borrar_archivos(cola._reclamar())
+    assert os.path.exists(a["ruta"]), "b sigue referenciándolo"
+
+    cola.descartar_archivos([b])
+    assert not os.path.exists(a["ruta"])
+    assert cola.estado(envio_id) is not None
+
+
+def test_lote_fallido_cancela_el_resto_y_no_corre_la_accion(cola):
+    hechos = []
+    cola.registrar_accion("cerrar", hechos.append)
+    lote = cola.nuevo_lote()
+    cola.encolar_mensaje(1, "instrucciones", ref=7, paso="instrucciones", lote=lote)
+    cola.encolar_foto(1, Upload(b"qr"), ref=7, paso="qr", lote=lote)
+    cola.encolar_mensaje(1, "listo", ref=7, paso="cierre", lote=lote, accion="cerrar")
+
+    async def llamar(metodo, datos, files=None):
+        if metodo == "sendPhoto":
+            raise ErrorTelegram(403, "Forbidden: bot was blocked by the user")
+        return {"message_id": 1}
+
+    drenar(cola, llamar)
+    assert [(p["paso"], p["estado"]) for p in cola.pasos(7)] == [
+        ("instrucciones", ENVIADO), ("qr", FALLIDO), ("cierre", CANCELADO),
+    ]
+    assert cola.trabajos([7])["7"]["paso"] == "qr"
+    assert hechos == []
+    # El QR del paso fallido no queda en el spool
+    assert os.listdir(cola.archivos_dir) == []
+
+
+def test_lote_entregado_corre_la_accion_al_final(cola):
+    hechos = []
+    cola.registrar_accion("cerrar", hechos.append)
+    lote = cola.nuevo_lote()
+    cola.encolar_mensaje(1, "instrucciones", ref=8, paso="instrucciones", lote=lote)
+    cola.encolar_mensaje(1, "listo", ref=8, paso="cierre", lote=lote, accion="cerrar")
+    assert cola.trabajos([8]) == {"8": {"estado": "en_curso"}}
+
+    async def llamar(metodo, datos, files=None):
+        assert hechos == []
+        return {"message_id": 1}
+
+    drenar(cola, llamar)
+    assert hechos == ["8"]
+    assert cola.trabajos([8]) == {"8": {"estado": "enviado"}}
+
+
+def test_error_de_file_id():
+    assert ColaEnvios._es_error_file_id(ErrorTelegram(400, "Bad Request: wrong file identifier/HTTP URL specified"))
+    assert not ColaEnvios._es_error_file_id(ErrorTelegram(400, "Bad Request: chat not found"))
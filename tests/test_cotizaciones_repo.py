@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from cotizaciones_repo import CotizacionesRepo, ESTADOS_CERRADOS
+
+
+@pytest.fixture
+def vuelo(postgrest):
+    with postgrest.lock:
+        return postgrest.insertar("cotizaciones", {
+            "user_id": "10", "username": "ana", "estado": "Cotizado", "monto": 100.0,
+        })
+
+
+def correr(postgrest, operacion):
+    """Corre operacion(repo) en un loop nuevo y cierra el pool al terminar"""
+    async def principal():
+        repo = CotizacionesRepo(postgrest.url, "falsa.falsa.falsa")
+        try:
+            return await operacion(repo)
+        finally:
+            await repo.cerrar()
+    return asyncio.run(principal())
+
+
+def fila(postgrest, v_id):
+    with postgrest.lock:
+        return next((dict(f) for f in postgrest.tabla("cotizaciones") if f["id"] == v_id), None)
+
+
+def test_actualizar_de_otro_usuario_no_cambia_nada(postgrest, vuelo):
+    filas = correr(postgrest, lambda repo: repo.actualizar(
+        vuelo["id"], {"monto": 1.0}, user_id=99
+    ))
+    assert filas == []
+    assert fila(postgrest, vuelo["id"])["monto"] == 100.0
+
+
+def test_actualizar_respeta_estados_excluidos(postgrest, vuelo):
+    with postgrest.lock:
+        postgrest.tabla("cotizaciones")[-1]["estado"] = "Pago Confirmado"
+    filas = correr(postgrest, lambda repo: repo.actualizar(
+        vuelo["id"], {"estado": "Esperando atención"}, user_id=10,
+        estados_excluidos=ESTADOS_CERRADOS,
+    ))
+    assert filas == []
+    assert fila(postgrest, vuelo["id"])["estado"] == "Pago Confirmado"
+
+
+def test_actualizar_condicional_devuelve_la_fila_y_refresca_cache(postgrest, vuelo):
+    async def operacion(repo):
+        await repo.obtener_resumen(vuelo["id"])  # deja el vuelo en caché
+        filas = await repo.actualizar(
+            vuelo["id"], {"estado": "Esperando atención"}, user_id=10,
+            estados_excluidos=ESTADOS_CERRADOS,
+        )
+        return filas, await repo.obtener_resumen(vuelo["id"])
+
+    filas, resumen = correr(postgrest, operacion)
+    assert [f["id"] for f in filas] == [vuelo["id"]]
+    assert resumen["estado"] == "Esperando atención"
+
+
+def test_borrar_condicional(postgrest, vuelo):
+    ajeno = correr(postgrest, lambda repo: repo.borrar(vuelo["id"], user_id=99))
+    assert ajeno == []
+    assert fila(postgrest, vuelo["id"]) is not None
+
+    borradas = correr(postgrest, lambda repo: repo.borrar(
+        vuelo["id"], user_id=10, estados_excluidos=ESTADOS_CERRADOS
+    ))
+    assert [f["id"] for f in borradas] == [vuelo["id"]]
+    assert fila(postgrest, vuelo["id"]) is None
@@ -0,0 +1,86 @@
+import pytest
+
+TABLA = "pruebas_keyset"
+
+
+@pytest.fixture
+def filas(dashboard, postgrest):
+    """Nueve filas; varias comparten created_at para probar el desempate por id"""
+    marcas = [
+        "2024-05-01T10:00:00+00:00",
+        "2024-05-01T10:00:00+00:00",
+        "2024-05-01T10:00:00+00:00",
+        "2024-05-02T08:30:00.5+00:00",
+        "2024-05-02T08:30:00.5+00:00",
+        "2024-05-03T00:00:00+00:00",
+        "2024-05-03T00:00:00+00:00",
+        "2024-05-03T00:00:00+00:00",
+        "2024-05-04T12:00:00+00:00",
+    ]
+    with postgrest.lock:
+        postgrest.tablas[TABLA] = []
+        return [postgrest.insertar(TABLA, {"created_at": m, "nombre": f"v{i}"})
+                for i, m in enumerate(marcas)]
+
+
+def recorrer(dashboard, limite, desc=True):
+    vistos, cursor = [], None
+    while True:
+        pagina, cursor = dashboard.pagina_keyset(
+            dashboard.supabase.table(TABLA).select("id, created_at"), cursor, limite, desc=desc
+        )
+        assert len(pagina) <= limite
+        vistos.extend(f["id"] for f in pagina)
+        if cursor is None:
+            return vistos
+
+
+def test_leer_cursor(dashboard):
+    assert dashboard.leer_cursor(None) is None
+    assert dashboard.leer_cursor("") is None
+    assert dashboard.leer_cursor("2024-05-01T10:00:00+00:00|12") == ("2024-05-01T10:00:00+00:00", 12)
+    # El valor puede contener "|": el id es lo que va tras el último
+    assert dashboard.leer_cursor("a|b|3") == ("a|b", 3)
+
+
+@pytest.mark.parametrize("cursor", ["basura", "|3", "2024-05-01|", "2024-05-01|x", "2024|-1"])
+def test_leer_cursor_invalido(dashboard, cursor):
+    with pytest.raises(dashboard.CursorInvalido):
+        dashboard.leer_cursor(cursor)
+
+
+def test_literal_postgrest(dashboard):
+    assert dashboard.literal_postgrest("2024-05-01T10:00:00+00:00") == '"2024-05-01T10:00:00+00:00"'
+    assert dashboard.literal_postgrest('a,b)"c\\') == '"a,b)\\"c\\\\"'
+
+
+def test_cortar_pagina(dashboard):
+    filas = [{"id": i, "created_at": f"t{i}"} for i in range(4)]
+    assert dashboard.cortar_pagina(filas[:3], 3) == (filas[:3], None)
+    assert dashboard.cortar_pagina(filas, 3) == (filas[:3], "t2|2")
+
+
+@pytest.mark.parametrize("limite", [1, 2, 3, 4, 9, 20])
+def test_recorre_todo_sin_duplicar_ni_saltear(dashboard, filas, limite):
+    esperado = [f["id"] for f in sorted(filas, key=lambda f: (f["created_at"], f["id"]), reverse=True)]
+    assert recorrer(dashboard, limite) == esperado
+    assert recorrer(dashboard, limite, desc=False) == esperado[::-1]
+
+
+def test_filas_nuevas_no_desplazan_la_pagina(dashboard, postgrest, filas):
+    tabla = dashboard.supabase.table(TABLA)
+    primera, cursor = dashboard.pagina_keyset(tabla.select("id, created_at"), None, 4)
+    with postgrest.lock:
+        postgrest.insertar(TABLA, {"created_at": "2024-06-01T00:00:00+00:00"})
+    segunda, _ = dashboard.pagina_keyset(
+        dashboard.supabase.table(TABLA).select("id, created_at"), cursor, 4
+    )
+    assert not {f["id"] for f in primera} & {f["id"] for f in segunda}
+    assert segunda[0]["id"] == sorted(
+        filas, key=lambda f: (f["created_at"], f["id"]), reverse=True
+    )[4]["id"]
+
+
+def test_cursor_invalido_responde_400(dashboard):
+    cliente = dashboard.app.test_client()
+    assert cliente.get("/historial?cursor=basura").status_code == 400
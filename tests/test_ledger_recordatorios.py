@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+import ledger_recordatorios
+from ledger_recordatorios import LedgerBase, LedgerSQLite, LedgerSupabase
+
+
+@pytest.fixture(params=["sqlite", "supabase"])
+def ledger(request, tmp_path, postgrest):
+    if request.param == "sqlite":
+        return LedgerSQLite(str(tmp_path / "recordatorios.db"))
+    from supabase import create_client
+    with postgrest.lock:
+        postgrest.tablas.pop("recordatorios_enviados", None)
+    return LedgerSupabase(create_client(postgrest.url, "falsa.falsa.falsa"))
+
+
+def test_base_es_abstracta():
+    with pytest.raises(TypeError):
+        LedgerBase()
+
+
+def test_reservar_excluye_en_curso_y_enviados(ledger):
+    assert ledger.reservar("24h", [1, 2, 3]) == {"1", "2", "3"}
+    # Otra corrida solapada no toma lo que la primera tiene en curso
+    assert ledger.reservar("24h", [1, 2, 3, 4]) == {"4"}
+    ledger.enviado("24h", 1)
+    assert ledger.reservar("24h", [1]) == set()
+    # Cada ventana lleva su propio registro
+    assert ledger.reservar("2h", [1]) == {"1"}
+
+
+def test_fallido_libera_para_la_proxima_corrida(ledger):
+    ledger.reservar("24h", [7, 8])
+    ledger.fallido("24h", 7)
+    ledger.enviado("24h", 8)
+    assert ledger.reservar("24h", [7, 8]) == {"7"}
+    # fallido() no borra un envío ya confirmado
+    ledger.fallido("24h", 8)
+    assert ledger.reservar("24h", [8]) == set()
+
+
+def test_reserva_vencida_se_retoma(ledger, monkeypatch):
+    ledger.reservar("24h", [5, 6])
+    ledger.enviado("24h", 6)
+    monkeypatch.setattr(ledger_recordatorios, "LEDGER_RESERVA_SEG", -60)
+    # La reserva de 5 quedó de una corrida que murió; 6 ya salió
+    assert ledger.reservar("24h", [5, 6]) == {"5"}
+
+
+def test_corridas_concurrentes_no_duplican(tmp_path):
+    ruta = str(tmp_path / "recordatorios.db")
+    LedgerSQLite(ruta)
+    ids = list(range(200))
+    reservas = []
+
+    def corrida():
+        reservas.append(LedgerSQLite(ruta).reservar("24h", ids))
+
+    hilos = [threading.Thread(target=corrida) for _ in range(4)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert sum(len(r) for r in reservas) == len(ids)
+    assert set().union(*reservas) == {str(i) for i in ids}
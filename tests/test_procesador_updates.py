@@ -0,0 +1,92 @@
+import time
+import asyncio
+
+from telegram import Update
+
+from procesador_updates import ProcesadorPorUsuario
+
+
+def update(update_id: int, user_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": "hola",
+        },
+    }, None)
+
+
+def test_mismo_usuario_en_orden_y_sin_solaparse():
+    eventos = []
+
+    async def handler(n, espera):
+        eventos.append(("inicio", n))
+        await asyncio.sleep(espera)
+        eventos.append(("fin", n))
+
+    async def principal():
+        proc = ProcesadorPorUsuario(8)
+        # El primero tarda más: sin el turno por usuario el segundo terminaría antes
+        await asyncio.gather(*(
+            proc.process_update(update(n, 1), handler(n, espera))
+            for n, espera in enumerate([0.05, 0.01, 0.0])
+        ))
+        return proc
+
+    proc = asyncio.run(principal())
+    assert eventos == [(e, n) for n in range(3) for e in ("inicio", "fin")]
+    assert proc.usuarios_activos() == 0 and proc.en_cola() == 0
+
+
+def test_usuarios_distintos_en_paralelo():
+    async def principal():
+        proc = ProcesadorPorUsuario(8)
+        inicio = time.perf_counter()
+        await asyncio.gather(*(
+            proc.process_update(update(uid, uid), asyncio.sleep(0.1)) for uid in range(5)
+        ))
+        return time.perf_counter() - inicio
+
+    assert asyncio.run(principal()) < 0.3
+
+
+def test_rafaga_de_un_usuario_no_ocupa_huecos():
+    terminados = []
+
+    async def handler(nombre, espera):
+        await asyncio.sleep(espera)
+        terminados.append(nombre)
+
+    async def principal():
+        proc = ProcesadorPorUsuario(2)
+        rafaga = [
+            asyncio.create_task(proc.process_update(update(n, 1), handler(f"a{n}", 0.05)))
+            for n in range(6)
+        ]
+        await asyncio.sleep(0)
+        assert proc.usuarios_activos() == 1 and proc.en_cola() == 6
+        await proc.process_update(update(100, 2), handler("b", 0.0))
+        await asyncio.gather(*rafaga)
+
+    asyncio.run(principal())
+    # b no esperó a la ráfaga de a: entró en el hueco libre
+    assert terminados.index("b") <= 1
+    assert [t for t in terminados if t != "b"] == [f"a{n}" for n in range(6)]
+
+
+def test_updates_sin_usuario_pasan_directo():
+    async def principal():
+        proc = ProcesadorPorUsuario(2)
+        hecho = []
+
+        async def handler():
+            hecho.append(True)
+
+        await proc.process_update(object(), handler())
+        return proc, hecho
+
+    proc, hecho = asyncio.run(principal())
+    assert hecho == [True] and proc.usuarios_activos() == 0